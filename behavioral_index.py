@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+behavioral_index.py
+
+Index and validation of the behavioral / examcard resources of XNAT subjects.
+
+The resources of a subject (<SUBJ>/<folder>/resources/...) are walked once
+with scandir (or read from the index of a zip / tar download), and every
+behavioral file is validated with a few small reads instead of being accepted
+on its name:
+    - .wav: RIFF/WAVE chunk headers from the first WAV_HEADER_BYTES; the
+      duration is the data chunk size over the byte rate. A file shorter than
+      its data chunk is truncated; a recording shorter than MIN_WAV_SECONDS
+      (an empty file included) does not count.
+    - export.txt: line count from READ_SIZE blocks; fewer than
+      MIN_EXPORT_LINES lines (header + one trial) does not count.
+
+Per-subject status, as used for the missing report:
+    VFT       a valid .wav and a valid export.txt in Behavioral%20data-VFT/VFT
+    TRENDS    a valid export.txt in Behavioral%20data-TRENDS/TRENDS
+    EXAMCARD  an Examcards folder
+
+check_dicom_completeness.py takes the status from here while listing each
+subject on its pool; run this module on its own for the per-file report.
+
+Usage:
+    status, details = resource_status(['/data/SUBJ0001/Behavioral/resources'])
+    python behavioral_index.py <root> --out behavioral_files.csv
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+from struct import unpack_from
+
+from dicom_archive import archive_path, archive_stem, open_file
+from run_metrics import count
+from worker_pool import default_workers
+
+# Resource folders (relative to <folder>/resources) of each status flag
+RESOURCE_FOLDERS = {
+    'VFT': 'Behavioral%20data-VFT/VFT',
+    'TRENDS': 'Behavioral%20data-TRENDS/TRENDS',
+    'EXAMCARD': 'Examcards',
+}
+
+# Validation thresholds
+MIN_WAV_SECONDS = 1.0
+MIN_EXPORT_LINES = 2
+
+# Bytes read for the WAV chunk headers, and block size of the line count
+WAV_HEADER_BYTES = 4096
+READ_SIZE = 1 << 16
+
+# Worker pool of the standalone index
+N_WORKERS = default_workers()
+POOL_KIND = 'thread'
+
+# Columns of the per-file report
+DETAIL_COLUMNS = ['SUBJ', 'Resource', 'File', 'Size', 'Duration_s', 'Lines', 'Valid', 'Problem']
+
+# ------------------------------- Validation ---------------------------------- #
+
+
+def wav_duration(path, size):
+    """
+    Duration of a WAV file from its chunk headers.
+
+    Returns:
+        (seconds or None, problem or None)
+    """
+    if size == 0:
+        return None, 'empty'
+    with open_file(path) as f:
+        header = f.read(WAV_HEADER_BYTES)
+    count('files_opened')
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None, 'not a WAV file'
+
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= len(header):
+        chunk, length = header[pos:pos + 4], unpack_from('<I', header, pos + 4)[0]
+        if chunk == b'fmt ' and pos + 20 <= len(header):
+            byte_rate = unpack_from('<I', header, pos + 16)[0]
+        elif chunk == b'data':
+            if not byte_rate:
+                return None, 'no fmt chunk before the data'
+            available = size - (pos + 8)
+            seconds = min(length, available) / byte_rate
+            if available < length:
+                return seconds, 'truncated: %d of %d data bytes' % (available, length)
+            return seconds, None
+        pos += 8 + length + (length & 1)
+    return None, 'no data chunk in the first %d bytes' % WAV_HEADER_BYTES
+
+
+def count_lines(path, size):
+    """Number of lines of a text file (a last line without newline counts)."""
+    if size == 0:
+        return 0
+    lines = 0
+    last = b'\n'
+    with open_file(path) as f:
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    count('files_opened')
+    return lines + (last != b'\n')
+
+
+def validate_file(path, name, size):
+    """Validation of one behavioral file: dict with 'Duration_s', 'Lines', 'Valid', 'Problem'."""
+    result = {'Duration_s': None, 'Lines': None, 'Problem': None}
+    lower = name.lower()
+    if lower.endswith('.wav'):
+        seconds, problem = wav_duration(path, size)
+        if seconds is not None:
+            result['Duration_s'] = round(seconds, 2)
+            if problem is None and seconds < MIN_WAV_SECONDS:
+                problem = 'shorter than %gs' % MIN_WAV_SECONDS
+        result['Problem'] = problem
+    elif 'export.txt' in lower:
+        result['Lines'] = count_lines(path, size)
+        if result['Lines'] < MIN_EXPORT_LINES:
+            result['Problem'] = 'fewer than %d lines' % MIN_EXPORT_LINES
+    else:
+        return None
+    result['Valid'] = int(result['Problem'] is None)
+    return result
+
+# --------------------------------- Index ------------------------------------- #
+
+
+def walk_resources(resources_dir):
+    """
+    Every folder under a resources folder, in one pass.
+
+    Returns:
+        {folder relative to resources_dir ('' for itself): {file name: size}},
+        empty if resources_dir does not exist.
+    """
+    archive = archive_path(resources_dir)[0]
+    folders = {}
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        path = os.path.join(resources_dir, relative) if relative else resources_dir
+        files = folders[relative] = {}
+        if archive is not None:
+            if not archive.isdir(path):
+                return {}
+            files.update(archive.file_sizes(path))
+            stack.extend(os.path.join(relative, name) for name in archive.listdir(path) if name not in files)
+            continue
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            return {}
+        count('dirs_listed')
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(os.path.join(relative, entry.name))
+                elif entry.is_file():
+                    files[entry.name] = entry.stat().st_size
+    return folders
+
+
+def resource_status(resources_dirs):
+    """
+    Status flags of a subject from its resources folders (one per alphabetic
+    subject folder; a flag is set if any of them qualifies).
+
+    Returns:
+        (status {flag: 0/1}, details: list of dicts (DETAIL_COLUMNS without SUBJ))
+    """
+    status = dict.fromkeys(RESOURCE_FOLDERS, 0)
+    details = []
+    folder_flags = {os.path.normpath(folder): flag for flag, folder in RESOURCE_FOLDERS.items()}
+    for resources_dir in resources_dirs:
+        for relative, files in walk_resources(resources_dir).items():
+            flag = folder_flags.get(os.path.normpath(relative)) if relative else None
+            if flag is None:
+                continue
+            if flag == 'EXAMCARD':
+                status[flag] = 1
+                continue
+
+            valid = {'wav': False, 'export': False}
+            for name in sorted(files):
+                path = os.path.join(resources_dir, relative, name)
+                result = validate_file(path, name, files[name])
+                if result is None:
+                    continue
+                details.append(dict(result, Resource=flag, File=os.path.join(relative, name), Size=files[name]))
+                if result['Valid']:
+                    valid['wav' if result['Lines'] is None else 'export'] = True
+            if valid['export'] and (valid['wav'] or flag != 'VFT'):
+                status[flag] = 1
+    return status, details
+
+
+def index_subject(root, subj):
+    """(subject, status, details) of one subject folder or archive under root."""
+    subj_path = os.path.join(root, subj)
+    archive = archive_path(subj_path)[0]
+    if archive is not None:
+        names = [name for name in archive.listdir(subj_path) if archive.isdir(os.path.join(subj_path, name))]
+    else:
+        count('dirs_listed')
+        with os.scandir(subj_path) as entries:
+            names = [entry.name for entry in entries if entry.is_dir()]
+    resources_dirs = [os.path.join(subj_path, name, 'resources') for name in sorted(names) if name[0].isalpha()]
+    status, details = resource_status(resources_dirs)
+    return archive_stem(subj) or subj, status, details
+
+
+if __name__ == '__main__':
+    import argparse
+    import csv
+    from functools import partial
+
+    from run_metrics import map_tasks
+    parser = argparse.ArgumentParser(description='Index and validate the behavioral resources of every subject')
+    parser.add_argument('root')
+    parser.add_argument('--out', default='behavioral_files.csv', help='per-file report')
+    parser.add_argument('--workers', type=int, default=N_WORKERS)
+    args = parser.parse_args()
+
+    # Subject folders, and archives not extracted next to them (as check_dicom_completeness.walk)
+    names = os.listdir(args.root)
+    folders = {s for s in names if os.path.isdir(os.path.join(args.root, s))}
+    subjects = sorted(folders | {s for s in names if archive_stem(s) and archive_stem(s) not in folders})
+    flags = dict.fromkeys(RESOURCE_FOLDERS, 0)
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, DETAIL_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for subj, status, details in map_tasks(partial(index_subject, args.root), subjects,
+                                               args.workers, POOL_KIND):
+            for flag in flags:
+                flags[flag] += status[flag]
+            writer.writerows(dict(detail, SUBJ=subj) for detail in details)
+    print("[✓] Behavioral index saved: %s (%d subjects, %s)"
+          % (args.out, len(subjects), ', '.join('%s %d' % item for item in flags.items())))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+
+Benchmark of the checker stages on synthetic trees (see synthetic_tree.py).
+
+For every tree size in SIZES (subjects / sessions with the real expected file
+counts, times SCALE) the trees are generated once under BENCH_DIR, then each
+stage is timed in a fresh process:
+
+- scan:              check_dicom_completeness walk -> extract -> classify -> CSV
+                     over the XNAT tree (scan cache off)
+- analysis:          completeness column and missing report of the scanned inventory
+- ge_walk:           folder walk of every GE session, one header per series
+                     (check_dicom.py / DICOM_checker.py with use_dirfile off)
+- dirfile:           DIRFILE inventory and first header of every GE session
+                     (the same checkers with use_dirfile on), to compare with ge_walk
+- header_correction: dicom_header_correction.correct_session over the GE tree
+                     (header_only, one tag changed)
+
+Reported per stage: wall time, files/s (DICOM files covered by the stage) and
+peak RSS of the stage process (and of its worker processes with POOL_KIND
+'process'). Trees are read from the page cache after generation, so the scan
+figures are warm-cache figures.
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import csv
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import synthetic_tree
+
+# ----------------------------- Configuration -------------------------------- #
+
+# Working directory for the synthetic trees and stage outputs
+BENCH_DIR = '/tmp/dicom_benchmark'
+
+# Tree sizes (subjects for the XNAT tree, sessions for the GE tree) and the
+# fraction of the expected file counts written per series
+SIZES = [1, 2, 4]
+SCALE = 1.0
+
+# Pool used by the stages
+N_WORKERS = os.cpu_count() or 1
+POOL_KIND = 'thread'
+
+# Stages to run, in order
+STAGES = ['scan', 'analysis', 'ge_walk', 'dirfile', 'header_correction']
+
+# Results table (None = print only) and whether the trees are removed afterwards
+RESULTS_CSV = os.path.join(BENCH_DIR, 'benchmark.csv')
+KEEP_TREES = False
+
+RESULT_COLUMNS = ['size', 'stage', 'files', 'seconds', 'files_per_s', 'peak_rss_mb']
+
+# --------------------------------- Stages ------------------------------------ #
+
+
+def stage_scan(work_dir):
+    """XNAT scan pipeline into work_dir/modified.csv; returns the number of files covered."""
+    import check_dicom_completeness as checker
+    from csv_stream import stream_csv
+
+    behavioral_status = {}
+    rows = checker.classify(checker.extract(checker.walk(os.path.join(work_dir, 'xnat'), behavioral_status,
+                                                         N_WORKERS, POOL_KIND),
+                                            None, N_WORKERS, POOL_KIND))
+    return sum(row['N_files'] for row in stream_csv(rows, os.path.join(work_dir, 'modified.csv'),
+                                                    checker.MODIFIED_COLUMNS))
+
+
+def stage_analysis(work_dir):
+    """Completeness column and missing report of the scanned inventory."""
+    import pandas as pd
+    import check_dicom_completeness as checker
+    from completeness import mark_complete, missing_report
+
+    data = pd.read_csv(os.path.join(work_dir, 'modified.csv'))
+    data['Sequence_name_clean'] = data['Sequence_name'].str.replace(checker.WIP_PREFIX, '', regex=True).str.lower()
+    data['N_files_Complete'] = mark_complete(data, checker.EXPECTED_FILES)
+    missing_report(data, checker.EXPECTED_FILES).to_csv(os.path.join(work_dir, 'missing.csv'), index=False)
+    return int(data['N_files'].sum())
+
+
+def stage_ge_walk(work_dir):
+    """Folder walk and first header of every series of every GE session."""
+    from dicom_header_reader import read_header
+
+    root = os.path.join(work_dir, 'ge')
+    n_files = 0
+    for session in sorted(os.listdir(root)):
+        session_path = os.path.join(root, session)
+        for seq in os.listdir(session_path):
+            seq_path = os.path.join(session_path, seq)
+            if 'S0' in seq or seq == 'DIRFILE' or not os.path.isdir(seq_path):
+                continue
+            files = os.listdir(seq_path)
+            i_files = [name for name in files if name.startswith('I')]
+            if i_files:
+                read_header(os.path.join(seq_path, i_files[0]))
+                n_files += len(files)
+    return n_files
+
+
+def stage_dirfile(work_dir):
+    """DIRFILE inventory and first header of every GE session."""
+    from dicom_header_reader import read_header
+    from dicomdir_inventory import first_image, session_inventory
+
+    root = os.path.join(work_dir, 'ge')
+    n_files = 0
+    for session in sorted(os.listdir(root)):
+        session_path = os.path.join(root, session)
+        inventory = session_inventory(session_path, skip=lambda name: 'S0' in name)
+        read_header(first_image(session_path, inventory))
+        n_files += sum(entry['n_images'] for entry in inventory.values())
+    return n_files
+
+
+def stage_header_correction(work_dir):
+    """Header-only correction of every file of the GE tree (journal in work_dir)."""
+    from dicom_header_correction import correct_session, list_dicom_files
+
+    root = os.path.join(work_dir, 'ge')
+    journal_file = os.path.join(work_dir, 'header_correction.journal')
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
+    dicom_paths = [path for session in sorted(os.listdir(root))
+                   for path in list_dicom_files(os.path.join(root, session))]
+    failures = correct_session(dicom_paths, {'StudyComments': '102'}, journal_file,
+                               header_only=True, workers=N_WORKERS, pool_kind=POOL_KIND)
+    return len(dicom_paths) - len(failures)
+
+
+STAGE_FUNCTIONS = {
+    'scan': stage_scan,
+    'analysis': stage_analysis,
+    'ge_walk': stage_ge_walk,
+    'dirfile': stage_dirfile,
+    'header_correction': stage_header_correction,
+}
+
+# -------------------------------- Harness ------------------------------------ #
+
+
+def run_stage(stage, work_dir):
+    """
+    Runs one stage (in the benchmark's child process).
+
+    Returns:
+        (files, seconds, peak RSS in MB of this process and of its children)
+    """
+    start = time.perf_counter()
+    n_files = STAGE_FUNCTIONS[stage](work_dir)
+    seconds = time.perf_counter() - start
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return n_files, seconds, peak_kb / 1024
+
+
+def timed_stage(stage, work_dir):
+    """Runs a stage in a fresh (spawned) process so its peak RSS is its own."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stage, stage, work_dir).result()
+
+
+def make_trees(work_dir, size):
+    """Generates the XNAT and GE trees of one size (kept if already there)."""
+    for layout, make in (('xnat', synthetic_tree.make_xnat_tree), ('ge', synthetic_tree.make_ge_tree)):
+        root = os.path.join(work_dir, layout)
+        if os.path.isdir(root):
+            continue
+        start = time.perf_counter()
+        n_files = make(root, size, SCALE)
+        print("Generated %s tree: %d files in %.1fs" % (layout, n_files, time.perf_counter() - start))
+
+
+def main():
+    results = []
+    for size in SIZES:
+        work_dir = os.path.join(BENCH_DIR, 'size_%d' % size)
+        make_trees(work_dir, size)
+        for stage in STAGES:
+            n_files, seconds, peak_rss = timed_stage(stage, work_dir)
+            results.append(dict(zip(RESULT_COLUMNS, [size, stage, n_files, round(seconds, 3),
+                                                     round(n_files / seconds if seconds else 0, 1),
+                                                     round(peak_rss, 1)])))
+            print("[✓] size %d %-17s %8d files %8.2fs %10.1f files/s %8.1f MB peak RSS"
+                  % (size, stage, n_files, seconds, n_files / seconds if seconds else 0, peak_rss))
+        if not KEEP_TREES:
+            shutil.rmtree(work_dir)
+
+    if RESULTS_CSV:
+        os.makedirs(os.path.dirname(RESULTS_CSV), exist_ok=True)
+        with open(RESULTS_CSV, 'w', newline='') as f:
+            writer = csv.DictWriter(f, RESULT_COLUMNS, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"[✓] Benchmark results saved: {RESULTS_CSV}")
+
+
+if __name__ == '__main__':
+    main()
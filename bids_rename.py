@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+bids_rename.py
+
+In-process BIDS renaming of one converted session.
+
+Doing the renaming with rename/sed/mv spawns a process per file and rescans the
+session folder for every glob. Here the folder is listed once and every dcm2niix output
+goes through the same steps in memory, giving a plan of (source, destination,
+sidecar edits):
+    1. 'WIP_' stripped from the name,
+    2. run suffix: a trailing a/b/c/d before the extension -> run-02..05,
+       otherwise run-01, with the sub-<ADBS_ID>_ses-<ASSESSMENT_ID> prefix,
+    3. protocol renames (fieldmap_e1 -> magnitude1, DKI -> acq-80dir_dwi, ...),
+       first occurrence only, in order,
+    4. acq/dir/task before run (e.g. _run-01_acq-rest_dir-AP_epi -> _acq-rest_dir-AP_run-01_epi),
+    5. PhaseEncodingDirection inserted after "PhaseEncodingAxis": "j" in the
+       rest bold, AP/PA epi and dwi JSON sidecars,
+    6. datatype folder (survey/func/anat/dwi/fmap), first matching pattern wins.
+The plan is checked for name collisions, then applied: edited sidecars are
+written straight to their destination, every other file is renamed.
+
+Usage:
+    python bids_rename.py <session_dir> <ADBS_ID> <ASSESSMENT_ID> [--dry-run]
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import argparse
+import os
+import re
+from fnmatch import fnmatchcase
+
+# Run suffixes: trailing letter before the extension -> run number
+RUN_SUFFIXES = [
+    (re.compile(r'a\.[^.]*$'), 'a', '02'),
+    (re.compile(r'b\.[^.]*$'), 'b', '03'),
+    (re.compile(r'c\.[^.]*$'), 'c', '04'),
+    (re.compile(r'[^ld]d\.[^.]*$'), 'd', '05'),
+]
+
+# Protocol name -> BIDS entities (applied in order, first occurrence only)
+PROTOCOL_RENAMES = [
+    ('fieldmap_e1_ph', 'phase1'),
+    ('T1w_PSIR', 'acq-psirc_PSIR'),
+    ('fieldmap_e2_ph', 'phase2'),
+    ('fieldmap_e1', 'magnitude1'),
+    ('fieldmap_e2', 'magnitude2'),
+    ('AP', 'dir-AP_epi'),
+    ('PA', 'dir-PA_epi'),
+    ('Ref_rest', 'acq-rest'),
+    ('Ref_DWI', 'acq-dwi'),
+    ('DKI', 'acq-80dir_dwi'),
+    ('DTI_6dir', 'acq-06dir_dwi'),
+    ('Ref_TRENDS', 'acq-trends'),
+    ('Ref_VFT', 'acq-vft'),
+]
+
+# Entity reorders: (file patterns, regex, replacement)
+REORDERS = [
+    (('*epi.json', '*epi.nii'),
+     re.compile(r'_run-([0-9]+)_acq-([a-zA-Z]+)_dir-([a-zA-Z]+)_epi'), r'_acq-\2_dir-\3_run-\1_epi'),
+    (('*dwi.*',),
+     re.compile(r'_run-([0-9]+)_acq-([0-9]+dir)_dwi'), r'_acq-\2_run-\1_dwi'),
+    (('*bold.nii', '*bold.json'),
+     re.compile(r'_run-([0-9]+)_task-([a-zA-Z]+)_bold'), r'_task-\2_run-\1_bold'),
+    (('*PSIR.nii', '*PSIR.json'),
+     re.compile(r'_run-([0-9]+)_acq-([a-zA-Z]+)_PSIR'), r'_acq-\2_run-\1_PSIR'),
+]
+
+# Sidecar pattern -> PhaseEncodingDirection inserted after "PhaseEncodingAxis": "j",
+PHASE_ENCODING_EDITS = [
+    ('*task-rest_bold*.json', 'j'),
+    ('*dir-AP_epi*.json', 'j-'),
+    ('*dir-PA_epi*.json', 'j'),
+    ('*dwi*.json', 'j'),
+]
+PHASE_ENCODING_AXIS = '"PhaseEncodingAxis": "j",'
+
+# Name pattern -> datatype folder (first match wins)
+DATATYPE_FOLDERS = [
+    ('*Survey*', 'survey'),
+    ('*task*', 'func'),
+    ('*T1*', 'anat'),
+    ('*T2*', 'anat'),
+    ('*FLAIR*', 'anat'),
+    ('*06dir*', 'dwi'),
+    ('*80dir*', 'dwi'),
+    ('*_dir-*', 'fmap'),
+    ('*magnitude*', 'fmap'),
+    ('*phase*', 'fmap'),
+    ('*PSIR*', 'anat'),
+]
+FOLDERS = ['fmap', 'dwi', 'func', 'anat', 'survey']
+
+
+def bids_name(name, adbs_id, assessment_id):
+    """Final BIDS file name of one dcm2niix output (steps 1-4)."""
+    name = name.replace('WIP_', '')
+
+    if '.' in name:
+        prefix = 'sub-%s_ses-%s' % (adbs_id, assessment_id)
+        for pattern, suffix, run in RUN_SUFFIXES:
+            if pattern.search(name):
+                base, extension = name.rsplit('.', 1)
+                if base.endswith(suffix):
+                    base = base[:-1]
+                name = '%s_run-%s_%s.%s' % (prefix, run, base, extension)
+                break
+        else:
+            name = '%s_run-01_%s' % (prefix, name)
+
+    for old, new in PROTOCOL_RENAMES:
+        name = name.replace(old, new, 1)
+
+    for patterns, regex, replacement in REORDERS:
+        if any(fnmatchcase(name, p) for p in patterns):
+            name = regex.sub(replacement, name, count=1)
+    return name
+
+
+def phase_encoding_edits(name):
+    """PhaseEncodingDirection values to insert in a sidecar, in the order they are applied."""
+    return [direction for pattern, direction in PHASE_ENCODING_EDITS if fnmatchcase(name, pattern)]
+
+
+def datatype_folder(name):
+    """Datatype folder of a BIDS file name, or None if it stays in the session folder."""
+    for pattern, folder in DATATYPE_FOLDERS:
+        if fnmatchcase(name, pattern):
+            return folder
+    return None
+
+
+def patch_sidecar(text, directions):
+    """
+    Inserts a PhaseEncodingDirection line after every PhaseEncodingAxis "j" line,
+    once per direction, keeping the rest of the dcm2niix formatting as it is.
+    """
+    lines = text.split('\n')
+    for direction in directions:
+        patched = []
+        for line in lines:
+            patched.append(line)
+            if PHASE_ENCODING_AXIS in line:
+                patched.append('\t"PhaseEncodingDirection": "%s",' % direction)
+        lines = patched
+    return '\n'.join(lines)
+
+
+def plan_session(session_dir, adbs_id, assessment_id):
+    """
+    Plans the renaming of every (non-hidden) file in session_dir.
+
+    Returns:
+        list of (source name, destination relative path, PhaseEncodingDirection edits)
+
+    Raises:
+        ValueError: if two files would end up with the same destination.
+    """
+    plan = []
+    for entry in sorted(os.scandir(session_dir), key=lambda e: e.name):
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        name = bids_name(entry.name, adbs_id, assessment_id)
+        folder = datatype_folder(name)
+        destination = os.path.join(folder, name) if folder else name
+        edits = phase_encoding_edits(name) if name.endswith('.json') else []
+        plan.append((entry.name, destination, edits))
+
+    destinations = {}
+    for source, destination, _ in plan:
+        if destination in destinations:
+            raise ValueError("%s and %s would both be renamed to %s"
+                             % (destinations[destination], source, destination))
+        destinations[destination] = source
+    return plan
+
+
+def apply_plan(session_dir, plan):
+    """Creates the datatype folders, writes the patched sidecars and renames the files."""
+    for folder in FOLDERS:
+        os.makedirs(os.path.join(session_dir, folder), exist_ok=True)
+
+    for source, destination, edits in plan:
+        source_path = os.path.join(session_dir, source)
+        destination_path = os.path.join(session_dir, destination)
+        if edits:
+            with open(source_path, newline='') as f:
+                text = f.read()
+            tmp_path = destination_path + '.tmp'
+            with open(tmp_path, 'w', newline='') as f:
+                f.write(patch_sidecar(text, edits))
+            os.replace(tmp_path, destination_path)
+            os.remove(source_path)
+        elif source_path != destination_path:
+            os.replace(source_path, destination_path)
+
+
+def rename_session(session_dir, adbs_id, assessment_id, dry_run=False):
+    """
+    Renames one converted session to BIDS.
+
+    Parameters:
+        session_dir (str): dcm2niix output folder of the session (converted with -f "%p").
+        adbs_id (str): ADBS_ID of the subject.
+        assessment_id (str): ASSESSMENT_ID of the session.
+        dry_run (bool): Print the plan without touching the files.
+
+    Returns:
+        list: the plan (see plan_session).
+    """
+    plan = plan_session(session_dir, adbs_id, assessment_id)
+    if dry_run:
+        for source, destination, edits in plan:
+            note = '  [PhaseEncodingDirection %s]' % ', '.join(edits) if edits else ''
+            print('%s -> %s%s' % (source, destination, note))
+    else:
+        apply_plan(session_dir, plan)
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BIDS renaming of one dcm2niix-converted session')
+    parser.add_argument('session_dir')
+    parser.add_argument('ADBS_ID')
+    parser.add_argument('ASSESSMENT_ID')
+    parser.add_argument('--dry-run', action='store_true', help='print the plan only')
+    args = parser.parse_args()
+    rename_session(args.session_dir, args.ADBS_ID, args.ASSESSMENT_ID, args.dry_run)
@@ -1,61 +1,31 @@
 #updated check_dicom.py to account for WIP_sequencies
 # Import necessary libraries
-from pydicom import dcmread as dr
+from columnar_output import stream_columnar, write_columnar
+from completeness import SubjectSummary, complete_flag, missing_report
+from csv_stream import stream_csv
+from dicom_header_reader import read_header_fields
+from run_metrics import RunMetrics, add_time, count, profiled, record, stage, timed
+from scan_cache import ScanCache, dir_mtime
+from subject_mapping import fill_ids, load_mapping
 import os
-import pandas as pd
-from collections import defaultdict
+import re
+import time
 
 # Define the path to the directory containing the DICOM files
 path = '/path/to/your/scan'
 
-# Initialize a list to store final information
-final_info = []
-
-# Loop through each subject
-for subj in os.listdir(path):
-    subj_path = os.path.join(path, subj)
-    if os.path.isdir(subj_path):
-        for seq in os.listdir(subj_path):
-            seq_path = os.path.join(subj_path, seq)
-            if os.path.isdir(seq_path) and 'S0' not in seq and seq != 'DIRFILE':
-
-                all_files = os.listdir(seq_path)
-                dcm_files = [file for file in all_files if file.endswith('.dcm')]
-
-                if dcm_files:
-                    dcm_file_path = os.path.join(seq_path, dcm_files[0])
-                    print('Trying to read DICOM file:', dcm_file_path)
-                    try:
-                        data = dr(dcm_file_path, force=True)
-                        data_info = [
-                            subj,
-                            getattr(data, 'AccessionNumber', None),
-                            getattr(data, 'PatientName', None),
-                            getattr(data, 'StudyDescription', None),
-                            getattr(data, 'StudyComments', None),
-                            seq,
-                            getattr(data, 'ProtocolName', None),
-                            len(all_files),
-                            getattr(data, 'PerformedProcedureStepStartDate', None)
-                        ]
-                        final_info.append(data_info)
-                    except IOError:
-                        print('Failed to read DICOM file:', dcm_file_path)
-                else:
-                    print('No .dcm file found in {}. Skipping...'.format(seq_path))
-
-# Convert the collected information into a DataFrame
-data = pd.DataFrame(final_info, columns=[
-    'SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID',
-    'Seq', 'Sequence_name', 'N_files', 'DATE'
-])
-
-# Filter out rows where Seq is 'secondary'
-data = data[data['Seq'].str.lower() != 'secondary'].reset_index(drop=True)
+# Scan cache: series folders unchanged since the last run are not re-read.
+# Set cache_file to None to disable it, force_rescan = True to re-read everything.
+cache_file = '/scan_cache.sqlite'
+force_rescan = False
 
+# Optional subject table (ANC number, ADBS_ID, ASSESSMENT_ID) used to fill blank
+# ADBS_ID / Assesment_ID values by AccessionNumber; None disables it
+subject_table = None
 
-# Create a cleaned version of Sequence_name for comparison only
-data['Sequence_name_clean'] = data['Sequence_name'].str.replace(r'^WIP\s+', '', regex=True).str.lower()
+# Header fields kept for each series
+row_tags = ['AccessionNumber', 'PatientName', 'StudyDescription', 'StudyComments',
+            'ProtocolName', 'PerformedProcedureStepStartDate']
 
 # Dictionary to store expected number of files for each sequence (keys must be lowercase)
 expected_files = {
@@ -79,57 +49,140 @@ expected_files = {
     'task-vft_bold': 4752
 }
 
-# Function to check if N_files is complete using cleaned name
-def is_complete(row):
-    sequence = row['Sequence_name_clean']
-    if sequence in expected_files:
-        expected_count = expected_files[sequence]
-        return 1 if row['N_files'] >= expected_count else 0
-    else:
-        return -1  # Indicate unknown sequence
-
-# Add completeness column
-data['N_files_Complete'] = data.apply(is_complete, axis=1)
-
-# Export modified data with original sequence names
+# Output files
 modified_data_file = '/modified_test.csv'
-data.drop(columns=['Sequence_name_clean']).to_csv(modified_data_file, index=False)
+missing_sequences_file = '/missing_test.csv'
+
+# Typed columnar copies of the modified / missing data for dashboards
+# (.parquet or .arrow, see columnar_output.py; needs pyarrow); None skips them
+modified_columnar_file = None
+missing_columnar_file = None
+
+# Run metrics (stage times, directories listed, files opened, bytes read, slowest
+# subjects/series) as JSON and as a Prometheus textfile; None skips either file
+metrics_json = '/run_metrics.json'
+metrics_prom = None
+
+# Dump cProfile stats of the scan loop to this file (None = no profiling)
+profile_file = None
+
+# Columns of the modified data (rows are written as soon as each series is read)
+columns = ['SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID',
+           'Seq', 'Sequence_name', 'N_files', 'DATE']
+
+
+def scan_series(cache):
+    """Walk and extract stages: yields the row of every readable series."""
+    # Loop through each subject
+    count('dirs_listed')
+    for subj in os.listdir(path):
+        subj_path = os.path.join(path, subj)
+        if os.path.isdir(subj_path):
+            count('dirs_listed')
+            for seq in os.listdir(subj_path):
+                seq_path = os.path.join(subj_path, seq)
+                if os.path.isdir(seq_path) and 'S0' not in seq and seq != 'DIRFILE':
+
+                    # Reuse the cached result if the folder has not changed
+                    mtime = dir_mtime(seq_path)
+                    cached = cache.get(seq_path, mtime) if cache else None
+                    if cached is not None:
+                        n_files, fields = cached
+                    else:
+                        start = time.perf_counter()
+                        all_files = os.listdir(seq_path)
+                        count('dirs_listed')
+                        dcm_files = [file for file in all_files if file.endswith('.dcm')]
+                        n_files, fields = len(all_files), None
+
+                        if dcm_files:
+                            dcm_file_path = os.path.join(seq_path, dcm_files[0])
+                            print('Trying to read DICOM file:', dcm_file_path)
+                            count('files_opened')
+                            try:
+                                fields = read_header_fields(dcm_file_path, row_tags)
+                            except IOError:
+                                print('Failed to read DICOM file:', dcm_file_path)
+                                continue
+                        else:
+                            print('No .dcm file found in {}. Skipping...'.format(seq_path))
+                        if cache:
+                            cache.put(seq_path, mtime, n_files, fields)
+                        elapsed = time.perf_counter() - start
+                        record('series', seq_path, elapsed)
+                        add_time('subject', subj, elapsed)
+
+                    if fields is not None:
+                        yield dict(zip(columns, [
+                            subj,
+                            fields['AccessionNumber'],
+                            fields['PatientName'],
+                            fields['StudyDescription'],
+                            fields['StudyComments'],
+                            seq,
+                            fields['ProtocolName'],
+                            n_files,
+                            fields['PerformedProcedureStepStartDate']
+                        ]))
+
+
+def classify(rows, mapping):
+    """Classify stage: IDs from the subject table, secondary filter, completeness."""
+    for row in rows:
+        # Fill ADBS_ID / Assesment_ID missing from the headers using the subject table
+        if mapping:
+            fill_ids(row, mapping)
+
+        # Filter out rows where Seq is 'secondary'
+        if row['Seq'].lower() == 'secondary':
+            continue
+
+        # Create a cleaned version of Sequence_name for comparison only
+        name = row['Sequence_name']
+        row['Sequence_name_clean'] = re.sub(r'^WIP\s+', '', str(name)).lower() if name is not None else None
+
+        # Add completeness column (1 complete, 0 incomplete, -1 unknown sequence)
+        row['N_files_Complete'] = complete_flag(row['N_files'], expected_files.get(row['Sequence_name_clean']))
+        yield row
+
+
+def stream_modified(rows):
+    """Write stage: the modified data file, and its columnar copy if enabled."""
+    output_columns = columns + ['N_files_Complete']
+    rows = stream_csv(rows, modified_data_file, output_columns)
+    if modified_columnar_file:
+        rows = stream_columnar(rows, modified_columnar_file, output_columns)
+    return rows
+
+
+# Stream the rows to the modified data file, keeping only the per-subject
+# state needed for the missing sequences (best run of each sequence)
+metrics = RunMetrics('check_dicom02')
+summary = SubjectSummary(expected_files, agg='max')
+mapping = load_mapping(subject_table) if subject_table else None
+cache = ScanCache(cache_file, force_rescan) if cache_file else None
+try:
+    rows = timed(classify(timed(scan_series(cache), 'scan'), mapping), 'classify')
+    with profiled(profile_file):
+        for row in timed(stream_modified(rows), 'write_modified'):
+            summary.add(row)
+finally:
+    if cache:
+        cache.close()
 print('Modified data saved to %s' % modified_data_file)
+if modified_columnar_file:
+    print('Modified data saved to %s' % modified_columnar_file)
 
-# Group data by subject and check missing sequences
-missing_sequences = defaultdict(list)
-for subject, group in data.groupby('SUBJ'):
-    missing = []
-    group_clean = group.set_index('Sequence_name_clean')
-    for sequence_clean, expected_count in expected_files.items():
-        if sequence_clean not in group_clean.index:
-            missing.append(sequence_clean)
-        elif group_clean.loc[sequence_clean, 'N_files'].max() < expected_count:
-            missing.append(sequence_clean)
-    if missing:
-        missing_sequences[subject].extend(missing)
-    elif subject not in missing_sequences:
-        missing_sequences[subject].append('NIL')
-
-# Create missing sequence DataFrame using original names
-missing_data = []
-for subject, sequences in missing_sequences.items():
-    subject_data = data[data['SUBJ'] == subject]
-    missing_data.append([
-        subject,
-        subject_data['ANCID'].iloc[0],
-        subject_data['Name'].iloc[0],
-        subject_data['ADBS_ID'].iloc[0],
-        subject_data['Assesment_ID'].iloc[0],
-        subject_data['DATE'].iloc[0],
-        ','.join(sorted(set(sequences)))  # still in lowercase
-    ])
-
-missing_df = pd.DataFrame(missing_data, columns=[
-    'SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID', 'Date', 'Missing Sequences'
-])
-
-# Export missing sequences
-missing_sequences_file = '/missing_test.csv'
-missing_df.to_csv(missing_sequences_file, index=False)
+# Missing sequences per subject (absent, or best run below the expected count)
+with stage('missing_report'):
+    missing_df = missing_report(summary.frame(), expected_files, agg='max')
+
+    # Export missing sequences
+    missing_df.to_csv(missing_sequences_file, index=False)
+    if missing_columnar_file:
+        write_columnar(missing_df, missing_columnar_file)
 print('Missing sequences saved to %s' % missing_sequences_file)
+if missing_columnar_file:
+    print('Missing sequences saved to %s' % missing_columnar_file)
+
+metrics.finish(metrics_json, metrics_prom)
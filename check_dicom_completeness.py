@@ -6,18 +6,47 @@ This script parses DICOM data stored in a nested folder structure and verifies
 whether all required sequences are present and complete based on expected file counts.
 It also checks for the presence of associated behavioral data (VFT, TRENDS) and exam cards.
 
+Subjects and their series are scanned on a pool of N_WORKERS threads or processes;
+rows are produced in sorted subject/series order so the outputs are deterministic.
+Series unchanged since the previous run are taken from the scan cache (CACHE_FILE).
+Subjects may also be zip / tar downloads (<SUBJ>.zip next to the subject
+folders): they are read in place, without extraction (see dicom_archive.py).
+Each run records its stage times and I/O counters (see run_metrics.py).
+A scan can be split across processes or hosts (SHARD, see sharding.py): each
+shard writes partial results to SHARD_DIR and merge_shards.py builds the reports.
+
+The scan is a pipeline of generator stages (walk -> extract -> classify -> write):
+each series row is written to the modified CSV as soon as it is read, and only a
+small per-subject summary is kept for the missing report, so memory stays flat
+whatever the size of the tree and an interrupted run keeps the rows written so far.
+
 Outputs:
 - modified_test.csv: Metadata and sequence completeness info.
 - missing_test.csv: Per-subject missing sequences and behavioral data availability.
+- deep_validation_test.csv: Per-series gaps/duplicates/mixed series (DEEP_VALIDATION only).
+- run_metrics.json (and METRICS_PROM): Stage times, I/O counters, slowest subjects/series.
 
 Author: Deepankan
 Last Updated: 2025-08-04
 """
 
+import csv
 import os
-import pandas as pd
-from collections import defaultdict
-from pydicom import dcmread as dr
+import re
+from functools import partial
+from behavioral_index import resource_status
+from columnar_output import stream_columnar, write_columnar
+from completeness import SubjectSummary, complete_flag, missing_report
+from csv_stream import stream_csv
+from deep_validation import DEEP_COLUMNS, validate_series
+from dicom_archive import archive_path, archive_stem
+from dicom_header_reader import read_header_fields
+from run_metrics import RunMetrics, add_time, count, map_tasks, profiled, record, stage, timed
+from scan_cache import ScanCache, dir_mtime
+from sharding import in_shard, shard_files, write_status
+from size_check import SIZE_COLUMNS, SIZE_TAGS, check_sizes
+from subject_mapping import fill_ids, load_mapping
+from worker_pool import default_workers
 
 # ----------------------------- Configuration -------------------------------- #
 
@@ -28,6 +57,55 @@ ROOT_PATH = '/mnt/f/Deepankan/XNAT/Subject_data/adbs-20250729_135320'
 MODIFIED_CSV = '/mnt/f/Deepankan/XNAT/output/modified_test.csv'
 MISSING_CSV = '/mnt/f/Deepankan/XNAT/output/missing_test.csv'
 
+# Typed columnar copies of the modified / missing tables for dashboards
+# (.parquet or .arrow, see columnar_output.py; needs pyarrow). None skips them.
+MODIFIED_COLUMNAR = None
+MISSING_COLUMNAR = None
+
+# Parallel scan: number of workers (1 = sequential) and pool type.
+# 'thread' suits network/disk bound scans, 'process' uses separate interpreters.
+N_WORKERS = default_workers()
+POOL_KIND = 'thread'
+
+# Incremental scan cache: series whose directory mtime is unchanged since the
+# last run are not re-listed or re-read. None disables the cache; FORCE_RESCAN
+# re-reads everything and refreshes the cache.
+CACHE_FILE = '/mnt/f/Deepankan/XNAT/output/scan_cache.sqlite'
+FORCE_RESCAN = False
+
+# Deep validation (opt-in): read the header of every file of every series and
+# report InstanceNumber gaps, duplicates and mixed series per SeriesInstanceUID.
+# Use POOL_KIND = 'process' for the best files/second.
+DEEP_VALIDATION = False
+DEEP_CSV = '/mnt/f/Deepankan/XNAT/output/deep_validation_test.csv'
+
+# Size check (cheap, stat only): flag the files of every series whose size does
+# not fit the image geometry of its representative header (truncated copies).
+# Series taken from a cache written without the check are only checked for
+# empty / odd-sized files; set FORCE_RESCAN once after enabling it.
+SIZE_CHECK = False
+SIZE_CSV = '/mnt/f/Deepankan/XNAT/output/size_check_test.csv'
+
+# Sharded scan: 'i/n' scans only the subjects in hash shard i of n, 'first:last'
+# the subjects whose folder name is in that range (see sharding.py). A shard
+# writes its partial results to SHARD_DIR instead of MODIFIED_CSV / MISSING_CSV;
+# merge_shards.py combines them. None scans every subject (also: --shard).
+SHARD = None
+SHARD_DIR = '/mnt/f/Deepankan/XNAT/output/shards'
+
+# Optional subject table (ANC number, ADBS_ID, ASSESSMENT_ID): fills blank
+# ADBS_ID / Assesment_ID header values from the AccessionNumber. None disables it.
+SUBJECT_TABLE = None
+
+# Run metrics: time per stage, directories listed, files opened, bytes read and
+# the slowest subjects/series, saved as JSON and as a Prometheus textfile
+# (node_exporter textfile collector, *.prom). None skips either file.
+METRICS_JSON = '/mnt/f/Deepankan/XNAT/output/run_metrics.json'
+METRICS_PROM = None
+
+# Dump cProfile stats of the scan loop to this file (None = no profiling)
+PROFILE_FILE = None
+
 # Expected number of DICOM files per cleaned sequence name
 EXPECTED_FILES = {
     'dki': 4480,
@@ -54,127 +132,324 @@ EXPECTED_FILES = {
 
 # ---------------------------- Data Extraction ------------------------------- #
 
-final_info = []
-behavioral_status = {}
+# Header fields kept for each series, in output column order
+ROW_TAGS = ['AccessionNumber', 'PatientName', 'StudyDescription', 'StudyComments',
+            'ProtocolName', 'PerformedProcedureStepStartDate']
+
+
+def series_sort_key(name):
+    """Sort numeric series folders numerically, everything else by name after them."""
+    return (0, int(name), name) if name.isnumeric() else (1, 0, name)
+
+
+def list_subject(root, subj):
+    """
+    Walks one subject folder (or subject archive, named <SUBJ>.zip, .tar...).
+
+    Returns the subject name, the list of (subj, seq, dicom_dir, mtime_ns) series
+    to read and the behavioral/examcard status of the subject.
+    """
+    subj_path = os.path.join(root, subj)
+    series = []
+    resources_dirs = []
 
-for subj in os.listdir(ROOT_PATH):
-    subj_path = os.path.join(ROOT_PATH, subj)
-    if not os.path.isdir(subj_path):
-        continue
+    listdir, isdir, mtime = os.listdir, os.path.isdir, dir_mtime
+    if archive_stem(subj):
+        # Archive: listed from its index, series are as recent as the archive file
+        archive = archive_path(subj_path)[0]
+        subj = archive_stem(subj)
 
-    behavioral_status[subj] = {"VFT": 0, "TRENDS": 0, "EXAMCARD": 0}
+        def archive_mtime(path):
+            if not archive.isdir(path):
+                raise FileNotFoundError(path)
+            return archive.mtime_ns
 
-    for seq in os.listdir(subj_path):
+        listdir, isdir, mtime = archive.listdir, archive.isdir, archive_mtime
+
+    count('dirs_listed')
+    for seq in sorted(listdir(subj_path), key=series_sort_key):
         seq_path = os.path.join(subj_path, seq)
-        if not os.path.isdir(seq_path):
+        if not isdir(seq_path):
             continue
 
         # --- Numeric folders (DICOM) ---
         if seq.isnumeric():
             dicom_dir = os.path.join(seq_path, "DICOM")
-            if os.path.isdir(dicom_dir):
-                dcm_files = [f for f in os.listdir(dicom_dir) if f.endswith('.dcm')]
-                if dcm_files:
-                    dcm_path = os.path.join(dicom_dir, dcm_files[0])
-                    print(f"Reading: {dcm_path}")
-                    try:
-                        dcm_data = dr(dcm_path, force=True)
-                        final_info.append([
-                            subj,
-                            getattr(dcm_data, 'AccessionNumber', None),
-                            getattr(dcm_data, 'PatientName', None),
-                            getattr(dcm_data, 'StudyDescription', None),
-                            getattr(dcm_data, 'StudyComments', None),
-                            seq,
-                            getattr(dcm_data, 'ProtocolName', None),
-                            len(os.listdir(dicom_dir)),
-                            getattr(dcm_data, 'PerformedProcedureStepStartDate', None)
-                        ])
-                    except Exception as e:
-                        print(f"Error reading {dcm_path}: {e}")
-
-        # --- Behavioral/Examcard folders ---
-        elif seq[0].isalpha():
-            resources_dir = os.path.join(seq_path, "resources")
-            if not os.path.isdir(resources_dir):
+            try:
+                series.append((subj, seq, dicom_dir, mtime(dicom_dir)))
+            except OSError:
                 continue
 
-            vft_path = os.path.join(resources_dir, "Behavioral%20data-VFT", "VFT")
-            if os.path.isdir(vft_path):
-                vft_files = os.listdir(vft_path)
-                if any(f.lower().endswith(".wav") for f in vft_files) and any("export.txt" in f.lower() for f in vft_files):
-                    behavioral_status[subj]["VFT"] = 1
+        # --- Behavioral/Examcard folders (indexed and validated below) ---
+        elif seq[0].isalpha():
+            resources_dirs.append(os.path.join(seq_path, "resources"))
 
-            trends_path = os.path.join(resources_dir, "Behavioral%20data-TRENDS", "TRENDS")
-            if os.path.isdir(trends_path):
-                if any("export.txt" in f.lower() for f in os.listdir(trends_path)):
-                    behavioral_status[subj]["TRENDS"] = 1
+    status = resource_status(resources_dirs)[0]
+    return subj, series, status
 
-            examcard_path = os.path.join(resources_dir, "Examcards")
-            if os.path.isdir(examcard_path):
-                behavioral_status[subj]["EXAMCARD"] = 1
 
-# -------------------------- Data Cleaning & Check --------------------------- #
+def read_series(task):
+    """
+    Lists one series and reads the header of its representative DICOM file.
+
+    Returns (n_files, fields), with fields None if the series has no .dcm file,
+    or None if the file could not be read.
+    """
+    subj, seq, dicom_dir, _ = task
+    archive = archive_path(dicom_dir)[0]
+    all_files = sorted(archive.listdir(dicom_dir) if archive else os.listdir(dicom_dir))
+    count('dirs_listed')
+    dcm_files = [f for f in all_files if f.endswith('.dcm')]
+    if not dcm_files:
+        return len(all_files), None
+
+    # In an archive: the first .dcm member in archive order (read from memory for tar)
+    first = next(f for f in archive.files(dicom_dir) if f.endswith('.dcm')) if archive else dcm_files[0]
+    dcm_path = os.path.join(dicom_dir, first)
+    print(f"Reading: {dcm_path}")
+    count('files_opened')
+    try:
+        return len(all_files), read_header_fields(dcm_path, ROW_TAGS + SIZE_TAGS if SIZE_CHECK else ROW_TAGS)
+    except Exception as e:
+        print(f"Error reading {dcm_path}: {e}")
+        return None
+
+
+# Columns of a scanned series, of the modified CSV and of the partial file of a shard
+ROW_COLUMNS = ['SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID', 'Seq', 'Sequence_name', 'N_files', 'DATE']
+MODIFIED_COLUMNS = ROW_COLUMNS + ['N_files_Complete']
+SHARD_COLUMNS = MODIFIED_COLUMNS + ['Sequence_name_clean']
 
-# Create DataFrame
-data = pd.DataFrame(final_info, columns=[
-    'SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID',
-    'Seq', 'Sequence_name', 'N_files', 'DATE'
-])
-
-# Remove secondary sequences
-data = data[data['Seq'].str.lower() != 'secondary'].reset_index(drop=True)
-
-# Clean sequence names
-data['Sequence_name_clean'] = data['Sequence_name'].str.replace(r'^WIP\s+', '', regex=True).str.lower()
-
-# Check completeness
-def is_complete(row):
-    seq = row['Sequence_name_clean']
-    if seq in EXPECTED_FILES:
-        return int(row['N_files'] >= EXPECTED_FILES[seq])
-    return -1  # Unknown sequence
-
-data['N_files_Complete'] = data.apply(is_complete, axis=1)
-
-# Save modified metadata
-data.drop(columns=['Sequence_name_clean']).to_csv(MODIFIED_CSV, index=False)
-print(f"[✓] Modified metadata saved: {MODIFIED_CSV}")
-
-# ---------------------- Identify Missing Sequences -------------------------- #
-
-missing_sequences = defaultdict(list)
-for subject, group in data.groupby('SUBJ'):
-    group = group.set_index('Sequence_name_clean')
-    for expected_seq, expected_count in EXPECTED_FILES.items():
-        if expected_seq not in group.index:
-            missing_sequences[subject].append(expected_seq)
-        elif group.loc[expected_seq, 'N_files'].max() < expected_count:
-            missing_sequences[subject].append(expected_seq)
-    if subject not in missing_sequences:
-        missing_sequences[subject].append('NIL')
-
-# Create summary DataFrame
-missing_data = []
-for subj, missing in missing_sequences.items():
-    subj_data = data[data['SUBJ'] == subj]
-    row = [
+# Scanner prefix removed before matching sequence names
+WIP_PREFIX = re.compile(r'^WIP\s+')
+
+
+def make_row(subj, seq, n_files, fields):
+    """
+    Builds the row (dict of ROW_COLUMNS) of one series, plus the SIZE_TAGS
+    fields when they were read (not written to the CSV).
+    """
+    row = dict(zip(ROW_COLUMNS, [
         subj,
-        subj_data['ANCID'].iloc[0] if not subj_data.empty else None,
-        subj_data['Name'].iloc[0] if not subj_data.empty else None,
-        subj_data['ADBS_ID'].iloc[0] if not subj_data.empty else None,
-        subj_data['Assesment_ID'].iloc[0] if not subj_data.empty else None,
-        subj_data['DATE'].iloc[0] if not subj_data.empty else None,
-        ','.join(sorted(set(missing)))
-    ]
-    bstatus = behavioral_status.get(subj, {"VFT": 0, "TRENDS": 0, "EXAMCARD": 0})
-    row.extend([bstatus["VFT"], bstatus["TRENDS"], bstatus["EXAMCARD"]])
-    missing_data.append(row)
-
-missing_df = pd.DataFrame(missing_data, columns=[
-    'SUBJ', 'ANCID', 'Name', 'ADBS_ID', 'Assesment_ID', 'Date',
-    'Missing Sequences', 'VFT', 'TRENDS', 'EXAMCARD'
-])
-
-missing_df.to_csv(MISSING_CSV, index=False)
-print(f"[✓] Missing sequences saved: {MISSING_CSV}")
+        fields['AccessionNumber'],
+        fields['PatientName'],
+        fields['StudyDescription'],
+        fields['StudyComments'],
+        seq,
+        fields['ProtocolName'],
+        n_files,
+        fields['PerformedProcedureStepStartDate']
+    ]))
+    row.update((tag, fields[tag]) for tag in SIZE_TAGS if tag in fields)
+    return row
+
+
+def extract_task(item):
+    """Pool task of the extract stage: (task, (n_files, fields) or None, taken from cache)."""
+    task, cached = item
+    if cached is not None:
+        return task, cached, True
+    return task, read_series(task), False
+
+
+def record_series(result, seconds):
+    """Charges the time of a series read (not taken from the cache) to the run metrics."""
+    task, _, cached = result
+    if not cached:
+        record('series', task[2], seconds)
+        add_time('subject', task[0], seconds)
+
+
+def walk(root, behavioral_status, workers=None, kind=None, shard=None):
+    """
+    Walk stage: yields the (subj, seq, dicom_dir, mtime_ns) series of every subject
+    under root (of the shard only, if given), in sorted order, recording each
+    subject's behavioral/examcard flags in behavioral_status.
+    workers / kind default to N_WORKERS / POOL_KIND, read at call time.
+    """
+    workers = N_WORKERS if workers is None else workers
+    kind = POOL_KIND if kind is None else kind
+    # Subject folders, and subject archives not extracted next to them
+    names = os.listdir(root)
+    folders = {s for s in names if os.path.isdir(os.path.join(root, s))}
+    subjects = sorted(folders | {s for s in names if archive_stem(s) and archive_stem(s) not in folders
+                                 and os.path.isfile(os.path.join(root, s))})
+    if shard:
+        subjects = [s for s in subjects if in_shard(s, shard)]
+    count('dirs_listed')
+    on_task = lambda result, seconds: add_time('subject', result[0], seconds)
+    for subj, series, status in map_tasks(partial(list_subject, root), subjects, workers, kind, on_task):
+        behavioral_status[subj] = status
+        yield from series
+
+
+def extract(series, cache=None, workers=None, kind=None):
+    """
+    Extract stage: yields the row of every readable series, in input order.
+
+    Series found unchanged in the scan cache are not read again; the others are
+    read on the pool (N_WORKERS / POOL_KIND unless given) and stored in the cache.
+    """
+    workers = N_WORKERS if workers is None else workers
+    kind = POOL_KIND if kind is None else kind
+    items = ((task, cache.get(task[2], task[3]) if cache else None) for task in series)
+    for task, result, cached in map_tasks(extract_task, items, workers, kind, record_series):
+        if result is None:
+            continue
+        if cache and not cached:
+            cache.put(task[2], task[3], *result)
+        if result[1] is not None:
+            row = make_row(task[0], task[1], *result)
+            # Series folder for the optional stages (not written to the CSV)
+            row['Series_dir'] = task[2]
+            yield row
+
+
+def classify(rows, mapping=None):
+    """
+    Classify stage: fills IDs from the subject table, drops secondary series and
+    adds Sequence_name_clean and N_files_Complete (1 complete, 0 incomplete,
+    -1 unknown sequence).
+    """
+    for row in rows:
+        if mapping:
+            fill_ids(row, mapping)
+
+        # Remove secondary sequences
+        if str(row['Seq']).lower() == 'secondary':
+            continue
+
+        # Clean sequence names
+        name = row['Sequence_name']
+        row['Sequence_name_clean'] = WIP_PREFIX.sub('', str(name)).lower() if name is not None else None
+
+        # Check completeness
+        row['N_files_Complete'] = complete_flag(row['N_files'], EXPECTED_FILES.get(row['Sequence_name_clean']))
+        yield row
+
+
+# -------------------------- Data Cleaning & Check --------------------------- #
+
+BEHAVIORAL_COLUMNS = ['VFT', 'TRENDS', 'EXAMCARD']
+
+
+def build_missing_report(summary, behavioral_status):
+    """
+    Per-subject missing sequences (from the completeness matrix of the subject
+    summary) joined with the behavioral/examcard flags.
+    """
+    import pandas as pd
+    missing_df = missing_report(summary.frame(), EXPECTED_FILES)
+    status = pd.DataFrame.from_dict(behavioral_status, orient='index', columns=BEHAVIORAL_COLUMNS)
+    missing_df = missing_df.join(status, on='SUBJ')
+    missing_df[BEHAVIORAL_COLUMNS] = missing_df[BEHAVIORAL_COLUMNS].fillna(0).astype('int64')
+    return missing_df
+
+
+def deep_validate(rows, deep_csv=None, workers=None, kind=None):
+    """
+    Optional stage: deep-validates every series passing through (see
+    deep_validation.py), streaming the results to deep_csv. The arguments
+    default to DEEP_CSV, N_WORKERS and POOL_KIND, read at call time.
+    """
+    deep_csv = DEEP_CSV if deep_csv is None else deep_csv
+    workers = N_WORKERS if workers is None else workers
+    kind = POOL_KIND if kind is None else kind
+    columns = ['SUBJ', 'Seq', 'Sequence_name'] + DEEP_COLUMNS
+    with open(deep_csv, 'w', newline='', buffering=1) as f:
+        writer = csv.DictWriter(f, columns, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            for result in validate_series(row['Series_dir'], workers, kind):
+                writer.writerow({'SUBJ': row['SUBJ'], 'Seq': row['Seq'],
+                                 'Sequence_name': row['Sequence_name'], **result})
+            yield row
+
+
+def size_check(rows, size_csv=None):
+    """
+    Optional stage: checks the file sizes of every series passing through (see
+    size_check.py), streaming the suspect files to size_csv (SIZE_CSV by default).
+    """
+    size_csv = SIZE_CSV if size_csv is None else size_csv
+    n_suspects = 0
+    with open(size_csv, 'w', newline='', buffering=1) as f:
+        writer = csv.DictWriter(f, ['SUBJ', 'Seq', 'Sequence_name'] + SIZE_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            for suspect in check_sizes(row['Series_dir'], row, suffix='.dcm'):
+                writer.writerow({'SUBJ': row['SUBJ'], 'Seq': row['Seq'],
+                                 'Sequence_name': row['Sequence_name'], **suspect})
+                n_suspects += 1
+            yield row
+    print(f"[✓] Size check saved: {size_csv} ({n_suspects} suspect files)")
+
+
+def main(shard=None):
+    """Full scan (of one shard if given, SHARD by default) with the module settings read at call time."""
+    shard = SHARD if shard is None else shard
+    metrics = RunMetrics('check_dicom_completeness')
+    behavioral_status = {}
+    summary = SubjectSummary(EXPECTED_FILES)
+    mapping = load_mapping(SUBJECT_TABLE) if SUBJECT_TABLE else None
+    cache = ScanCache(CACHE_FILE, FORCE_RESCAN) if CACHE_FILE else None
+
+    modified_csv, modified_columns, modified_columnar = MODIFIED_CSV, MODIFIED_COLUMNS, MODIFIED_COLUMNAR
+    if shard:
+        # Partial results; the status file marks the shard as complete once written
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        modified_csv, status_file = shard_files(SHARD_DIR, shard)
+        modified_columns, modified_columnar = SHARD_COLUMNS, None
+        if os.path.exists(status_file):
+            os.remove(status_file)
+
+    # walk -> extract -> classify -> write, one series at a time
+    try:
+        rows = timed(walk(ROOT_PATH, behavioral_status, shard=shard), 'walk')
+        rows = timed(extract(rows, cache), 'extract')
+        rows = timed(classify(rows, mapping), 'classify')
+        if SIZE_CHECK:
+            rows = timed(size_check(rows), 'size_check')
+        if DEEP_VALIDATION:
+            rows = timed(deep_validate(rows), 'deep_validation')
+        rows = stream_csv(rows, modified_csv, modified_columns)
+        if modified_columnar:
+            rows = stream_columnar(rows, modified_columnar, MODIFIED_COLUMNS)
+        with profiled(PROFILE_FILE):
+            for row in timed(rows, 'write_modified'):
+                summary.add(row)
+    finally:
+        if cache:
+            cache.close()
+
+    print(f"[✓] Modified metadata saved: {modified_csv}")
+    if modified_columnar:
+        print(f"[✓] Modified metadata saved: {MODIFIED_COLUMNAR}")
+    if DEEP_VALIDATION:
+        print(f"[✓] Deep validation saved: {DEEP_CSV}")
+
+    if shard:
+        write_status(behavioral_status, status_file, BEHAVIORAL_COLUMNS)
+        print(f"[✓] Shard {shard} complete: {status_file} (combine the shards with merge_shards.py)")
+        metrics.finish(METRICS_JSON, METRICS_PROM)
+        return
+
+    # ---------------------- Identify Missing Sequences -------------------------- #
+
+    with stage('missing_report'):
+        missing_df = build_missing_report(summary, behavioral_status)
+        missing_df.to_csv(MISSING_CSV, index=False)
+        if MISSING_COLUMNAR:
+            write_columnar(missing_df, MISSING_COLUMNAR)
+    print(f"[✓] Missing sequences saved: {MISSING_CSV}")
+    if MISSING_COLUMNAR:
+        print(f"[✓] Missing sequences saved: {MISSING_COLUMNAR}")
+
+    metrics.finish(METRICS_JSON, METRICS_PROM)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='DICOM completeness check')
+    parser.add_argument('--shard', default=SHARD, help="scan one shard: 'i/n' (subject name hash) or 'first:last'")
+    main(parser.parse_args().shard)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+checksum_manifest.py
+
+Checksum manifests of DICOM sessions, to verify the copies made between the
+scanner exports, the backup storage and XNAT.
+
+- create: hashes every file of a session on a pool of readers and writes the
+  session's manifest (relative path, size, mtime, digest) to MANIFEST_DIR.
+- verify: hashes a copy of the session and compares it with the manifest;
+  missing, extra, truncated (size) and corrupted (checksum) files are reported.
+
+Both are incremental. Every hashed tree keeps a state file (the manifest itself
+for create, a per-copy state under MANIFEST_DIR for verify) and a file whose
+size and mtime match its entry there is not read again, so the nightly run only
+hashes the files copied or changed since the last one. Files rewritten in place
+with their mtime preserved are not re-hashed; use --full (FULL_RECHECK) to
+re-hash everything periodically.
+
+Reads use a large buffer (readinto, no per-block allocation), or mmap for files
+above MMAP_THRESHOLD. hashlib releases the GIL while hashing, so a thread pool
+keeps several files in flight.
+
+Usage:
+    python checksum_manifest.py create /mnt/Storage/Backupdata/MRI/<session> ...
+    python checksum_manifest.py verify /xnat/archive/<session> ... [--full]
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import csv
+import hashlib
+import mmap
+import os
+import zlib
+
+from run_metrics import count, map_tasks
+from worker_pool import default_workers
+
+# ----------------------------- Configuration -------------------------------- #
+
+# Folder of the session manifests (<session>.tsv) and verify states
+MANIFEST_DIR = '/mnt/Storage/Backupdata/MRI/checksum_manifests'
+
+# Digest algorithm of new manifests (any hashlib name)
+ALGORITHM = 'sha256'
+
+# Reader pool
+N_WORKERS = default_workers()
+POOL_KIND = 'thread'
+
+# Read buffer size, and file size from which files are mmapped instead
+BUFFER_SIZE = 1 << 20
+MMAP_THRESHOLD = 8 << 20
+
+# Re-hash every file, ignoring the sizes and mtimes of the last run
+FULL_RECHECK = False
+
+# ------------------------------- Hashing ------------------------------------- #
+
+
+def hash_file(path, algorithm=None):
+    """Hex digest of one file (ALGORITHM by default)."""
+    algorithm = ALGORITHM if algorithm is None else algorithm
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+        else:
+            buffer = bytearray(min(BUFFER_SIZE, size) or 1)
+            view = memoryview(buffer)
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                digest.update(view[:n])
+    count('files_opened')
+    count('bytes_hashed', size)
+    return digest.hexdigest()
+
+
+class _HashTask:
+    """Pool task: (relative path, full path) -> (relative path, digest or None, error)."""
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+
+    def __call__(self, item):
+        relative, path = item
+        try:
+            return relative, hash_file(path, self.algorithm), None
+        except OSError as e:
+            return relative, None, str(e)
+
+
+def list_files(root):
+    """
+    {relative path: (size, mtime_ns)} of every file under root. Hidden files
+    (temporary files of interrupted copies and writes) are skipped.
+    """
+    files = {}
+    stack = ['']
+    while stack:
+        relative_dir = stack.pop()
+        count('dirs_listed')
+        with os.scandir(os.path.join(root, relative_dir)) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                relative = os.path.join(relative_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(relative)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[relative] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+# ------------------------------- Manifests ----------------------------------- #
+
+
+def read_manifest(path):
+    """
+    Reads a manifest.
+
+    Returns:
+        (algorithm, {relative path: (size, mtime_ns, digest)})
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        entries = {row[0]: (int(row[1]), int(row[2]), row[3]) for row in reader}
+    return header[3], entries
+
+
+def write_manifest(entries, path, algorithm):
+    """Writes a manifest (sorted by path) through a temporary file + rename."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['path', 'size', 'mtime_ns', algorithm])
+        for relative in sorted(entries):
+            writer.writerow([relative, *entries[relative]])
+    os.replace(tmp_path, path)
+
+
+def hash_tree(root, previous=None, algorithm=None, workers=None, kind=None):
+    """
+    Digests of every file under root.
+
+    Parameters:
+        previous (dict): Entries of the last run over the same tree; files with
+            the same size and mtime take their digest from there.
+        algorithm, workers, kind: ALGORITHM, N_WORKERS, POOL_KIND by default
+            (read at call time).
+
+    Returns:
+        (entries {relative path: (size, mtime_ns, digest)}, {relative path: error},
+         number of files hashed)
+    """
+    algorithm = ALGORITHM if algorithm is None else algorithm
+    workers = N_WORKERS if workers is None else workers
+    kind = POOL_KIND if kind is None else kind
+    previous = previous or {}
+    entries, todo = {}, []
+    for relative, (size, mtime_ns) in sorted(list_files(root).items()):
+        known = previous.get(relative)
+        if known is not None and known[:2] == (size, mtime_ns):
+            entries[relative] = known
+        else:
+            entries[relative] = (size, mtime_ns, None)
+            todo.append(relative)
+
+    errors = {}
+    items = ((relative, os.path.join(root, relative)) for relative in todo)
+    for relative, digest, error in map_tasks(_HashTask(algorithm), items, workers, kind):
+        if error is not None:
+            errors[relative] = error
+            del entries[relative]
+        else:
+            entries[relative] = entries[relative][:2] + (digest,)
+    return entries, errors, len(todo)
+
+
+def manifest_path(session, manifest_dir=None):
+    """Manifest of a session (by folder name) in manifest_dir (MANIFEST_DIR)."""
+    return os.path.join(MANIFEST_DIR if manifest_dir is None else manifest_dir, os.path.basename(os.path.normpath(session)) + '.tsv')
+
+
+def state_path(copy_path, manifest_dir=None):
+    """Verify state of one copy of a session (several copies of a session each have their own)."""
+    manifest_dir = MANIFEST_DIR if manifest_dir is None else manifest_dir
+    name = os.path.basename(os.path.normpath(copy_path))
+    tag = zlib.crc32(os.path.abspath(copy_path).encode('utf-8'))
+    return os.path.join(manifest_dir, 'verified', '%s.%08x.tsv' % (name, tag))
+
+
+def _previous(path, algorithm, full):
+    """Entries of a state file usable for an incremental run, or None."""
+    if full or not os.path.exists(path):
+        return None
+    state_algorithm, entries = read_manifest(path)
+    return entries if state_algorithm == algorithm else None
+
+
+def create(session, manifest_dir=None, algorithm=None, full=None, workers=None, kind=None):
+    """
+    Writes (or updates) the manifest of a session. The arguments left to None
+    take the module settings (MANIFEST_DIR, ALGORITHM, FULL_RECHECK, N_WORKERS,
+    POOL_KIND) at call time.
+
+    Returns:
+        {relative path: error} of the files that could not be read (left out of the manifest).
+    """
+    algorithm = ALGORITHM if algorithm is None else algorithm
+    full = FULL_RECHECK if full is None else full
+    path = manifest_path(session, manifest_dir)
+    entries, errors, n_hashed = hash_tree(session, _previous(path, algorithm, full), algorithm, workers, kind)
+    write_manifest(entries, path, algorithm)
+    print("[✓] Manifest saved: %s (%d files, %d hashed, %d unreadable)"
+          % (path, len(entries), n_hashed, len(errors)))
+    return errors
+
+
+def compare(source, copy):
+    """
+    Differences between a manifest and the entries of a copy.
+
+    Returns:
+        sorted list of (relative path, problem), problem being 'missing',
+        'extra', 'size' (truncated / grown) or 'checksum'. mtimes are not
+        compared, copies need not preserve them.
+    """
+    problems = []
+    for relative in sorted(set(source) | set(copy)):
+        if relative not in copy:
+            problems.append((relative, 'missing'))
+        elif relative not in source:
+            problems.append((relative, 'extra'))
+        elif source[relative][0] != copy[relative][0]:
+            problems.append((relative, 'size'))
+        elif source[relative][2] != copy[relative][2]:
+            problems.append((relative, 'checksum'))
+    return problems
+
+
+def verify(copy_path, manifest_file=None, manifest_dir=None, full=None, workers=None, kind=None):
+    """
+    Verifies a copy of a session against its manifest (default: the manifest
+    of the session of the same name in manifest_dir). The arguments left to
+    None take the module settings at call time, as in create().
+
+    Returns:
+        list of (relative path, problem): see compare(), plus 'unreadable'.
+    """
+    full = FULL_RECHECK if full is None else full
+    manifest_file = manifest_file or manifest_path(copy_path, manifest_dir)
+    algorithm, source = read_manifest(manifest_file)
+
+    state_file = state_path(copy_path, manifest_dir)
+    entries, errors, n_hashed = hash_tree(copy_path, _previous(state_file, algorithm, full),
+                                          algorithm, workers, kind)
+    write_manifest(entries, state_file, algorithm)
+
+    problems = compare(source, entries)
+    problems = sorted([p for p in problems if p[0] not in errors] + [(r, 'unreadable') for r in errors])
+    print("%s %s: %d files, %d hashed, %d problems"
+          % ('[✓]' if not problems else '[!]', copy_path, len(entries), n_hashed, len(problems)))
+    for relative, problem in problems:
+        print("    %-10s %s" % (problem, relative))
+    return problems
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Checksum manifests of DICOM sessions')
+    parser.add_argument('action', choices=['create', 'verify'])
+    parser.add_argument('sessions', nargs='+', help='session folders (verify: the copies)')
+    parser.add_argument('--manifest-dir', default=MANIFEST_DIR)
+    parser.add_argument('--manifest', help='verify against this manifest (single session)')
+    parser.add_argument('--algorithm', default=ALGORITHM, help='digest of new manifests')
+    parser.add_argument('--full', action='store_true', default=FULL_RECHECK, help='re-hash every file')
+    parser.add_argument('--workers', type=int, default=N_WORKERS)
+    args = parser.parse_args()
+
+    failed = False
+    for session in args.sessions:
+        if args.action == 'create':
+            failed |= bool(create(session, args.manifest_dir, args.algorithm, args.full, args.workers))
+        else:
+            failed |= bool(verify(session, args.manifest, args.manifest_dir, args.full, args.workers))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,232 @@
+"""
+columnar_output.py
+
+Typed columnar copies of the checker inventories (the modified and missing
+tables), for dashboards that load multi-year inventories.
+
+The CSV files stay the reference output. The columnar copy holds the same rows
+with a fixed type per column, so it loads without parsing or type guessing:
+
+- identifiers (SUBJ, ANCID, Name, ...) are strings, whatever pydicom returned
+  (PersonName, MultiValue...);
+- sequence names are dictionary encoded (pandas categoricals);
+- DATE / Date (DICOM 'YYYYMMDD') is a date; values that are not a valid date
+  are stored as null;
+- counts and flags are integers.
+
+The type of a column depends on its name only (COLUMN_TYPES, string for the
+others), never on the data, so every run writes the same schema.
+
+The format follows the file extension: '.parquet' (Parquet) or '.arrow' /
+'.feather' / '.ipc' (Arrow IPC file). Rows are written in batches while the
+scan runs; the file is written under a temporary name and renamed when the
+scan ends, so a dashboard never reads a partial file.
+
+Needs pyarrow (pip install pyarrow).
+
+Usage:
+    for record in stream_columnar(records, 'modified.parquet', columns):
+        summary.add(record)
+    write_columnar(missing_df, 'missing.parquet')
+    data = read_columnar('modified.parquet', columns=['SUBJ', 'Sequence_name', 'N_files'])
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import datetime
+import os
+
+# pyarrow is imported on first use (_require_pyarrow), so the checkers start
+# without it when no columnar file is written
+pa = ipc = pq = None
+
+# Type of each known column ('category' = dictionary encoded string)
+COLUMN_TYPES = {
+    'SUBJ': 'string',
+    'ANCID': 'string',
+    'Name': 'string',
+    'ADBS_ID': 'string',
+    'Assesment_ID': 'string',
+    'Seq': 'string',
+    'Sequence_name': 'category',
+    'Sequence_name_clean': 'category',
+    'N_files': 'int64',
+    'DATE': 'date',
+    'Date': 'date',
+    'N_files_Complete': 'int8',
+    'Missing Sequences': 'string',
+    'VFT': 'int8',
+    'TRENDS': 'int8',
+    'EXAMCARD': 'int8',
+}
+
+# File extensions of the Arrow IPC format (anything else is Parquet)
+IPC_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Rows per written batch (Parquet row group)
+BATCH_ROWS = 10000
+
+
+def _require_pyarrow():
+    global pa, ipc, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Columnar output needs pyarrow (pip install pyarrow)")
+        pa, ipc, pq = pyarrow, pyarrow.ipc, pyarrow.parquet
+
+
+def _arrow_type(kind):
+    if kind == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    if kind == 'date':
+        return pa.date32()
+    return pa.type_for_alias(kind)
+
+
+def column_schema(columns):
+    """Arrow schema of a table with these columns (types from COLUMN_TYPES)."""
+    _require_pyarrow()
+    return pa.schema([(name, _arrow_type(COLUMN_TYPES.get(name, 'string'))) for name in columns])
+
+
+def _is_ipc(path):
+    return path.lower().endswith(IPC_EXTENSIONS)
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _date(value):
+    """DICOM date ('YYYYMMDD', or a date) -> datetime.date, None if not a valid date."""
+    if _missing(value):
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        # Dates read back from a CSV by pandas are floats when the column has blanks
+        value = int(value)
+    try:
+        return datetime.datetime.strptime(str(value).strip()[:8], '%Y%m%d').date()
+    except ValueError:
+        return None
+
+
+class _BatchBuilder:
+    """
+    Accumulates rows column by column and turns them into record batches.
+
+    Dictionary columns share one growing dictionary across batches, so every
+    batch only adds new values (dictionary deltas), as the IPC file format needs.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.values = {name: [] for name in schema.names}
+        self.dictionaries = {field.name: {} for field in schema if pa.types.is_dictionary(field.type)}
+
+    def __len__(self):
+        return len(self.values[self.schema.names[0]]) if self.schema.names else 0
+
+    def add(self, record):
+        for name, values in self.values.items():
+            values.append(record.get(name))
+
+    def _array(self, field, values):
+        if field.name in self.dictionaries:
+            dictionary = self.dictionaries[field.name]
+            indices = [None if _missing(v) else dictionary.setdefault(str(v), len(dictionary)) for v in values]
+            return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()),
+                                                  pa.array(list(dictionary), pa.string()))
+        if pa.types.is_date32(field.type):
+            return pa.array([_date(v) for v in values], field.type)
+        if pa.types.is_string(field.type):
+            return pa.array([None if _missing(v) else str(v) for v in values], field.type)
+        return pa.array([None if _missing(v) else int(v) for v in values], field.type)
+
+    def batch(self):
+        """Record batch of the rows added since the last call."""
+        arrays = [self._array(field, self.values[field.name]) for field in self.schema]
+        for values in self.values.values():
+            values.clear()
+        return pa.record_batch(arrays, schema=self.schema)
+
+
+class _ColumnarWriter:
+    """Parquet or Arrow IPC file writer of record batches."""
+
+    def __init__(self, path, schema, arrow_ipc=False):
+        if arrow_ipc:
+            options = ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self.writer = ipc.new_file(path, schema, options=options)
+        else:
+            self.writer = pq.ParquetWriter(path, schema)
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+def stream_columnar(records, path, columns, batch_rows=BATCH_ROWS):
+    """
+    Write stage of a checker pipeline, next to stream_csv.
+
+    Parameters:
+        records (iterable of dict): Rows; keys not in columns are not written.
+        path (str): Output file (.parquet, or .arrow / .feather / .ipc).
+        columns (list): Output columns, in order.
+        batch_rows (int): Rows per written batch.
+
+    Yields:
+        Every record. The file is in place once the records are exhausted;
+        if the pipeline stops early any earlier file is left untouched.
+    """
+    schema = column_schema(columns)
+    builder = _BatchBuilder(schema)
+    tmp_path = path + '.tmp'
+    writer = _ColumnarWriter(tmp_path, schema, _is_ipc(path))
+    done = False
+    try:
+        for record in records:
+            builder.add(record)
+            if len(builder) >= batch_rows:
+                writer.write(builder.batch())
+            yield record
+        if len(builder):
+            writer.write(builder.batch())
+        done = True
+    finally:
+        writer.close()
+        if done:
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+
+
+def write_columnar(frame, path, columns=None):
+    """Writes a DataFrame (e.g. the missing report) as a typed columnar file."""
+    columns = list(frame.columns) if columns is None else columns
+    for _ in stream_columnar(frame.to_dict('records'), path, columns):
+        pass
+
+
+def read_columnar(path, columns=None):
+    """
+    Loads a columnar inventory as a DataFrame: categoricals for the dictionary
+    columns, datetime64 for the dates.
+    """
+    _require_pyarrow()
+    if _is_ipc(path):
+        table = ipc.open_file(path).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        table = pq.read_table(path, columns=columns)
+    return table.to_pandas(date_as_object=False)
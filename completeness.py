@@ -0,0 +1,212 @@
+"""
+completeness.py
+
+Vectorized completeness and missing-sequence engine shared by the checker scripts.
+
+The expected file counts are turned into a table and joined against the
+per-series inventory once, giving a subject x sequence completeness matrix.
+Both the N_files_Complete column and the Missing Sequences report are read off
+that matrix, so the cost grows linearly with the number of series instead of
+re-filtering the whole inventory once per subject.
+
+Checkers that stream their rows to CSV instead of building the inventory
+DataFrame use complete_flag per row and keep a SubjectSummary: the subject's
+info columns and one aggregated count per expected sequence. Its frame() feeds
+missing_report with the same result as the full inventory; its missing() gives
+the same Missing Sequences values without pandas.
+
+pandas is imported by the DataFrame functions only, so the row-level helpers
+(complete_flag, SubjectSummary.add / missing) start fast in small CLIs.
+
+Functions:
+    - mark_complete: N_files_Complete column (1 complete, 0 incomplete, -1 unknown).
+    - completeness_matrix: Subject x expected sequence boolean matrix.
+    - missing_report: Per-subject missing sequences with the subject's info columns.
+    - complete_flag: N_files_Complete value of a single row.
+    - SubjectSummary: Per-subject state for the missing report of streamed rows.
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+# Subject columns copied into the missing report (taken from the subject's first row)
+INFO_COLUMNS = ['ANCID', 'Name', 'ADBS_ID', 'Assesment_ID', 'DATE']
+
+# Streaming equivalents of the groupby aggregations used by completeness_matrix
+STREAM_AGGREGATES = {
+    'max': max,
+    'sum': lambda total, n: total + n,
+    'first': lambda first, n: first,
+}
+
+
+def _expected_table(expected_files):
+    """Expected counts as a Series indexed by sequence name."""
+    import pandas as pd
+    return pd.Series(expected_files, dtype='float64')
+
+
+def mark_complete(data, expected_files, seq_col='Sequence_name_clean', exact=False):
+    """
+    Computes the N_files_Complete column.
+
+    Parameters:
+        data (DataFrame): Inventory with an 'N_files' column.
+        expected_files (dict): Sequence name -> expected number of files.
+        seq_col (str): Column holding the sequence name matched against expected_files.
+        exact (bool): Require N_files == expected instead of N_files >= expected.
+
+    Returns:
+        Series of int: 1 if complete, 0 if incomplete, -1 for unknown sequences.
+    """
+    expected = data[seq_col].map(_expected_table(expected_files))
+    if exact:
+        complete = data['N_files'] == expected
+    else:
+        complete = data['N_files'] >= expected
+    return complete.astype('int64').where(expected.notna(), -1)
+
+
+def completeness_matrix(data, expected_files, seq_col='Sequence_name_clean',
+                        agg='max', exact=False, subject_col='SUBJ'):
+    """
+    Builds the subject x expected sequence completeness matrix.
+
+    Parameters:
+        data (DataFrame): Inventory with subject, sequence and 'N_files' columns.
+        expected_files (dict): Sequence name -> expected number of files.
+        seq_col (str): Column holding the sequence name matched against expected_files.
+        agg (str): How repeated series of one sequence are combined before the
+            comparison: 'max' (best run), 'sum' (split series) or 'first'.
+        exact (bool): Require an exact count instead of at least the expected count.
+        subject_col (str): Subject column.
+
+    Returns:
+        DataFrame of bool, one row per subject (sorted) and one column per expected
+        sequence. True means present with enough files.
+    """
+    import pandas as pd
+    expected = _expected_table(expected_files)
+    subjects = pd.Index(data[subject_col].drop_duplicates().sort_values(), name=subject_col)
+
+    known = data[data[seq_col].isin(expected.index)]
+    counts = (known.groupby([subject_col, seq_col])['N_files'].agg(agg)
+              .unstack(seq_col)
+              .reindex(index=subjects, columns=expected.index)
+              .astype('float64'))
+
+    if exact:
+        return counts.eq(expected, axis='columns')
+    return counts.ge(expected, axis='columns')
+
+
+def missing_report(data, expected_files, seq_col='Sequence_name_clean', agg='max',
+                   exact=False, display_names=None, subject_col='SUBJ',
+                   info_columns=INFO_COLUMNS):
+    """
+    Builds the per-subject missing sequence report.
+
+    A sequence is missing for a subject if it is absent or has fewer files than
+    expected (see completeness_matrix). Subjects with nothing missing get 'NIL'.
+
+    Parameters:
+        data, expected_files, seq_col, agg, exact, subject_col: see completeness_matrix.
+        display_names (dict): Optional sequence name -> name shown in the report.
+        info_columns (list): Subject columns copied from the subject's first row;
+            'DATE' is reported as 'Date'.
+
+    Returns:
+        DataFrame with the subject, info columns and 'Missing Sequences',
+        one row per subject in sorted order.
+    """
+    import pandas as pd
+    missing = ~completeness_matrix(data, expected_files, seq_col, agg, exact, subject_col)
+
+    # Report names, de-duplicated and sorted, as ','.join(sorted(set(...))) did
+    labels = missing.columns.to_series()
+    if display_names:
+        labels = labels.map(lambda name: display_names.get(name, name))
+    missing = missing.T.groupby(labels.values).any().T
+
+    names = missing.dot(missing.columns.astype(str) + ',').str.rstrip(',') if len(missing.columns) \
+        else pd.Series('', index=missing.index)
+    names = names.where(names != '', 'NIL')
+
+    info = (data.drop_duplicates(subject_col)
+            .set_index(subject_col)[list(info_columns)]
+            .reindex(missing.index))
+    report = info.assign(**{'Missing Sequences': names}).reset_index()
+    return report.rename(columns={'DATE': 'Date'})
+
+
+def complete_flag(n_files, expected, exact=False):
+    """
+    N_files_Complete of one row: 1 complete, 0 incomplete, -1 unknown sequence
+    (expected is None). Same rule as mark_complete.
+    """
+    if expected is None:
+        return -1
+    return int(n_files == expected if exact else n_files >= expected)
+
+
+class SubjectSummary:
+    """
+    Per-subject state needed for the missing report when rows are streamed.
+
+    Keeps, for every subject, the info columns of its first row and one count per
+    expected sequence, aggregated as completeness_matrix would ('max', 'sum' or
+    'first'). Memory grows with the number of subjects, not of series.
+    """
+
+    def __init__(self, expected_files, seq_col='Sequence_name_clean', agg='max',
+                 subject_col='SUBJ', info_columns=INFO_COLUMNS):
+        if agg not in STREAM_AGGREGATES:
+            raise ValueError("Unknown aggregation %r, expected one of %s" % (agg, sorted(STREAM_AGGREGATES)))
+        self.expected_files = expected_files
+        self.seq_col = seq_col
+        self.combine = STREAM_AGGREGATES[agg]
+        self.subject_col = subject_col
+        self.info_columns = list(info_columns)
+        self.subjects = {}
+
+    def add(self, record):
+        """Adds one row (dict with the subject, info, sequence and 'N_files' columns)."""
+        subject = self.subjects.get(record[self.subject_col])
+        if subject is None:
+            subject = self.subjects[record[self.subject_col]] = (
+                {column: record[column] for column in self.info_columns}, {})
+        counts = subject[1]
+        seq = record[self.seq_col]
+        if seq in self.expected_files:
+            counts[seq] = self.combine(counts[seq], record['N_files']) if seq in counts else record['N_files']
+
+    def frame(self):
+        """
+        Compact inventory (one row per subject and expected sequence seen, or one
+        placeholder row for a subject without any) for missing_report.
+        """
+        import pandas as pd
+        rows = []
+        for subj, (info, counts) in self.subjects.items():
+            for seq, n_files in (counts.items() or [(None, 0)]):
+                rows.append({self.subject_col: subj, **info, self.seq_col: seq, 'N_files': n_files})
+        return pd.DataFrame(rows, columns=[self.subject_col] + self.info_columns + [self.seq_col, 'N_files'])
+
+    def missing(self, exact=False, display_names=None):
+        """
+        Missing Sequences of every subject, as missing_report computes them
+        (absent or too few files; 'NIL' when nothing is missing), without pandas.
+
+        Returns:
+            {subject: comma-separated sorted names or 'NIL'}, in sorted subject order.
+        """
+        report = {}
+        for subj in sorted(self.subjects):
+            counts = self.subjects[subj][1]
+            names = set()
+            for seq, expected in self.expected_files.items():
+                n_files = counts.get(seq)
+                if n_files is None or not (n_files == expected if exact else n_files >= expected):
+                    names.add(display_names.get(seq, seq) if display_names else seq)
+            report[subj] = ','.join(sorted(names)) or 'NIL'
+        return report
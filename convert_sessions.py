@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+convert_sessions.py
+
+Parallel DICOM -> BIDS conversion driver.
+
+dicom2bids3.sh converts the sessions of a DICOM folder one after the other. This
+driver runs the same steps for every session - look up ADBS_ID/ASSESSMENT_ID in
+the subject table, dcm2niix, BIDS renaming (bids_rename.py) - as independent
+jobs on a bounded pool, so a batch of sessions uses N_JOBS cores at a time.
+
+- Each job converts into a hidden staging folder that is renamed to
+  sub-<ADBS_ID>/ses-<ASSESSMENT_ID> only when the job succeeded, so a failed or
+  interrupted job never leaves a half-converted session behind.
+- Conversion is tracked per series. Every series folder (a folder holding
+  files) has a fingerprint - SeriesInstanceUID, number of files, newest file
+  mtime - kept in STATE_FILE with the BIDS files it produced. When a session is
+  planned again, only the new or changed series go through dcm2niix (one call
+  per series folder) and only their BIDS files are replaced in the existing
+  session folder; the outputs of series removed from the DICOM folder are
+  deleted. Re-delivering one fieldmap re-converts that fieldmap only.
+- dcm2niix run letters (a second "DKI" becomes "DKIa", hence run-02) depend on
+  the other series of the session, so they are assigned here over the whole
+  session from the dcm2niix output names recorded for every series, in the
+  order dcm2niix converts the series: ascending CRC-32 of the
+  SeriesInstanceUID, not the folder or series number (checked against
+  dcm2niix v1.0.20260724; re-check a session with --check-letters). A series
+  whose letter shifts (a new series converted before it) is re-converted as well.
+- A failed session is logged and the batch continues.
+- Progress and failures are logged to LOG_FILE; the dcm2niix output of every job
+  goes to LOG_DIR/<session>.log.
+- The outcome of every session is kept in STATE_FILE. On restart, sessions
+  already converted and unchanged are skipped and failed ones are retried.
+  Sessions converted without series tracking (dicom2bids3.sh, older runs) are
+  skipped as a whole, as before.
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import filecmp
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bids_rename import rename_session
+from dicom_header_reader import read_header_fields
+from subject_mapping import load_mapping, lookup
+from worker_pool import default_workers
+
+# ----------------------------- Configuration -------------------------------- #
+
+# Directory containing one DICOM folder per session
+DICOM_DATA_PATH = '/file_path/'
+# Table with the ANC number, ADBS_ID and ASSESSMENT_ID columns (subject_data.txt or the raw ANC table)
+TEXT_FILE = '/file_path'
+# Directory where the NIfTI files are saved in BIDS format
+OUTPUT_PATH = '/file_path/'
+
+# Resumable job state and logs
+STATE_FILE = os.path.join(OUTPUT_PATH, 'conversion_state.json')
+LOG_FILE = os.path.join(OUTPUT_PATH, 'conversion.log')
+LOG_DIR = os.path.join(OUTPUT_PATH, 'conversion_logs')
+
+# Number of sessions converted at the same time
+N_JOBS = default_workers()
+
+# Converter
+DCM2NIIX = 'dcm2niix'
+# dcm2niix exit code for a folder without DICOM files (e.g. a folder of behavioural files)
+DCM2NIIX_NO_DICOM = 2
+
+# Files of a session that are not part of any series
+NON_SERIES_FILES = {'DIRFILE'}
+
+# Run letters dcm2niix appends to a repeated output name, before these extensions
+RUN_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+OUTPUT_EXTENSIONS = ('.nii.gz', '.nii', '.json', '.bval', '.bvec')
+
+logger = logging.getLogger('convert_sessions')
+
+# ------------------------------- Job state ---------------------------------- #
+
+
+def load_state(state_file):
+    """Session name -> last job record."""
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state, state_file):
+    """Writes the state atomically (temporary file + rename)."""
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+# --------------------------------- Jobs ------------------------------------- #
+
+
+def run_step(command, job_log, ok_codes=(0,)):
+    """Runs one command of a job, appending its output to the job log."""
+    job_log.write('$ %s\n' % ' '.join(command))
+    job_log.flush()
+    returncode = subprocess.run(command, stdout=job_log, stderr=subprocess.STDOUT).returncode
+    if returncode not in ok_codes:
+        raise subprocess.CalledProcessError(returncode, command)
+
+# ------------------------------ Series state --------------------------------- #
+
+
+def _natural_key(path):
+    """Sort key of a series folder: '2/DICOM' before '10/DICOM'."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def list_series(source):
+    """
+    Series folders of a session: folders directly holding files (hidden files and
+    NON_SERIES_FILES aside), in one scandir pass.
+
+    Returns:
+        {folder relative to the session: (number of files, newest mtime_ns, first file name)}
+    """
+    series = {}
+    stack = ['']
+    while stack:
+        relative_dir = stack.pop()
+        n_files, newest, first = 0, 0, None
+        with os.scandir(os.path.join(source, relative_dir)) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name in NON_SERIES_FILES:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(os.path.join(relative_dir, entry.name))
+                elif entry.is_file():
+                    n_files += 1
+                    newest = max(newest, entry.stat().st_mtime_ns)
+                    first = entry.name if first is None else min(first, entry.name)
+        if n_files:
+            series[relative_dir] = (n_files, newest, first)
+    return series
+
+
+def series_fingerprints(source):
+    """{series folder: [SeriesInstanceUID, number of files, newest mtime_ns]} of a session."""
+    fingerprints = {}
+    for relative, (n_files, newest, first) in list_series(source).items():
+        try:
+            uid = read_header_fields(os.path.join(source, relative, first), ['SeriesInstanceUID'],
+                                     stop_after='SeriesInstanceUID')['SeriesInstanceUID']
+        except Exception:
+            # Not a DICOM file: the folder is tracked by its files only
+            uid = None
+        fingerprints[relative] = [None if uid is None else str(uid), n_files, newest]
+    return fingerprints
+
+
+def _split_extension(name):
+    """('DKI_2.5mm', '.nii.gz') for 'DKI_2.5mm.nii.gz': only the known dcm2niix extensions are split off."""
+    for extension in OUTPUT_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)], extension
+    return name, ''
+
+
+def conversion_order_key(uid, relative):
+    """
+    Sort key of the order in which dcm2niix converts the series of a session
+    (hence hands out the run letters): ascending CRC-32 of the SeriesInstanceUID,
+    folders without a readable UID first, then by folder.
+    """
+    return (uid is not None, zlib.crc32(uid.encode('ascii')) if uid else 0, _natural_key(relative))
+
+
+def run_letter_names(raw_names, uids):
+    """
+    dcm2niix output names of every series as a whole-session conversion names
+    them: the first series converted keeps a name, the next ones get 'a', 'b',
+    ... before the extension.
+
+    Parameters:
+        raw_names (dict): {series folder: output names of that series converted alone}.
+        uids (dict): {series folder: SeriesInstanceUID or None}, for the conversion order.
+
+    Returns:
+        {series folder: {output name: session-wide output name}}
+    """
+    taken = {}
+    names = {}
+    for relative in sorted(raw_names, key=lambda relative: conversion_order_key(uids.get(relative), relative)):
+        letters = {}
+        for name in sorted(raw_names[relative]):
+            base, extension = _split_extension(name)
+            if base not in letters:
+                n = taken.get(base, 0)
+                taken[base] = n + 1
+                letters[base] = '' if n == 0 else RUN_LETTERS[min(n, len(RUN_LETTERS)) - 1]
+            names.setdefault(relative, {})[name] = base + letters[base] + extension
+        names.setdefault(relative, {})
+    return names
+
+# --------------------------------- Jobs ------------------------------------- #
+
+
+def _convert_series(job, relative, staging, job_log):
+    """dcm2niix of one series folder into its own staging folder; returns the output names."""
+    out_dir = os.path.join(staging, 'series', relative)
+    os.makedirs(out_dir, exist_ok=True)
+    run_step([DCM2NIIX, '-f', '%p', '-d', '0', '-o', out_dir, os.path.join(job['source'], relative)],
+             job_log, ok_codes=(0, DCM2NIIX_NO_DICOM))
+    return sorted(name for name in os.listdir(out_dir) if not name.startswith('.'))
+
+
+def check_run_letters(source):
+    """
+    Checks run_letter_names against dcm2niix itself: converts the session once
+    as a whole (as dicom2bids3.sh does) and once series by series (as
+    convert_session does) in a temporary folder, and compares the files under
+    their session-wide names byte for byte.
+
+    Returns:
+        list of problems (empty if every output matches).
+    """
+    fingerprints = series_fingerprints(source)
+    with tempfile.TemporaryDirectory() as work, open(os.devnull, 'w') as job_log:
+        whole = os.path.join(work, 'whole')
+        os.makedirs(whole)
+        run_step([DCM2NIIX, '-f', '%p', '-o', whole, source], job_log, ok_codes=(0, DCM2NIIX_NO_DICOM))
+        job = {'source': source}
+        raw = {relative: _convert_series(job, relative, work, job_log) for relative in fingerprints}
+        names = run_letter_names(raw, {relative: fingerprint[0] for relative, fingerprint in fingerprints.items()})
+
+        problems = []
+        expected = set()
+        for relative, outputs in raw.items():
+            for name in outputs:
+                target = names[relative][name]
+                expected.add(target)
+                if not os.path.exists(os.path.join(whole, target)):
+                    problems.append('%s/%s: %s not written by the whole-session conversion' % (relative, name, target))
+                elif not filecmp.cmp(os.path.join(work, 'series', relative, name), os.path.join(whole, target),
+                                     shallow=False):
+                    problems.append('%s/%s: differs from %s of the whole-session conversion' % (relative, name, target))
+        problems.extend('%s: only written by the whole-session conversion' % name
+                        for name in sorted(set(os.listdir(whole)) - expected))
+    return problems
+
+
+def convert_session(job):
+    """
+    Converts the new or changed series of one session: dcm2niix of each series
+    folder into a staging folder, session-wide run letters, BIDS renaming, then
+    either rename of the staging folder to the final session folder (new
+    session) or replacement of the outputs of those series only.
+
+    Parameters:
+        job (dict): 'session', 'source', 'ADBS_ID', 'ASSESSMENT_ID', 'output',
+            'fingerprints' (current series fingerprints), 'convert' (series
+            folders to convert), 'previous' (series state of the last conversion).
+
+    Returns:
+        dict: job record with 'status' ('done' or 'failed'), 'error', 'seconds',
+        'series' (series state) and 'converted_series'.
+    """
+    start = time.time()
+    output = job['output']
+    staging = os.path.join(os.path.dirname(output), '.%s.partial' % os.path.basename(output))
+    fingerprints, previous = job['fingerprints'], job['previous']
+    record = {key: job[key] for key in ('session', 'source', 'ADBS_ID', 'ASSESSMENT_ID', 'output')}
+    record.update(status='failed', error=None, series=previous, converted_series=[])
+
+    try:
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        raw = {}
+        with open(os.path.join(LOG_DIR, '%s.log' % job['session']), 'w') as job_log:
+            todo = list(job['convert'])
+            while True:
+                for relative in todo:
+                    raw[relative] = _convert_series(job, relative, staging, job_log)
+                names = run_letter_names(dict({relative: previous[relative]['raw'] for relative in fingerprints
+                                               if relative not in raw}, **raw),
+                                         {relative: fingerprint[0] for relative, fingerprint in fingerprints.items()})
+                # Unchanged series whose run letter moved are converted again
+                todo = [relative for relative in fingerprints if relative not in raw
+                        and sorted(names[relative].values()) != previous[relative]['names']]
+                if not todo:
+                    break
+
+        # Every converted output under its session-wide name, then BIDS renaming
+        bids_dir = os.path.join(staging, 'bids')
+        os.makedirs(bids_dir)
+        series_of = {}
+        for relative, outputs in raw.items():
+            for name in outputs:
+                os.rename(os.path.join(staging, 'series', relative, name),
+                          os.path.join(bids_dir, names[relative][name]))
+                series_of[names[relative][name]] = relative
+        plan = rename_session(bids_dir, job['ADBS_ID'], job['ASSESSMENT_ID'])
+        produced = {relative: [] for relative in raw}
+        for source, destination, _ in plan:
+            produced[series_of[source]].append(destination)
+
+        if not os.path.isdir(output):
+            os.rename(bids_dir, output)
+        else:
+            # Outputs of the re-converted and removed series are replaced / deleted
+            new_files = {destination for _, destination, _ in plan}
+            for relative in set(raw) | (set(previous) - set(fingerprints)):
+                for destination in previous.get(relative, {}).get('outputs', []):
+                    if destination not in new_files and os.path.exists(os.path.join(output, destination)):
+                        os.remove(os.path.join(output, destination))
+            for _, destination, _ in plan:
+                os.makedirs(os.path.dirname(os.path.join(output, destination)), exist_ok=True)
+                os.replace(os.path.join(bids_dir, destination), os.path.join(output, destination))
+        shutil.rmtree(staging)
+
+        series = {relative: previous[relative] for relative in fingerprints if relative not in raw}
+        for relative in raw:
+            series[relative] = {'fingerprint': fingerprints[relative], 'raw': raw[relative],
+                                'names': sorted(names[relative].values()),
+                                'outputs': sorted(produced[relative])}
+        record.update(status='done', series=series, converted_series=sorted(raw, key=_natural_key))
+    except Exception as e:
+        record['error'] = str(e)
+        shutil.rmtree(staging, ignore_errors=True)
+
+    record['seconds'] = round(time.time() - start, 1)
+    record['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return record
+
+
+def plan_session(dicom_path, filename, mapping, output_path, state):
+    """
+    Builds the job of one session folder, or None if it is skipped: no match in
+    the subject table, no new, changed or removed series since the last
+    conversion, or converted without series tracking (state without series, or
+    BIDS session folder already existing, as in dicom2bids3.sh).
+    """
+    source = os.path.join(dicom_path, filename)
+    if not os.path.isdir(source):
+        return None
+    last = state.get(filename, {})
+    if last.get('status') == 'done' and 'series' not in last:
+        logger.info('Already converted: %s', filename)
+        return None
+
+    ids = lookup(mapping, filename)
+    if ids is None:
+        logger.warning('No match found for %s in %s', filename, TEXT_FILE)
+        return None
+
+    # Only the first three characters of the ASSESSMENT_ID, as in dicom2bids3.sh
+    adbs_id, assessment_id = ids[0], ids[1][:3]
+    output = os.path.join(output_path, 'sub-%s' % adbs_id, 'ses-%s' % assessment_id)
+    previous = last.get('series') or {}
+    if last.get('output') != output or not os.path.isdir(output):
+        # Session folder removed (or renamed in the subject table): full conversion
+        previous = {}
+    if os.path.isdir(output) and not previous:
+        logger.info('Directory %s already exists. Skipping processing for %s', output, filename)
+        return None
+
+    fingerprints = series_fingerprints(source)
+    convert = [relative for relative in sorted(fingerprints, key=_natural_key)
+               if previous.get(relative, {}).get('fingerprint') != fingerprints[relative]]
+    if previous and not convert and set(previous) <= set(fingerprints):
+        logger.info('Already converted, no series changed: %s', filename)
+        return None
+    if previous:
+        logger.info('%s: %d new or changed series, %d removed', filename, len(convert),
+                    len(set(previous) - set(fingerprints)))
+
+    return {'session': filename, 'source': source, 'ADBS_ID': adbs_id,
+            'ASSESSMENT_ID': assessment_id, 'output': output,
+            'fingerprints': fingerprints, 'convert': convert, 'previous': previous}
+
+
+def plan_jobs(dicom_path, mapping, output_path, state):
+    """Builds the list of sessions to convert (see plan_session)."""
+    jobs = []
+    for filename in sorted(os.listdir(dicom_path)):
+        job = plan_session(dicom_path, filename, mapping, output_path, state)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def run_batch(jobs, state, state_file, n_jobs=N_JOBS):
+    """Runs the jobs on a pool of n_jobs, recording each outcome in the state file."""
+    failed = 0
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = {pool.submit(convert_session, job): job for job in jobs}
+        for i, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            state[record['session']] = record
+            save_state(state, state_file)
+            if record['status'] == 'done':
+                logger.info('[%d/%d] Converted %s -> %s (%d series, %.1fs)', i, len(jobs), record['session'],
+                            record['output'], len(record['converted_series']), record['seconds'])
+            else:
+                failed += 1
+                logger.error('[%d/%d] FAILED %s: %s (see %s)', i, len(jobs), record['session'],
+                             record['error'], os.path.join(LOG_DIR, '%s.log' % record['session']))
+    return failed
+
+
+def main():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s',
+                        handlers=[logging.FileHandler(LOG_FILE), logging.StreamHandler()])
+
+    mapping = load_mapping(TEXT_FILE)
+    state = load_state(STATE_FILE)
+    jobs = plan_jobs(DICOM_DATA_PATH, mapping, OUTPUT_PATH, state)
+    for job in jobs:
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+
+    logger.info('%d sessions to convert with %d parallel jobs', len(jobs), N_JOBS)
+    failed = run_batch(jobs, state, STATE_FILE)
+    logger.info('SCRIPT COMPLETE: %d converted, %d failed', len(jobs) - failed, failed)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Parallel DICOM -> BIDS conversion')
+    parser.add_argument('--check-letters', metavar='SESSION',
+                        help='only compare the run letters of one session folder with a whole-session dcm2niix run')
+    args = parser.parse_args()
+    if args.check_letters:
+        problems = check_run_letters(args.check_letters)
+        for problem in problems:
+            print('[!] %s' % problem)
+        print('%s Run letters of %s %s dcm2niix' % ('[!]' if problems else '[✓]', args.check_letters,
+                                                  'differ from' if problems else 'match'))
+        sys.exit(1 if problems else 0)
+    main()
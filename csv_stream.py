@@ -0,0 +1,46 @@
+"""
+csv_stream.py
+
+Incremental CSV output for the checker pipelines.
+
+The checkers stream their rows through generator stages (walk -> extract ->
+classify -> write) instead of collecting every row before writing. stream_csv is
+the write stage: each row is written (and flushed) as soon as it is produced and
+then passed on, so an interrupted scan keeps every row written so far and memory
+does not grow with the size of the archive. The output matches
+DataFrame.to_csv(index=False) for the same rows.
+
+Usage:
+    for record in stream_csv(records, 'modified.csv', columns):
+        summary.add(record)
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import csv
+import os
+
+
+def stream_csv(records, path, columns, append=False):
+    """
+    Write stage of a checker pipeline.
+
+    Parameters:
+        records (iterable of dict): Rows; keys not in columns are not written.
+        path (str): CSV file, overwritten unless append is set.
+        columns (list): Output columns, in order.
+        append (bool): Add the rows to an existing file (header written only
+            when the file is new or empty).
+
+    Yields:
+        Every record, after it has been written.
+    """
+    new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a' if append else 'w', newline='', buffering=1) as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore', lineterminator='\n')
+        if new_file:
+            writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            yield record
@@ -20,6 +20,9 @@ text_file="/file_path"
 # Directory where processed NUIfTI files will be saved in BIDS format
 output_file_path="/file_path/"
 
+# Directory of this script (bids_rename.py lives next to it)
+script_dir="$(cd "$(dirname "$0")" && pwd)"
+
 # Iterate through the files in the source directory
 cd "$DICOM_DATA_file_path" || exit 1
 for filename in *; do
@@ -34,6 +37,7 @@ for filename in *; do
         ASSESSMENT_ID=$(echo "$columns" | awk '{print $3}' | cut -c 1-3)  # Extract only the first three digits
 
         # before conversion check if the BIDS file already exists, if yes, skip processing
+        # (whole sessions only: convert_sessions.py re-converts just the new or changed series of a session)
         if [ -d "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID" ]; then
             echo "Directory $output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID already exists. Skipping processing for $filename"
             continue
@@ -45,100 +49,8 @@ for filename in *; do
                 # Convert DICOM files to NIfTI in the current directory
                 dcm2niix -f "%p" -o "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID" "$DICOM_DATA_file_path/$filename"
                   
-                 # Remove 'WIP_' from filenames
-                for file in "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID"/*; do
-                    base=$(basename "$file")
-                    new_base=${base//WIP_/}
-                    mv "$file" "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID/$new_base"
-                done
-
-  
-                # Rename the NIfTI files by prepending ADBS_ID and ASSESSMENT_ID
-                for NIfTI_file in "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID"/*.*; do
-                    original_filename=$(basename "$NIfTI_file")
-                    new_filename="$original_filename"
-
-                    # Rename files based on run count
-                    if [[ "$new_filename" =~ a\.[^.]*$ ]]; then
-                        # Rename files with 'a' prefix
-                        extension="${new_filename##*.}"
-                        base_filename="${new_filename%.*}"
-                        new_filename="sub-${ADBS_ID}_ses-${ASSESSMENT_ID}_run-02_${base_filename%a}.${extension}"
-                    elif [[ "$new_filename" =~ b\.[^.]*$ ]]; then
-                        # Rename files with 'b' prefix
-                        extension="${new_filename##*.}"
-                        base_filename="${new_filename%.*}"
-                        new_filename="sub-${ADBS_ID}_ses-${ASSESSMENT_ID}_run-03_${base_filename%b}.${extension}"
-                    elif [[ "$new_filename" =~ c\.[^.]*$ ]]; then
-                        # Rename files with 'c' prefix
-                        extension="${new_filename##*.}"
-                        base_filename="${new_filename%.*}"
-                        new_filename="sub-${ADBS_ID}_ses-${ASSESSMENT_ID}_run-04_${base_filename%c}.${extension}"
-                     elif [[ "$new_filename" =~ [^ld]d\.[^.]*$ ]]; then
-                        # Rename files with 'd' prefix except 'ld'
-                        extension="${new_filename##*.}"
-                        base_filename="${new_filename%.*}"
-                        new_filename="sub-${ADBS_ID}_ses-${ASSESSMENT_ID}_run-05_${base_filename%d}.${extension}"
-                    else
-                        # Default naming convention
-                        new_filename="sub-${ADBS_ID}_ses-${ASSESSMENT_ID}_run-01_${new_filename}"
-                    fi
-
-                    # Move and rename files
-                    mv "$NIfTI_file" "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID/$new_filename"
-                done
-
-
-                # Rename NIfTI files before moving into directories
-                cd "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID/$newfilename"
-                rename 'fieldmap_e1_ph' 'phase1' *
-                rename 'T1w_PSIR' 'acq-psirc_PSIR' *
-                rename 'fieldmap_e2_ph' 'phase2' *
-                rename 'fieldmap_e1' 'magnitude1' *
-                rename 'fieldmap_e2' 'magnitude2' *
-                rename 'AP' 'dir-AP_epi' *
-                rename 'PA' 'dir-PA_epi' *
-                rename 'Ref_rest' 'acq-rest' *
-                rename 'Ref_DWI' 'acq-dwi' *
-                rename 'DKI' 'acq-80dir_dwi' *
-                rename 'DTI_6dir' 'acq-06dir_dwi' *
-                rename 'Ref_TRENDS' 'acq-trends' *
-                rename 'Ref_VFT' 'acq-vft' *
-
-                # Rename them properly
-                for file in *epi.json *epi.nii; do new_name=$(echo "$file" | sed -E 's/_run-([0-9]+)_acq-([a-zA-Z]+)_dir-([a-zA-Z]+)_epi/_acq-\2_dir-\3_run-\1_epi/'); mv "$file" "$new_name"; done
-                for file in *dwi.*; do new_name=$(echo "$file" | sed -E 's/_run-([0-9]+)_acq-([0-9]+dir)_dwi/_acq-\2_run-\1_dwi/'); mv "$file" "$new_name"; done
-                for file in *bold.nii *bold.json ; do new_name=$(echo "$file" | sed -E 's/_run-([0-9]+)_task-([a-zA-Z]+)_bold/_task-\2_run-\1_bold/'); mv "$file" "$new_name"; done
-                for file in *PSIR.nii *PSIR.json ; do new_name=$(echo "$file" | sed -E 's/_run-([0-9]+)_acq-([a-zA-Z]+)_PSIR/_acq-\2_run-\1_PSIR/'); mv "$file" "$new_name"; done
-
-
-                # Add required lines to various json files
-                find *task-rest_bold*.json -exec \
-                sed -i '/"PhaseEncodingAxis": "j",/a\\t"PhaseEncodingDirection": "j",' {} \;
-                find *dir-AP_epi*.json -exec \
-                sed -i 's/"PhaseEncodingAxis": "j",/&\n\t"PhaseEncodingDirection": "j-",/' {} \;
-                find *dir-PA_epi*.json -exec \
-                sed -i 's/"PhaseEncodingAxis": "j",/&\n\t"PhaseEncodingDirection": "j",/' {} \;
-                find *dwi*.json -exec \
-                sed -i 's/"PhaseEncodingAxis": "j",/&\n\t"PhaseEncodingDirection": "j",/' {} \;
-                
-
-
-
-                # Create directories and move files
-                mkdir -p fmap dwi func anat survey
-                mv -f *Survey* survey/
-                mv -f *task* func/
-                mv -f *T1* anat/
-                mv -f *T2* anat/
-                mv -f *FLAIR* anat/
-                mv -f *06dir* dwi/
-                mv -f *80dir* dwi/
-                mv -f *_dir-* fmap/
-                mv -f *magnitude* fmap/
-                mv -f *phase* fmap/
-                mv -f *PSIR* anat/
-                cd -
+                # Rename to BIDS and organize into fmap/dwi/func/anat/survey
+                python3 "$script_dir/bids_rename.py" "$output_file_path/sub-$ADBS_ID/ses-$ASSESSMENT_ID" "$ADBS_ID" "$ASSESSMENT_ID"
             fi
         fi
     else
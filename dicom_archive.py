@@ -0,0 +1,217 @@
+"""
+dicom_archive.py
+
+Read access to zip / tar downloads of XNAT sessions without extracting them.
+
+A subject downloaded as <root>/<SUBJ>.zip (or .tar, .tar.gz, ...) holds the
+same tree as the extracted <root>/<SUBJ> folder (a top-level <SUBJ>/ folder in
+the archive is skipped). Paths through the archive work like folder paths:
+
+    /data/SUBJ0001.zip/13/DICOM            a series folder
+    /data/SUBJ0001.zip/13/DICOM/0001.dcm   one of its files
+
+- The archive is indexed once (zip: the central directory only; tar: one pass
+  over the member headers) and kept open, per process, for the next reads.
+  Listings, file counts and sizes come from the index.
+- Opening a zip member decompresses only the bytes actually read, so a header
+  read streams the first kilobytes of one member. Tar members cannot be
+  reached without reading through the archive, so the first SAMPLE_BYTES of
+  the first file (and first .dcm file) of every folder are kept while indexing:
+  the representative header of every series is then read from memory.
+
+Usage:
+    archive, inner = archive_path('/data/SUBJ0001.zip/13/DICOM')
+    archive.listdir('/data/SUBJ0001.zip/13/DICOM')
+    with archive.open('/data/SUBJ0001.zip/13/DICOM/0001.dcm') as f:
+        ...
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import io
+import os
+import posixpath
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+from run_metrics import count
+
+# Archive types read in place of a folder
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# Bytes kept from the sampled files of a tar archive (enough for any header)
+SAMPLE_BYTES = 1 << 18
+SAMPLE_SUFFIX = '.dcm'
+
+# Archives kept open per process
+OPEN_ARCHIVES = 8
+
+# Substrings of every archive path (quick test before splitting a path)
+_ARCHIVE_MARKERS = ('.zip', '.tar', '.tgz')
+
+_open_archives = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def archive_stem(name):
+    """Name without its archive suffix ('SUBJ0001.zip' -> 'SUBJ0001'), None if not an archive."""
+    lower = name.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lower.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+def split_archive_path(path):
+    """
+    ('/data/SUBJ0001.zip', '13/DICOM') for a path through an archive file,
+    (None, None) for any other path.
+    """
+    lower = path.lower()
+    if not any(marker in lower for marker in _ARCHIVE_MARKERS):
+        return None, None
+    parts = path.split(os.sep)
+    for i, part in enumerate(parts):
+        if archive_stem(part):
+            archive = os.sep.join(parts[:i + 1])
+            if os.path.isfile(archive):
+                return archive, '/'.join(p for p in parts[i + 1:] if p)
+    return None, None
+
+
+class DicomArchive:
+    """Index of one zip / tar archive, read through paths starting with its own path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self.folders = {}
+        self.members = {}
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._zip = self._tar = None
+
+        if path.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(path)
+            members = [(info.filename, None if info.is_dir() else info.file_size, info)
+                       for info in self._zip.infolist()]
+        else:
+            self._tar = tarfile.open(path, 'r:*')
+            members = []
+            sampled = set()
+            for info in self._tar:
+                if info.isdir():
+                    members.append((info.name, None, info))
+                if not info.isfile():
+                    continue
+                members.append((info.name, info.size, info))
+                key = (info.name.rpartition('/')[0], info.name.endswith(SAMPLE_SUFFIX))
+                if key not in sampled:
+                    sampled.add(key)
+                    self.samples[info.name] = self._tar.extractfile(info).read(SAMPLE_BYTES)
+        count('files_opened')
+
+        # Member names as relative paths ('./13/DICOM/1.dcm' -> '13/DICOM/1.dcm');
+        # a single top-level folder named after the archive is the subject folder itself
+        members = [(posixpath.normpath(name).lstrip('/'), size, info) for name, size, info in members]
+        top = archive_stem(os.path.basename(path))
+        strip = len(top) + 1 if members and all(name == top or name.startswith(top + '/')
+                                                for name, _, _ in members) else 0
+
+        self.folders[''] = ([], set())
+        for name, size, info in members:
+            inner = name[strip:]
+            if size is None:
+                # Folder entry (keeps empty folders)
+                if inner not in ('', '.'):
+                    self._folder(inner)
+                continue
+            folder, _, file_name = inner.rpartition('/')
+            self._folder(folder)[0].append(file_name)
+            self.members[inner] = (size, info)
+
+    def _folder(self, folder):
+        """(files, subfolders) entry of a folder, created with its parents."""
+        entry = self.folders.get(folder)
+        if entry is None:
+            entry = self.folders[folder] = ([], set())
+            parent, _, name = folder.rpartition('/')
+            self._folder(parent)[1].add(name)
+        return entry
+
+    def _inner(self, path):
+        if path == self.path:
+            return ''
+        if not path.startswith(self.path + os.sep):
+            raise FileNotFoundError(path)
+        return path[len(self.path) + 1:].replace(os.sep, '/').strip('/')
+
+    def isdir(self, path):
+        return self._inner(path) in self.folders
+
+    def listdir(self, path):
+        """Names of the files and folders of a folder, as os.listdir."""
+        entry = self.folders.get(self._inner(path))
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry[0] + sorted(entry[1])
+
+    def files(self, path):
+        """File names of a folder, in archive order."""
+        entry = self.folders.get(self._inner(path))
+        return list(entry[0]) if entry else []
+
+    def file_sizes(self, path, suffix=''):
+        """{file name: size} of the files of a folder ending with suffix (from the index)."""
+        inner = self._inner(path)
+        prefix = inner + '/' if inner else ''
+        return {name: self.members[prefix + name][0] for name in self.files(path) if name.endswith(suffix)}
+
+    def open(self, path):
+        """Binary file object of one member."""
+        inner = self._inner(path)
+        if inner not in self.members:
+            raise FileNotFoundError(path)
+        info = self.members[inner][1]
+        if self._zip is not None:
+            return self._zip.open(info)
+        if info.name in self.samples:
+            return io.BytesIO(self.samples[info.name])
+        with self._lock:
+            return io.BytesIO(self._tar.extractfile(info).read())
+
+
+def open_archive(path):
+    """DicomArchive of an archive file, indexed once per process (re-indexed when the file changes)."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _open_lock:
+        archive = _open_archives.get(path)
+        if archive is not None and archive.mtime_ns == mtime_ns:
+            _open_archives.move_to_end(path)
+            return archive
+
+    archive = DicomArchive(path)
+    with _open_lock:
+        _open_archives[path] = archive
+        while len(_open_archives) > OPEN_ARCHIVES:
+            _open_archives.popitem(last=False)
+    return archive
+
+
+def open_file(path):
+    """Binary file object of a file, or of an archive member given by its path through the archive."""
+    archive, _ = split_archive_path(path)
+    if archive is None:
+        return open(path, 'rb')
+    return open_archive(archive).open(path)
+
+
+def archive_path(path):
+    """(DicomArchive, path inside it) for a path through an archive, (None, None) otherwise."""
+    archive, inner = split_archive_path(path)
+    if archive is None:
+        return None, None
+    return open_archive(archive), inner
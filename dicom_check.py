@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+dicom_check.py
+
+Command-line entry point of the XNAT completeness check, with paths and options
+as arguments instead of edits to the script configuration.
+
+    session   Checks one or more just-arrived subject folders (or zip / tar
+              downloads): per-series file counts against EXPECTED_FILES, missing
+              sequences and behavioral/examcard flags, printed to the terminal.
+              Same walk / extract / classify stages as check_dicom_completeness.py,
+              without pandas or pyarrow (see completeness.SubjectSummary.missing),
+              so a session is checked in a fraction of a second. Exits with 1 if
+              a sequence is missing or incomplete.
+    tree      Full-tree run of check_dicom_completeness.py (modified and missing
+              reports, pandas-based), optionally for one shard.
+
+Heavy modules are only imported by the code paths needing them.
+
+Usage:
+    python dicom_check.py session /data/XNAT/SUBJ0001 [/data/XNAT/SUBJ0002.zip ...]
+    python dicom_check.py tree /data/XNAT --modified modified.csv --missing missing.csv [--shard 0/4]
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import argparse
+import os
+import sys
+
+import check_dicom_completeness as checker
+from completeness import SubjectSummary
+
+# N_files_Complete values as printed
+COMPLETE_LABELS = {1: 'ok', 0: 'INCOMPLETE', -1: 'unknown'}
+
+
+def check_session(path, mapping=None, workers=None, kind=None):
+    """
+    Checks one subject folder or archive.
+
+    Returns:
+        (subject, rows (dicts of MODIFIED_COLUMNS + Sequence_name_clean),
+         Missing Sequences value, behavioral/examcard flags)
+    """
+    root, name = os.path.split(os.path.abspath(path))
+    subj, series, status = checker.list_subject(root, name)
+    rows = list(checker.classify(checker.extract(series, None, workers, kind), mapping))
+
+    summary = SubjectSummary(checker.EXPECTED_FILES)
+    for row in rows:
+        summary.add(row)
+    # A subject without any readable series misses everything
+    missing = summary.missing().get(subj) or ','.join(sorted(checker.EXPECTED_FILES))
+    return subj, rows, missing, status
+
+
+def print_session(subj, rows, missing, status):
+    info = rows[0] if rows else {}
+    print('\n%s  ANCID %s  ADBS_ID %s  Assesment_ID %s  DATE %s'
+          % (subj, *(info.get(column) for column in ('ANCID', 'ADBS_ID', 'Assesment_ID', 'DATE'))))
+    print('  %-6s %-28s %8s %9s  %s' % ('Seq', 'Sequence_name', 'N_files', 'Expected', 'Status'))
+    for row in rows:
+        expected = checker.EXPECTED_FILES.get(row['Sequence_name_clean'])
+        print('  %-6s %-28s %8d %9s  %s' % (row['Seq'], row['Sequence_name'], row['N_files'],
+                                            '-' if expected is None else expected,
+                                            COMPLETE_LABELS[row['N_files_Complete']]))
+    print('  Missing Sequences: %s' % missing)
+    print('  %s' % '  '.join('%s %d' % (column, status[column]) for column in checker.BEHAVIORAL_COLUMNS))
+
+
+def run_tree(args):
+    """Full-tree reports through check_dicom_completeness.main, configured from the arguments."""
+    checker.ROOT_PATH = args.root
+    checker.MODIFIED_CSV = args.modified
+    checker.MISSING_CSV = args.missing
+    checker.CACHE_FILE = None if args.no_cache else args.cache
+    checker.FORCE_RESCAN = args.rescan
+    checker.SUBJECT_TABLE = args.subject_table
+    checker.METRICS_JSON = args.metrics
+    if args.shard_dir:
+        checker.SHARD_DIR = args.shard_dir
+    checker.main(args.shard)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XNAT DICOM completeness check')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    session = commands.add_parser('session', help='check single subject folders / archives (no pandas)')
+    session.add_argument('paths', nargs='+', help='subject folders or zip / tar downloads')
+    session.add_argument('--subject-table', help='fill blank ADBS_ID / Assesment_ID from this table')
+    session.add_argument('--workers', type=int, help='pool size (default N_WORKERS)')
+
+    tree = commands.add_parser('tree', help='modified and missing reports of a whole tree')
+    tree.add_argument('root', nargs='?', default=checker.ROOT_PATH)
+    tree.add_argument('--modified', default=checker.MODIFIED_CSV)
+    tree.add_argument('--missing', default=checker.MISSING_CSV)
+    tree.add_argument('--cache', default=checker.CACHE_FILE, help='scan cache file')
+    tree.add_argument('--no-cache', action='store_true', help='scan without the cache')
+    tree.add_argument('--rescan', action='store_true', default=checker.FORCE_RESCAN, help='refresh the cache')
+    tree.add_argument('--subject-table', default=checker.SUBJECT_TABLE)
+    tree.add_argument('--metrics', default=checker.METRICS_JSON, help='run metrics JSON file')
+    tree.add_argument('--shard', default=checker.SHARD, help="'i/n' or 'first:last' (see sharding.py)")
+    tree.add_argument('--shard-dir', help='partial results folder of a shard (default SHARD_DIR)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'tree':
+        run_tree(args)
+        return 0
+
+    mapping = None
+    if args.subject_table:
+        from subject_mapping import load_mapping
+        mapping = load_mapping(args.subject_table)
+    incomplete = 0
+    for path in args.paths:
+        subj, rows, missing, status = check_session(path, mapping, args.workers)
+        print_session(subj, rows, missing, status)
+        incomplete += missing != 'NIL'
+    return 1 if incomplete else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,14 +5,31 @@ This script is designed to modify DICOM header values based on the provided new
 It traverses through a directory containing DICOM files, reads each DICOM file, modifies
 the specified header tags with new values, and saves the modified DICOM files.
 
+Bulk correction:
+    - Files are corrected on a pool of 'workers' threads or processes.
+    - Every file is written to a temporary file next to it and renamed over the
+      original, so an interrupted run never leaves a half-written file.
+    - Each corrected file is recorded in a journal; re-running after an
+      interruption skips the files already done (the journal is tied to the
+      new_values it was written for). The journal and the metrics are written
+      to log_dir, outside the session folder.
+    - Stage times, files opened, bytes read/written and the slowest files are
+      written to metrics_json / metrics_prom at the end (see run_metrics.py).
+    - With header_only = True only the header is parsed and rewritten; the pixel
+      data bytes are copied over as they are, without being decoded.
+
 Dependencies:
     - pydicom: Library for working with DICOM files
     - os: Module for handling file paths
 
 Functions:
     - modify_dicom_header: Function to modify the DICOM header with new values.
-    - Main Script: Traverses through a directory containing DICOM files, identifies
-                   subdirectories, filters DICOM files starting with 'I', and calls
+    - list_dicom_files: Lists the DICOM files of a session by listing each
+                        series subdirectory, or (use_dirfile) from the DIRFILE
+                        (DICOMDIR) when it matches the folders.
+    - correct_session: Runs modify_dicom_header over a session on the worker pool,
+                       with journaling.
+    - Main Script: Lists the DICOM files starting with 'I' of the session and calls
                    the modify_dicom_header function for each DICOM file.
 
 Usage:
@@ -23,30 +40,200 @@ Usage:
 
 """
 
-import pydicom
+import json
 import os
+import shutil
+from functools import partial
+
+import pydicom
+
+from dicomdir_inventory import session_inventory
+from run_metrics import RunMetrics, count, map_tasks, profiled, record, stage
+from worker_pool import default_workers
+
+# Transfer syntaxes whose dataset is not stored as-is (header and pixel data
+# cannot be split at a byte offset); these files are always fully rewritten
+DEFLATED_SYNTAXES = {'1.2.840.10008.1.2.1.99'}
+
+# Copy buffer for the pixel data bytes
+COPY_BUFFER = 1024 * 1024
+
+
+def _temporary_path(dicom_path):
+    """Hidden temporary file next to dicom_path (never matches the 'I*' filter)."""
+    folder, name = os.path.split(dicom_path)
+    return os.path.join(folder, '.%s.tmp' % name)
+
+
+def _replace(tmp_path, dicom_path):
+    """Makes tmp_path durable and atomically renames it over dicom_path."""
+    shutil.copymode(dicom_path, tmp_path)
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, dicom_path)
 
-def modify_dicom_header(dicom_path, new_values):
+
+def modify_dicom_header(dicom_path, new_values, header_only=False):
     """
     Modifies the DICOM header with new values.
 
     Parameters:
         dicom_path (str): Path to the DICOM file.
         new_values (dict): Dictionary containing tag-value pairs to be set in the DICOM header.
+        header_only (bool): Parse and rewrite only the header and copy the pixel data
+            bytes unchanged instead of loading the whole file.
+
+    Returns:
+        bool: True if the file was modified.
     """
-    if os.path.exists(dicom_path):
-        # Load the DICOM file
-        dicom_data = pydicom.dcmread(dicom_path)
-
-        # Modify the DICOM header with new values
-        for tag, value in new_values.items():
-            dicom_data[tag].value = value
-
-        # Save the modified DICOM file
-        dicom_data.save_as(dicom_path)
-        print("Modified DICOM header for %s" % dicom_path)
-    else:
+    if not os.path.exists(dicom_path):
         print("File or directory not found: %s" % dicom_path)
+        return False
+
+    tmp_path = _temporary_path(dicom_path)
+    count('files_opened')
+    try:
+        with open(dicom_path, 'rb') as src:
+            # Load the DICOM file (up to the pixel data in header-only mode)
+            dicom_data = pydicom.dcmread(src, stop_before_pixels=header_only)
+            pixel_offset = src.tell()
+            file_meta = getattr(dicom_data, 'file_meta', None)
+            syntax = file_meta.get('TransferSyntaxUID') if file_meta is not None else None
+
+            if header_only and syntax in DEFLATED_SYNTAXES:
+                src.seek(0)
+                dicom_data = pydicom.dcmread(src)
+                header_only = False
+
+            # Modify the DICOM header with new values
+            for tag, value in new_values.items():
+                dicom_data[tag].value = value
+
+            # Save the modified DICOM file to the temporary file
+            count('files_written')
+            with open(tmp_path, 'wb') as dst:
+                dicom_data.save_as(dst)
+                if header_only:
+                    # Pixel data element (and anything after it) copied byte for byte
+                    src.seek(pixel_offset)
+                    shutil.copyfileobj(src, dst, COPY_BUFFER)
+
+        _replace(tmp_path, dicom_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    print("Modified DICOM header for %s" % dicom_path)
+    return True
+
+
+def _correct_file(dicom_path, new_values, header_only):
+    """Pool task: returns (dicom_path, error message or None)."""
+    try:
+        if not modify_dicom_header(dicom_path, new_values, header_only):
+            return dicom_path, 'file not found'
+        return dicom_path, None
+    except Exception as e:
+        return dicom_path, str(e)
+
+
+def _load_journal(journal_file, new_values):
+    """
+    Returns the set of files already corrected for these new_values and the open
+    journal to append to. A journal written for other values is started afresh.
+    """
+    signature = json.dumps(new_values, sort_keys=True, default=str)
+    done = set()
+    if os.path.exists(journal_file):
+        with open(journal_file) as f:
+            lines = f.read().splitlines()
+        if lines and lines[0] == signature:
+            done = set(lines[1:])
+        else:
+            print('Journal %s was written for other values. Starting a new one.' % journal_file)
+            os.remove(journal_file)
+
+    journal = open(journal_file, 'a')
+    if not done:
+        journal.write(signature + '\n')
+        journal.flush()
+    return done, journal
+
+
+def correct_session(dicom_paths, new_values, journal_file, header_only=False,
+                    workers=None, pool_kind='thread'):
+    """
+    Modifies every file in dicom_paths on a worker pool, journaling each success.
+
+    Parameters:
+        dicom_paths (list): Files to correct.
+        new_values (dict): Tag-value pairs to set.
+        journal_file (str): Journal of corrected files; files listed in it are skipped.
+        header_only (bool): See modify_dicom_header.
+        workers (int): Pool size (None = all cores).
+        pool_kind (str): 'thread' or 'process'.
+
+    Returns:
+        list of (dicom_path, error) for the files that failed.
+    """
+    done, journal = _load_journal(journal_file, new_values)
+    todo = [path for path in dicom_paths if path not in done]
+    print('%d files to correct (%d already done according to %s)'
+          % (len(todo), len(dicom_paths) - len(todo), journal_file))
+
+    failures = []
+    task = partial(_correct_file, new_values=new_values, header_only=header_only)
+    on_task = lambda result, seconds: record('file', result[0], seconds)
+    try:
+        for dicom_path, error in map_tasks(task, todo, workers, pool_kind, on_task):
+            if error is None:
+                journal.write(dicom_path + '\n')
+                journal.flush()
+            else:
+                print('Failed to modify %s: %s' % (dicom_path, error))
+                failures.append((dicom_path, error))
+    finally:
+        journal.close()
+    return failures
+
+
+def list_dicom_files(file_path, use_dirfile=False):
+    """
+    Lists the DICOM files (names starting with 'I') of every series in a session.
+
+    Lists each series folder, skipping the DIRFILE itself. With use_dirfile the
+    DIRFILE inventory is used instead when available and consistent with the
+    folders on disk (slower: the whole DIRFILE is parsed and the folders are
+    still listed to check the counts).
+    """
+    inventory = session_inventory(file_path) if use_dirfile else None
+    if inventory is not None:
+        print('Using DIRFILE inventory of %s' % file_path)
+        return [os.path.join(file_path, f) for entry in inventory.values()
+                for f in entry['files'] if os.path.basename(f).startswith('I')]
+
+    dicom_paths = []
+    SeqList = os.listdir(file_path)
+    count('dirs_listed')
+    for Seq in SeqList:
+        if Seq == 'DIRFILE':
+            print('Skipped the DIRFILE')
+        else:
+            subdirectory_path = os.path.join(file_path, Seq)
+            if not os.path.isdir(subdirectory_path):
+                continue
+            print('Processing subdirectory: %s' % subdirectory_path)
+
+            # Get the list of files in the subdirectory
+            file_list = os.listdir(subdirectory_path)
+            count('dirs_listed')
+
+            # Filter out only the files starting with 'I'
+            dicom_files = [file for file in file_list if file.startswith('I')]
+            dicom_paths.extend(os.path.join(subdirectory_path, dicom_file) for dicom_file in dicom_files)
+    return dicom_paths
+
 
 # Define the file path:
 file_path = "Your/file/path"
@@ -58,23 +245,35 @@ new_values = {
 #    "AccessionNumber" : "ANCID"
 }
 
-SeqList = os.listdir(file_path)
-for Seq in SeqList:
-    if Seq == 'DIRFILE':
-        print('Skipped the DIRFILE')
-    else:
-        subdirectory_path = os.path.join(file_path, Seq)
-        print('Processing subdirectory: %s' % subdirectory_path)
+# Take the image list from the session DIRFILE when it matches the series
+# folders. Off by default: parsing the DIRFILE is slower than listing the
+# folders (benchmark.py, 30k-image session: 2.5s against 0.02s for ge_walk)
+use_dirfile = False
 
-        # Get the list of files in the subdirectory
-        file_list = os.listdir(subdirectory_path)
+# Bulk correction settings
+workers = default_workers()
+pool_kind = 'thread'
+header_only = True
 
-        # Filter out only the files starting with 'I'
-        dicom_files = [file for file in file_list if file.startswith('I')]
+# Journal and run metrics are kept outside the session (never in the patient data),
+# one file per session name in log_dir
+log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'header_correction_logs')
+session_name = os.path.basename(os.path.normpath(file_path))
+journal_file = os.path.join(log_dir, '%s.journal' % session_name)
 
-        for dicom_file in dicom_files:
-            dicom_path = os.path.join(subdirectory_path, dicom_file)
-            print('Trying to read DICOM file: %s' % dicom_path)
+# Run metrics as JSON and as a Prometheus textfile (None skips either file),
+# and optional cProfile stats of the correction loop
+metrics_json = os.path.join(log_dir, '%s_metrics.json' % session_name)
+metrics_prom = None
+profile_file = None
 
-            # Call the function to modify the DICOM header
-            modify_dicom_header(dicom_path, new_values)
+if __name__ == '__main__':
+    os.makedirs(log_dir, exist_ok=True)
+    metrics = RunMetrics('dicom_header_correction')
+    with stage('list_files'):
+        dicom_paths = list_dicom_files(file_path, use_dirfile)
+    with stage('correct'), profiled(profile_file):
+        failures = correct_session(dicom_paths, new_values, journal_file, header_only, workers, pool_kind)
+    if failures:
+        print('%d files could not be modified; re-run to retry them.' % len(failures))
+    metrics.finish(metrics_json, metrics_prom)
@@ -0,0 +1,198 @@
+"""
+dicom_header_reader.py
+
+Header-only DICOM reading shared by the checker scripts.
+
+The checkers only need a handful of attributes from the representative file of
+each series. Reading with pydicom's defaults loads the whole file, pixel data
+included, which is megabytes for multi-frame series. read_header() stops parsing
+at the pixel data element and only decodes the requested tags; every other
+element is skipped with a seek, so a few kilobytes are read per file.
+
+Paths may go through a zip / tar download (/data/SUBJ0001.zip/13/DICOM/1.dcm,
+see dicom_archive.py): only the header bytes of that member are decompressed.
+
+Usage:
+    from dicom_header_reader import read_header
+    data = read_header(path)
+    getattr(data, 'ProtocolName', None)
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+from struct import unpack_from
+
+from pydicom import dcmread as dr
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag
+
+from dicom_archive import open_file, split_archive_path
+
+# Attributes used by the checker scripts
+HEADER_TAGS = (
+    'AccessionNumber',
+    'PatientName',
+    'StudyDescription',
+    'StudyComments',
+    'ProtocolName',
+    'PerformedProcedureStepStartDate',
+    'StudyDate',
+    'SeriesDescription',
+)
+
+# Pixel data elements: parsing always stops before these
+PIXEL_TAGS = {0x7FE00008, 0x7FE00009, 0x7FE00010}
+
+# Bytes read by read_raw_tags; headers needing more fall back to pydicom
+RAW_READ_SIZE = 16384
+
+# Explicit VRs with a 4-byte length field
+LONG_VRS = {b'OB', b'OD', b'OF', b'OL', b'OV', b'OW', b'SQ', b'SV', b'UC', b'UN', b'UR', b'UT', b'UV'}
+
+IMPLICIT_LITTLE_ENDIAN = b'1.2.840.10008.1.2'
+# Transfer syntaxes whose dataset is not plain little endian
+UNSUPPORTED_RAW_SYNTAXES = {b'1.2.840.10008.1.2.1.99', b'1.2.840.10008.1.2.2'}
+
+ITEM_TAG = 0xFFFEE000
+ITEM_DELIMITER = 0xFFFEE00D
+SEQUENCE_DELIMITER = 0xFFFEE0DD
+
+
+def read_header(path, tags=HEADER_TAGS, force=True, stop_after=None):
+    """
+    Reads only the requested header tags of a DICOM file.
+
+    Parameters:
+        path (str or file-like): DICOM file to read.
+        tags (iterable): Keywords (or tag numbers) to decode.
+        force (bool): Read files without a DICOM preamble, as dcmread(force=True).
+        stop_after (str or int): Optional keyword/tag; parsing stops at the first
+            top-level element past it. Use the highest tag requested to avoid
+            walking the rest of the header (e.g. when reading every file of a series).
+
+    Returns:
+        pydicom Dataset holding only the requested tags (plus the file meta).
+        Missing tags are simply absent, so getattr(data, tag, None) works as before.
+    """
+    if not hasattr(path, 'read') and split_archive_path(path)[0]:
+        with open_file(path) as fp:
+            return read_header(fp, tags, force, stop_after)
+
+    if stop_after is None:
+        return dr(path, force=force, stop_before_pixels=True, specific_tags=list(tags))
+
+    last = Tag(stop_after)
+
+    def stop_when(tag, vr, length):
+        return tag > last or tag in PIXEL_TAGS
+
+    specific_tags = [Tag(t) for t in tags]
+    if hasattr(path, 'read'):
+        return read_partial(path, stop_when, force=force, specific_tags=specific_tags)
+    with open(path, 'rb') as fp:
+        return read_partial(fp, stop_when, force=force, specific_tags=specific_tags)
+
+
+def _element(buf, pos, implicit):
+    """Decodes the element header at pos: returns (tag, vr, length, value_pos)."""
+    group, elem = unpack_from('<HH', buf, pos)
+    tag = group << 16 | elem
+    if implicit or group == 0xFFFE:
+        return tag, None, unpack_from('<L', buf, pos + 4)[0], pos + 8
+    vr = buf[pos + 4:pos + 6]
+    if vr in LONG_VRS:
+        return tag, vr, unpack_from('<L', buf, pos + 8)[0], pos + 12
+    return tag, vr, unpack_from('<H', buf, pos + 6)[0], pos + 8
+
+
+def _skip_undefined(buf, pos, implicit):
+    """
+    Skips the items of an undefined-length sequence starting at pos.
+    Returns the position after the sequence delimiter.
+    """
+    while True:
+        tag, _, length, pos = _element(buf, pos, implicit)
+        if tag == SEQUENCE_DELIMITER:
+            return pos
+        if tag != ITEM_TAG:
+            raise ValueError("Malformed sequence")
+        if length != 0xFFFFFFFF:
+            pos += length
+            continue
+        # Undefined-length item: walk its elements up to the item delimiter
+        while True:
+            tag, vr, length, pos = _element(buf, pos, implicit)
+            if tag == ITEM_DELIMITER:
+                break
+            pos = _skip_undefined(buf, pos, implicit) if length == 0xFFFFFFFF else pos + length
+
+
+def read_raw_tags(path, tags, stop_after):
+    """
+    Fast path for reading a few top-level tags from many files.
+
+    Parses the element headers of a little-endian Part 10 file directly from its
+    first RAW_READ_SIZE bytes, without building a pydicom Dataset, and stops at
+    the first top-level element past stop_after.
+
+    Parameters:
+        path (str): DICOM file.
+        tags (iterable of int): Tag numbers wanted, e.g. 0x00200013.
+        stop_after (int): Highest tag number needed.
+
+    Returns:
+        dict tag -> raw value bytes (tags not present are absent), or None if the
+        file needs the full parser (no preamble, big endian/deflated, or a
+        header longer than RAW_READ_SIZE).
+    """
+    with open_file(path) as fp:
+        buf = fp.read(RAW_READ_SIZE)
+    if buf[128:132] != b'DICM':
+        return None
+
+    wanted = set(tags)
+    values = {}
+    try:
+        # File meta group is always explicit VR little endian
+        pos = 132
+        syntax = None
+        while unpack_from('<H', buf, pos)[0] == 0x0002:
+            tag, vr, length, value_pos = _element(buf, pos, False)
+            if tag == 0x00020010:
+                syntax = buf[value_pos:value_pos + length].rstrip(b'\0 ')
+            pos = value_pos + length
+        if syntax is None or syntax in UNSUPPORTED_RAW_SYNTAXES:
+            return None
+        implicit = syntax == IMPLICIT_LITTLE_ENDIAN
+
+        while pos + 8 <= len(buf):
+            tag, vr, length, value_pos = _element(buf, pos, implicit)
+            if tag > stop_after:
+                return values
+            if length == 0xFFFFFFFF:
+                pos = _skip_undefined(buf, value_pos, implicit)
+                continue
+            if tag in wanted:
+                if value_pos + length > len(buf):
+                    return None
+                values[tag] = buf[value_pos:value_pos + length]
+            pos = value_pos + length
+    except Exception:
+        # Ran off the end of the buffer or malformed header
+        return None
+    return None
+
+
+def read_header_fields(path, tags=HEADER_TAGS, force=True, stop_after=None):
+    """
+    Reads the requested header tags and returns them as a dict.
+    Parameters are as for read_header; file meta keywords (TransferSyntaxUID)
+    are taken from the file meta.
+
+    Returns:
+        dict: keyword -> value (None when the tag is not present).
+    """
+    data = read_header(path, tags, force, stop_after)
+    meta = getattr(data, 'file_meta', None)
+    return {tag: getattr(data, tag, getattr(meta, tag, None)) for tag in tags}
@@ -0,0 +1,216 @@
+"""
+fbirn_qa.py
+
+Streaming fBIRN stability metrics of a daily phantom EPI series
+(Friedman & Glover 2006), computed on the center slice:
+
+- Signal:  mean of the ROI of the average image.
+- SFNR:    mean over the ROI of signal / temporal fluctuation noise, the noise
+           being the standard deviation of each pixel's time series after a
+           2nd order polynomial detrend.
+- SNR:     signal / sqrt(variance over the ROI of (sum of odd images - sum of
+           even images) / number of images).
+- Percent fluctuation: 100 x residual std / mean of the ROI mean time series
+           after a 2nd order polynomial fit.
+- Drift:   100 x (max - min of that fit) / mean of the ROI mean time series.
+
+The series is one file per slice per volume. Its headers are read (raw tag
+reads, no pixel data) to find the slice positions; only the center slice of
+each volume is then decoded, in time order, and folded into running sums:
+per pixel sum(y t^k) for k = 0..2 and sum(y^2) give the detrended noise
+without keeping the time series, plus the odd/even difference image and the
+ROI mean per volume. Memory is a few images whatever the number of volumes.
+
+Usage:
+    metrics = series_metrics('/path/SER00')
+    metrics['SFNR'], metrics['SNR'], metrics['Percent_fluctuation'], metrics['Drift']
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+
+import numpy as np
+from pydicom import dcmread as dr
+
+from dicom_header_reader import read_header, read_raw_tags
+from run_metrics import count
+
+# Side of the square ROI at the center of the slice (fBIRN: 21 x 21 voxels)
+ROI_SIZE = 21
+
+# Volumes discarded at the start of the run (steady state)
+SKIP_VOLUMES = 2
+
+# Tags read from every file to order the series; parsing stops after the last one
+INSTANCE_NUMBER, IMAGE_POSITION, SLICE_LOCATION = 0x00200013, 0x00200032, 0x00201041
+POSITION_TAGS = ('InstanceNumber', 'ImagePositionPatient', 'SliceLocation')
+
+# Columns of the QA report
+QA_COLUMNS = ['N_volumes', 'N_slices', 'Signal', 'SNR', 'SFNR', 'Percent_fluctuation', 'Drift', 'QA_error']
+
+
+def slice_position(path):
+    """
+    (slice key, InstanceNumber) of one file. The slice key is SliceLocation, or
+    the ImagePositionPatient string when the location is missing.
+    """
+    raw = read_raw_tags(path, (INSTANCE_NUMBER, IMAGE_POSITION, SLICE_LOCATION), SLICE_LOCATION)
+    if raw is not None:
+        number = raw.get(INSTANCE_NUMBER, b'').strip(b'\0 ')
+        location = raw.get(SLICE_LOCATION, b'').strip(b'\0 ')
+        key = float(location) if location else raw.get(IMAGE_POSITION, b'').strip(b'\0 ').decode('ascii')
+        return key, int(number) if number else 0
+
+    # Files the raw parser cannot handle go through pydicom
+    data = read_header(path, POSITION_TAGS, stop_after='SliceLocation')
+    location = getattr(data, 'SliceLocation', None)
+    key = float(location) if location not in (None, '') else str(getattr(data, 'ImagePositionPatient', ''))
+    number = getattr(data, 'InstanceNumber', None)
+    return key, int(number) if number not in (None, '') else 0
+
+
+def center_slice_files(paths):
+    """
+    Orders a single-slice-per-file series into volumes.
+
+    Returns:
+        (files of the center slice in time order, number of slices)
+    """
+    slices = {}
+    for path in paths:
+        key, number = slice_position(path)
+        slices.setdefault(key, []).append((number, path))
+    count('files_opened', len(paths))
+
+    keys = sorted(slices, key=lambda k: (isinstance(k, str), k))
+    center = sorted(slices[keys[len(keys) // 2]])
+    return [path for _, path in center], len(keys)
+
+
+def read_slice(path):
+    """Pixel values of one slice as float64, with the modality rescale applied."""
+    data = dr(path)
+    count('files_opened')
+    image = data.pixel_array.astype(np.float64)
+    slope = float(getattr(data, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(data, 'RescaleIntercept', 0) or 0)
+    return image * slope + intercept
+
+
+def roi_slices(shape, size=ROI_SIZE):
+    """Row and column slices of the size x size ROI at the center of an image of shape."""
+    half = size // 2
+    rows, cols = shape[0] // 2, shape[1] // 2
+    return (slice(max(rows - half, 0), rows - half + size), slice(max(cols - half, 0), cols - half + size))
+
+
+def quadratic_fit(values):
+    """Fitted values of a 2nd order polynomial fit of values over 0..n-1."""
+    t = np.arange(len(values), dtype=np.float64)
+    return np.polyval(np.polyfit(t, values, 2), t)
+
+
+class FbirnAccumulator:
+    """
+    Running sums of the center slice images of a series, one image per volume.
+
+    add() each image in time order; metrics() gives the fBIRN summary values.
+    """
+
+    def __init__(self, roi_size=ROI_SIZE):
+        self.roi_size = roi_size
+        self.n = 0
+        self.offset = None
+        self.roi = None
+        self.sums = None
+        self.squares = None
+        self.odd_even = None
+        self.last = None
+        self.roi_means = []
+
+    def add(self, image):
+        if self.offset is None:
+            # Time series are accumulated relative to the first image, which
+            # keeps the sums small (the residuals do not depend on the offset)
+            self.offset = image.copy()
+            self.roi = roi_slices(image.shape, self.roi_size)
+            self.sums = np.zeros((3,) + image.shape)
+            self.squares = np.zeros(image.shape)
+            self.odd_even = np.zeros(image.shape)
+
+        t = float(self.n)
+        y = image - self.offset
+        self.sums[0] += y
+        self.sums[1] += t * y
+        self.sums[2] += t * t * y
+        self.squares += y * y
+        self.odd_even += image if self.n % 2 else -image
+        self.last = image
+        self.roi_means.append(image[self.roi].mean())
+        self.n += 1
+
+    def metrics(self):
+        """fBIRN summary values (dict) of the images added so far (at least 4)."""
+        n = self.n
+        if n < 4:
+            raise ValueError("fBIRN metrics need at least 4 volumes, got %d" % n)
+
+        # Average (signal) image
+        signal_image = self.offset + self.sums[0] / n
+
+        # Detrended temporal noise: residual sum of squares of the per-pixel
+        # least-squares quadratic fit, from the sufficient statistics
+        t = np.arange(n, dtype=np.float64)
+        xtx = np.array([[np.sum(t ** (i + j)) for j in range(3)] for i in range(3)])
+        coefficients = np.linalg.solve(xtx, self.sums.reshape(3, -1)).reshape(self.sums.shape)
+        residual = np.clip(self.squares - np.sum(coefficients * self.sums, axis=0), 0, None)
+        noise_image = np.sqrt(residual / n)
+        sfnr_image = np.divide(signal_image, noise_image, out=np.zeros_like(signal_image), where=noise_image > 0)
+
+        # Static spatial noise: odd - even images over an even number of volumes
+        # (with an odd count the last image, added as an even one, is taken out)
+        odd_even, n_used = self.odd_even, n
+        if n % 2:
+            odd_even, n_used = odd_even + self.last, n - 1
+
+        roi = self.roi
+        signal = signal_image[roi].mean()
+        roi_means = np.asarray(self.roi_means)
+        fit = quadratic_fit(roi_means)
+        mean_roi = roi_means.mean()
+        return {
+            'N_volumes': n,
+            'Signal': signal,
+            'SNR': signal / np.sqrt(odd_even[roi].var() / n_used),
+            'SFNR': sfnr_image[roi].mean(),
+            'Percent_fluctuation': 100 * np.std(roi_means - fit) / mean_roi,
+            'Drift': 100 * (fit.max() - fit.min()) / mean_roi,
+        }
+
+
+def series_metrics(series_dir, roi_size=ROI_SIZE, skip_volumes=SKIP_VOLUMES):
+    """
+    fBIRN metrics of one series folder (one file per slice per volume).
+
+    Returns:
+        dict with 'Series_dir' and QA_COLUMNS; on failure the metrics are None
+        and QA_error holds the reason.
+    """
+    result = dict.fromkeys(QA_COLUMNS, None)
+    result['Series_dir'] = series_dir
+    try:
+        paths = sorted(entry.path for entry in os.scandir(series_dir)
+                       if entry.is_file() and entry.name.startswith('I'))
+        count('dirs_listed')
+        files, result['N_slices'] = center_slice_files(paths)
+
+        accumulator = FbirnAccumulator(roi_size)
+        for path in files[skip_volumes:]:
+            accumulator.add(read_slice(path))
+        result.update({name: float(value) if name != 'N_volumes' else value
+                       for name, value in accumulator.metrics().items()})
+    except Exception as e:
+        result['QA_error'] = str(e)
+    return result
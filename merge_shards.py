@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+merge_shards.py
+
+Combines the partial results of a sharded check_dicom_completeness.py scan
+(SHARD, see sharding.py) into the usual modified and missing reports.
+
+- Only complete shards (status file written) are merged. Hash shards must
+  all be there ('i/n' for every i < n, a single n); a missing or incomplete
+  shard stops the merge unless --allow-incomplete is given.
+- The partial rows are streamed: every shard is in subject order, so the
+  shards are merged subject by subject into MODIFIED_CSV (and
+  MODIFIED_COLUMNAR) while the per-subject summary of the missing report is
+  built, as in a single scan.
+- A subject found in more than one shard (overlapping ranges) is taken from
+  the first shard only, with a warning.
+
+Usage:
+    python check_dicom_completeness.py --shard 0/4     (on every host, 0/4 .. 3/4)
+    python merge_shards.py [shard_dir] [--allow-incomplete]
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import csv
+import heapq
+import os
+
+import check_dicom_completeness as checker
+from columnar_output import stream_columnar, write_columnar
+from completeness import SubjectSummary
+from csv_stream import stream_csv
+from sharding import MODIFIED_SUFFIX, STATUS_SUFFIX, hash_shard, read_status
+
+# Integer columns of the partial rows (everything else is kept as written)
+INT_COLUMNS = ('N_files', 'N_files_Complete')
+
+
+def find_shards(shard_dir):
+    """
+    Partial results in a shard folder.
+
+    Returns:
+        {tag: (modified rows file, status file or None if the shard is incomplete)}
+    """
+    shards = {}
+    for name in sorted(os.listdir(shard_dir)):
+        if name.endswith(MODIFIED_SUFFIX):
+            tag = name[:-len(MODIFIED_SUFFIX)]
+            status_file = os.path.join(shard_dir, tag + STATUS_SUFFIX)
+            shards[tag] = (os.path.join(shard_dir, name), status_file if os.path.exists(status_file) else None)
+    return shards
+
+
+def coverage_problems(shards):
+    """Incomplete shards and hash shards missing from the set (list of messages)."""
+    problems = ['%s: incomplete (no status file)' % tag for tag, (_, status) in shards.items() if status is None]
+    hashed = [hash_shard(tag) for tag in shards if hash_shard(tag)]
+    totals = {total for _, total in hashed}
+    if len(totals) > 1:
+        problems.append('hash shards of different sizes: %s' % ', '.join(map(str, sorted(totals))))
+    for total in totals:
+        missing = sorted(set(range(total)) - {index for index, n in hashed if n == total})
+        if missing:
+            problems.append('hash shards missing: %s' % ', '.join('%d/%d' % (i, total) for i in missing))
+    return problems
+
+
+def read_rows(path):
+    """Rows of a partial modified file, with the integer columns converted."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            for column in INT_COLUMNS:
+                row[column] = int(row[column])
+            yield row
+
+
+def merged_rows(paths, duplicates):
+    """
+    Rows of all the shards in subject order; the rows of a subject already
+    taken from another shard are dropped (their subjects added to duplicates).
+    """
+    def keyed(i, path):
+        for row in read_rows(path):
+            yield row['SUBJ'], i, row
+
+    owner = {}
+    sources = [keyed(i, path) for i, path in enumerate(paths)]
+    for subj, i, row in heapq.merge(*sources, key=lambda item: item[:2]):
+        if owner.setdefault(subj, i) != i:
+            duplicates.add(subj)
+            continue
+        yield row
+
+
+def merge(shard_dir=None, allow_incomplete=False):
+    """Writes MODIFIED_CSV / MISSING_CSV (and their columnar copies) from the shards in shard_dir (SHARD_DIR)."""
+    shard_dir = checker.SHARD_DIR if shard_dir is None else shard_dir
+    shards = find_shards(shard_dir)
+    if not shards:
+        raise SystemExit('No shard results in %s' % shard_dir)
+    problems = coverage_problems(shards)
+    for problem in problems:
+        print('[!] %s' % problem)
+    if problems and not allow_incomplete:
+        raise SystemExit('Merge stopped (use --allow-incomplete to merge the complete shards only)')
+
+    complete = [tag for tag, (_, status) in shards.items() if status is not None]
+    behavioral_status = {}
+    for tag in complete:
+        behavioral_status.update(read_status(shards[tag][1]))
+
+    summary = SubjectSummary(checker.EXPECTED_FILES)
+    duplicates = set()
+    rows = merged_rows([shards[tag][0] for tag in complete], duplicates)
+    rows = stream_csv(rows, checker.MODIFIED_CSV, checker.MODIFIED_COLUMNS)
+    if checker.MODIFIED_COLUMNAR:
+        rows = stream_columnar(rows, checker.MODIFIED_COLUMNAR, checker.MODIFIED_COLUMNS)
+    for row in rows:
+        summary.add(row)
+    if duplicates:
+        print('[!] %d subjects found in more than one shard, first shard kept: %s'
+              % (len(duplicates), ', '.join(sorted(duplicates))))
+    print(f"[✓] Modified metadata saved: {checker.MODIFIED_CSV} ({len(complete)} shards)")
+
+    missing_df = checker.build_missing_report(summary, behavioral_status)
+    missing_df.to_csv(checker.MISSING_CSV, index=False)
+    if checker.MISSING_COLUMNAR:
+        write_columnar(missing_df, checker.MISSING_COLUMNAR)
+    print(f"[✓] Missing sequences saved: {checker.MISSING_CSV}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Merge the shards of a sharded DICOM completeness scan')
+    parser.add_argument('shard_dir', nargs='?', help='partial results folder (default SHARD_DIR)')
+    parser.add_argument('--allow-incomplete', action='store_true', help='merge the complete shards only')
+    args = parser.parse_args()
+    merge(args.shard_dir, args.allow_incomplete)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+phantom_store.py
+
+Longitudinal store of the daily phantom results: Parquet files partitioned by
+year and month, one file per session.
+
+    <store>/counts/year=2023/month=01/<session>.parquet   file counts (fBIRN.csv rows)
+    <store>/qa/year=2023/month=01/<session>.parquet       fBIRN QA metrics (fBIRN_QA.csv rows)
+
+- Appending a session writes its own file and never touches the others, so
+  Phantom_fBIRN_check only scans the sessions not in the store yet (is_stored
+  is a single stat). Files are written to a hidden temporary file and renamed,
+  so readers never see a partial session.
+- query() reads a date range across years: whole year partitions outside the
+  range are skipped, and only the requested columns are read.
+- Every table has a fixed schema, so sessions written years apart (or with
+  empty columns) read back as one table.
+- A session without a QA series is stored in 'qa' as a single marker row
+  (QA_error 'no <protocol> series', no metrics), so it is not scanned again.
+  Sessions whose QA failed are not stored and are retried on the next run.
+
+Needs pyarrow (pip install pyarrow).
+
+Usage:
+    append_session(store, 'qa', '2023', '01', 'FBIRN_20230102', rows)
+    trends = query(store, 'qa', start='20230101', end='20251231')
+    python phantom_store.py <store> --table qa --start 20230101 --end 20251231 --monthly --out trends.csv
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+# Column types of each table (partition columns 'year' and 'month' come from the path)
+SCHEMAS = {
+    'counts': [
+        ('Month', 'string'), ('File_name', 'string'), ('AccessionNumber', 'string'),
+        ('PatientName', 'string'), ('StudyDate', 'string'), ('Seq', 'string'),
+        ('ProtocolName', 'string'), ('N_files', 'int64'), ('N_files_Complete', 'int64'),
+    ],
+    'qa': [
+        ('Month', 'string'), ('File_name', 'string'), ('AccessionNumber', 'string'),
+        ('StudyDate', 'string'), ('Seq', 'string'), ('ProtocolName', 'string'),
+        ('N_files', 'int64'), ('N_volumes', 'int64'), ('N_slices', 'int64'),
+        ('Signal', 'float64'), ('SNR', 'float64'), ('SFNR', 'float64'),
+        ('Percent_fluctuation', 'float64'), ('Drift', 'float64'), ('QA_error', 'string'),
+    ],
+}
+PARTITION_COLUMNS = [('year', 'string'), ('month', 'string')]
+
+# QA metrics averaged by the monthly trend report
+TREND_COLUMNS = ['Signal', 'SNR', 'SFNR', 'Percent_fluctuation', 'Drift']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The phantom store needs pyarrow (pip install pyarrow)")
+
+
+def _schema(columns):
+    return pa.schema([(name, pa.type_for_alias(kind)) for name, kind in columns])
+
+
+def session_path(store, table, year, month, session):
+    """Parquet file of one session."""
+    return os.path.join(store, table, 'year=%s' % year, 'month=%s' % month, '%s.parquet' % session)
+
+
+def is_stored(store, table, year, month, session):
+    """True if the session is already in the table (no file is read)."""
+    return os.path.exists(session_path(store, table, year, month, session))
+
+
+def append_session(store, table, year, month, session, records):
+    """
+    Writes the rows of one session (DataFrame or list of dicts), replacing any
+    earlier version of that session only.
+    """
+    _require_pyarrow()
+    columns = SCHEMAS[table]
+    frame = pd.DataFrame(records)
+    frame = frame.reindex(columns=[name for name, _ in columns])
+    for name, kind in columns:
+        if kind == 'string':
+            # pydicom values (PersonName, MultiValue...) are stored as text
+            frame[name] = [None if pd.isna(value) else str(value) for value in frame[name]]
+    arrow_table = pa.Table.from_pandas(frame, schema=_schema(columns), preserve_index=False)
+
+    path = session_path(store, table, year, month, session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Hidden temporary file: dataset readers ignore names starting with '.'
+    tmp_path = os.path.join(os.path.dirname(path), '.%s.tmp' % os.path.basename(path))
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _date(value):
+    """'2023-01-02' / '20230102' -> '20230102'."""
+    return str(value).replace('-', '') if value is not None else None
+
+
+def query(store, table='qa', start=None, end=None, columns=None):
+    """
+    Reads the sessions of a table whose StudyDate is within [start, end]
+    (undated sessions: whose year partition is).
+
+    Parameters:
+        store (str): Store root.
+        table (str): 'counts' or 'qa'.
+        start, end (str): Optional dates, 'YYYYMMDD' or 'YYYY-MM-DD'.
+        columns (list): Columns to read (default all, plus 'year' and 'month').
+
+    Returns:
+        DataFrame sorted by StudyDate and session.
+    """
+    _require_pyarrow()
+    root = os.path.join(store, table)
+    schema = _schema(SCHEMAS[table] + PARTITION_COLUMNS)
+    if not os.path.isdir(root):
+        return schema.empty_table().to_pandas()
+
+    dataset = ds.dataset(root, schema=schema, format='parquet',
+                         partitioning=ds.partitioning(_schema(PARTITION_COLUMNS), flavor='hive'))
+    # Sessions without a StudyDate are kept when their year is in the range
+    start, end = _date(start), _date(end)
+    undated = ds.field('StudyDate').is_null()
+    conditions = []
+    if start:
+        conditions += [ds.field('year') >= start[:4], (ds.field('StudyDate') >= start) | undated]
+    if end:
+        conditions += [ds.field('year') <= end[:4], (ds.field('StudyDate') <= end) | undated]
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+
+    frame = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    order = [c for c in ('StudyDate', 'File_name', 'Seq') if c in frame.columns]
+    return frame.sort_values(order, kind='stable').reset_index(drop=True) if order else frame
+
+
+def monthly_trends(frame, value_columns=TREND_COLUMNS):
+    """
+    Per year/month session count and mean of the value columns of a query result
+    (QA rows with a QA_error, e.g. the markers of sessions without a QA series, left out).
+    """
+    if 'QA_error' in frame.columns:
+        frame = frame[frame['QA_error'].isna()]
+    values = [c for c in value_columns if c in frame.columns]
+    grouped = frame.groupby(['year', 'month'], sort=True)
+    report = grouped[values].mean()
+    report.insert(0, 'N_sessions', grouped['File_name'].nunique())
+    return report.reset_index()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the phantom results store')
+    parser.add_argument('store')
+    parser.add_argument('--table', choices=sorted(SCHEMAS), default='qa')
+    parser.add_argument('--start', help='first StudyDate (YYYYMMDD or YYYY-MM-DD)')
+    parser.add_argument('--end', help='last StudyDate (YYYYMMDD or YYYY-MM-DD)')
+    parser.add_argument('--monthly', action='store_true', help='per-month means instead of the sessions')
+    parser.add_argument('--out', help='CSV file (default: print)')
+    args = parser.parse_args()
+
+    result = query(args.store, args.table, args.start, args.end)
+    if args.monthly:
+        result = monthly_trends(result)
+    if args.out:
+        result.to_csv(args.out, index=False)
+        print('%d rows saved to %s' % (len(result), args.out))
+    else:
+        print(result.to_string(index=False))
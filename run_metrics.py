@@ -0,0 +1,338 @@
+"""
+run_metrics.py
+
+Per-stage timing and I/O instrumentation shared by the checkers and the
+header-correction tool.
+
+A RunMetrics object records, for one run:
+    - the wall time of every stage. Pipeline stages are generators wrapped with
+      timed(); a stage's time excludes the time spent in the stages feeding it,
+      so walk, extract, classify and CSV writing are told apart even though
+      they run interleaved.
+    - counters: directories listed, files opened (count() at the I/O sites),
+      and the bytes read/written by the process (/proc/self/io, Linux only).
+    - the slowest subjects and series.
+and writes a JSON summary and a Prometheus textfile-collector file at the end
+of the run (both written atomically, so a collector never reads half a file).
+
+Pool tasks are run through map_tasks: each task is timed where it runs and its
+counters (and, in a worker process, its I/O) are sent back with the result, so
+the figures are the same with thread and process pools.
+
+The module-level helpers (count, record, add_time, stage, timed, map_tasks)
+record into the run created last and do nothing (map_tasks is plain
+map_ordered) when there is none, so instrumented code runs unchanged outside
+an instrumented run.
+
+profiled() dumps cProfile stats of a block (the hot loop) when enabled.
+
+Usage:
+    metrics = RunMetrics('check_dicom_completeness')
+    for row in timed(rows, 'write'):
+        ...
+    count('files_opened')
+    metrics.finish(json_path, prom_path)
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import cProfile
+import heapq
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from worker_pool import map_ordered
+
+# /proc/<pid>/io fields reported as counters
+PROC_IO_FIELDS = {'rchar': 'bytes_read', 'wchar': 'bytes_written'}
+
+# Number of slowest subjects / series kept
+SLOWEST = 10
+
+# Metric name prefix of the Prometheus textfile
+PROM_PREFIX = 'dicom_run'
+
+# Run the module-level helpers record into (RunMetrics.activate), and per-task counters
+_active = None
+_task = threading.local()
+
+
+def proc_io():
+    """I/O counters of this process (bytes read/written), or {} where /proc is not available."""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':') for line in f if ':' in line)
+    except OSError:
+        return {}
+    return {name: int(fields[field]) for field, name in PROC_IO_FIELDS.items() if field in fields}
+
+
+class TimedTask:
+    """
+    Pool task wrapper: runs func(item) and returns (result, seconds, counters).
+    In a worker process the task's bytes read/written are added to its counters.
+    """
+
+    def __init__(self, func, parent_pid):
+        self.func = func
+        self.parent_pid = parent_pid
+
+    def __call__(self, item):
+        in_worker = os.getpid() != self.parent_pid
+        io_before = proc_io() if in_worker else {}
+        _task.counts = {}
+        start = time.perf_counter()
+        try:
+            result = self.func(item)
+        finally:
+            seconds = time.perf_counter() - start
+            counts, _task.counts = _task.counts, None
+        for name, value in proc_io().items() if in_worker else ():
+            counts[name] = counts.get(name, 0) + value - io_before.get(name, 0)
+        return result, seconds, counts
+
+
+class RunMetrics:
+    """Stage times, counters and slowest items of one run."""
+
+    def __init__(self, run_name, activate=True):
+        self.run_name = run_name
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._io_start = proc_io()
+        self.stages = {}
+        self.counters = {}
+        self.slowest = {}
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._nested = []
+        if activate:
+            self.activate()
+
+    def activate(self):
+        """Makes the module-level helpers record into this run."""
+        global _active
+        _active = self
+
+    def add(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def record(self, kind, label, seconds):
+        """Keeps label among the SLOWEST slowest items of its kind (e.g. 'series')."""
+        with self._lock:
+            heap = self.slowest.setdefault(kind, [])
+            item = (seconds, str(label))
+            if len(heap) < SLOWEST:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def add_time(self, kind, label, seconds):
+        """Adds seconds to the total of label (e.g. a subject over its series); slowest totals are reported."""
+        with self._lock:
+            totals = self.totals.setdefault(kind, {})
+            totals[label] = totals.get(label, 0.0) + seconds
+
+    def _add_stage(self, stage, seconds, items=0):
+        entry = self.stages.setdefault(stage, {'seconds': 0.0, 'items': 0})
+        entry['seconds'] += seconds
+        entry['items'] += items
+
+    @contextmanager
+    def stage(self, stage):
+        """Times a block as stage (time of stages nested in it excluded)."""
+        self._nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self._add_stage(stage, elapsed - nested)
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def timed(self, iterable, stage):
+        """Yields from iterable, timing each step as stage and counting the items."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.stages[stage]['items'] += 1
+            yield item
+
+    def map_tasks(self, func, items, workers=None, kind='thread', on_task=None):
+        """
+        worker_pool.map_ordered with per-task timing and counters.
+
+        Parameters:
+            on_task (callable): Optional on_task(result, seconds), called in input
+                order with each task's time (to record() or add_time() it).
+        """
+        task = TimedTask(func, os.getpid())
+        for result, seconds, counts in map_ordered(task, items, workers, kind):
+            for counter, n in counts.items():
+                self.add(counter, n)
+            if on_task:
+                on_task(result, seconds)
+            yield result
+
+    def summary(self):
+        """Summary of the run as a dict (what the JSON file holds)."""
+        counters = dict(self.counters)
+        for name, value in proc_io().items():
+            # Worker processes report their own I/O through their tasks
+            counters[name] = counters.get(name, 0) + value - self._io_start.get(name, 0)
+        peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        slowest = {kind: sorted(heap, reverse=True) for kind, heap in self.slowest.items()}
+        for kind, totals in self.totals.items():
+            slowest[kind] = heapq.nlargest(SLOWEST, ((seconds, label) for label, seconds in totals.items()))
+        return {
+            'run': self.run_name,
+            'started': self.started,
+            'finished': time.time(),
+            'duration_seconds': round(time.perf_counter() - self._start, 6),
+            'peak_rss_bytes': peak_kb * 1024,
+            'stages': {stage: {'seconds': round(entry['seconds'], 6), 'items': entry['items']}
+                       for stage, entry in self.stages.items()},
+            'counters': counters,
+            'slowest': {kind: [{'label': label, 'seconds': round(seconds, 6)}
+                               for seconds, label in items]
+                        for kind, items in slowest.items()},
+        }
+
+    def report(self, summary=None):
+        """Prints the stage times, counters and slowest items."""
+        summary = summary or self.summary()
+        print("Run %s: %.2fs, peak RSS %.1f MB"
+              % (summary['run'], summary['duration_seconds'], summary['peak_rss_bytes'] / 2 ** 20))
+        for stage, entry in sorted(summary['stages'].items(), key=lambda s: -s[1]['seconds']):
+            print("  %-20s %10.3fs %10d items" % (stage, entry['seconds'], entry['items']))
+        for counter, value in sorted(summary['counters'].items()):
+            print("  %-20s %12d" % (counter, value))
+        for kind, items in summary['slowest'].items():
+            print("  Slowest %s:" % kind)
+            for item in items:
+                print("    %8.3fs  %s" % (item['seconds'], item['label']))
+
+    def finish(self, json_path=None, prom_path=None, verbose=True):
+        """Reports the run and writes the JSON summary / Prometheus textfile (None skips either)."""
+        summary = self.summary()
+        if verbose:
+            self.report(summary)
+        if json_path:
+            write_json(summary, json_path)
+            print("[✓] Run metrics saved: %s" % json_path)
+        if prom_path:
+            write_prometheus(summary, prom_path)
+            print("[✓] Prometheus metrics saved: %s" % prom_path)
+        return summary
+
+
+# ------------------------ Helpers used by the scripts ------------------------ #
+
+
+def count(counter, n=1):
+    """Adds n to a counter of the running task, or of the active run."""
+    counts = getattr(_task, 'counts', None)
+    if counts is not None:
+        counts[counter] = counts.get(counter, 0) + n
+    elif _active is not None:
+        _active.add(counter, n)
+
+
+def record(kind, label, seconds):
+    if _active is not None:
+        _active.record(kind, label, seconds)
+
+
+def add_time(kind, label, seconds):
+    if _active is not None:
+        _active.add_time(kind, label, seconds)
+
+
+def stage(name):
+    """Context manager timing a block as stage name in the active run."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+def timed(iterable, name):
+    """Times a generator stage in the active run (iterable itself without one)."""
+    return _active.timed(iterable, name) if _active is not None else iterable
+
+
+def map_tasks(func, items, workers=None, kind='thread', on_task=None):
+    """RunMetrics.map_tasks of the active run, worker_pool.map_ordered without one."""
+    if _active is not None:
+        return _active.map_tasks(func, items, workers, kind, on_task)
+    return map_ordered(func, items, workers, kind)
+
+
+def _write_atomic(text, path):
+    """Writes text to path through a temporary file + rename."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_json(summary, path):
+    _write_atomic(json.dumps(summary, indent=1, sort_keys=True) + '\n', path)
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels.items())
+
+
+def write_prometheus(summary, path, prefix=PROM_PREFIX):
+    """
+    Writes the summary in the Prometheus text format, for node_exporter's textfile
+    collector (path should end in .prom). The slowest items stay in the JSON only,
+    to keep the label cardinality bounded.
+    """
+    run = summary['run']
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+        for labels, value in samples:
+            lines.append('%s_%s%s %s' % (prefix, name, _labels(run=run, **labels), repr(float(value))))
+
+    metric('duration_seconds', 'gauge', 'Wall time of the last run.', [({}, summary['duration_seconds'])])
+    metric('last_finished_timestamp_seconds', 'gauge', 'End time of the last run.', [({}, summary['finished'])])
+    metric('peak_rss_bytes', 'gauge', 'Peak resident set size of the last run.', [({}, summary['peak_rss_bytes'])])
+    metric('stage_seconds', 'gauge', 'Wall time per stage (nested stages excluded).',
+           [({'stage': stage}, entry['seconds']) for stage, entry in sorted(summary['stages'].items())])
+    metric('stage_items', 'gauge', 'Items produced per stage.',
+           [({'stage': stage}, entry['items']) for stage, entry in sorted(summary['stages'].items())])
+    for counter, value in sorted(summary['counters'].items()):
+        metric(counter, 'gauge', 'Counter %s of the last run.' % counter, [({}, value)])
+    _write_atomic('\n'.join(lines) + '\n', path)
+
+
+@contextmanager
+def profiled(stats_file=None):
+    """Runs the block under cProfile and dumps the stats to stats_file (no-op when None)."""
+    if not stats_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stats_file)
+        print("[✓] Profile saved: %s (python -m pstats %s)" % (stats_file, stats_file))
@@ -0,0 +1,124 @@
+"""
+scan_cache.py
+
+Persistent scan cache for the checker scripts.
+
+Stores, per series directory, the directory mtime, the number of files and the
+header fields extracted from its representative DICOM file in a small SQLite
+database. On the next run a series whose directory mtime is unchanged is taken
+from the cache without listing the directory or opening any file; only new or
+changed series are re-read.
+
+A directory's mtime changes whenever a file is added, removed or renamed in it,
+so an unchanged mtime also means an unchanged file count. Files rewritten in
+place (same name) do not touch the directory mtime; use force_rescan after such
+edits.
+
+Usage:
+    cache = ScanCache('/path/scan_cache.sqlite', force_rescan=False)
+    hit = cache.get(series_dir, mtime_ns)      # (n_files, fields) or None
+    cache.put(series_dir, mtime_ns, n_files, fields)
+    cache.close()
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import json
+import os
+import sqlite3
+
+# Number of puts between commits, so an interrupted run keeps most of its work
+COMMIT_EVERY = 500
+
+
+def dir_mtime(path):
+    """Directory modification time in nanoseconds."""
+    return os.stat(path).st_mtime_ns
+
+
+class ScanCache:
+    """
+    SQLite-backed cache of series directory -> (mtime, file count, header fields).
+
+    Entries are looked up by primary key as the scan goes, so memory does not grow
+    with the number of series. Lookups and writes must come from the thread that
+    opened the cache (the one collecting results).
+    """
+
+    def __init__(self, path, force_rescan=False):
+        """
+        Parameters:
+            path (str): SQLite database file, created if missing.
+            force_rescan (bool): Ignore existing entries; every series is re-read
+                and its entry overwritten.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS series ("
+            " series_dir TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " n_files INTEGER NOT NULL,"
+            " fields TEXT)"
+        )
+        if force_rescan:
+            self.conn.execute("DELETE FROM series")
+            self.conn.commit()
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, series_dir, mtime_ns):
+        """
+        Returns (n_files, fields) for an unchanged series, or None if the series
+        is new or its mtime differs from the cached one. fields is None for a
+        series that had no readable DICOM file.
+        """
+        entry = self.conn.execute(
+            "SELECT mtime_ns, n_files, fields FROM series WHERE series_dir = ?", (series_dir,)
+        ).fetchone()
+        if entry is None or entry[0] != mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1], json.loads(entry[2]) if entry[2] else None
+
+    def put(self, series_dir, mtime_ns, n_files, fields):
+        """
+        Stores the scan result of one series.
+
+        Parameters:
+            series_dir (str): Series directory (the cache key).
+            mtime_ns (int): Directory mtime taken before the directory was listed.
+            n_files (int): Number of files in the directory.
+            fields (dict or None): Extracted header fields. Values are stored as
+                strings, which is how they end up in the CSV outputs anyway.
+        """
+        if fields is not None:
+            fields = {k: (None if v is None else str(v)) for k, v in fields.items()}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO series (series_dir, mtime_ns, n_files, fields) VALUES (?, ?, ?, ?)",
+            (series_dir, mtime_ns, n_files, json.dumps(fields) if fields is not None else None)
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def commit(self):
+        """Commits pending entries (long-running callers commit after each unit of work)."""
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        """Commits pending entries and closes the database."""
+        self.commit()
+        self.conn.close()
+        print("Scan cache: %d unchanged series reused, %d (re)read" % (self.hits, self.misses))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
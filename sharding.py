@@ -0,0 +1,112 @@
+"""
+sharding.py
+
+Deterministic split of a scan across worker processes or hosts.
+
+Each worker is given a shard spec and scans only its subjects; nothing is
+shared but the shard folder the partial results are written to, so no
+coordinator is needed:
+
+    'i/n'          hash shard: subjects whose crc32(name) % n == i (0 <= i < n).
+                   Stable across hosts and runs; new subjects spread evenly.
+    'first:last'   range shard: subjects whose folder name is within
+                   [first, last] (either side may be left empty), e.g. to
+                   give each storage server the subjects it holds.
+
+A subject downloaded as an archive (SUBJ0001.zip) belongs to the same shard
+as its folder. Each shard writes two partial files to the shard folder:
+
+    <tag>.modified.csv     the modified rows of its subjects (plus Sequence_name_clean)
+    <tag>.status.csv       per-subject behavioral/examcard flags, written last
+
+The status file is the completion marker: it is removed when a shard starts
+and written (temporary file + rename) when it finishes. merge_shards.py
+combines the partial files into the usual reports.
+
+Usage:
+    subjects = [s for s in subjects if in_shard(s, '3/8')]
+    modified_file, status_file = shard_files(shard_dir, '3/8')
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import csv
+import os
+import re
+import zlib
+
+from dicom_archive import archive_stem
+
+# File name endings of the partial results of a shard
+MODIFIED_SUFFIX = '.modified.csv'
+STATUS_SUFFIX = '.status.csv'
+
+_HASH_TAG = re.compile(r'^shard-(\d+)-of-(\d+)$')
+
+
+def parse_shard(spec):
+    """
+    'i/n' -> ('hash', i, n), 'first:last' -> ('range', first, last).
+
+    Raises:
+        ValueError: for any other spec.
+    """
+    if '/' in spec:
+        index, _, total = spec.partition('/')
+        if index.isdigit() and total.isdigit() and int(index) < int(total):
+            return 'hash', int(index), int(total)
+    elif ':' in spec:
+        first, _, last = spec.partition(':')
+        return 'range', first, last
+    raise ValueError("Invalid shard %r: expected 'i/n' (0 <= i < n) or 'first:last'" % spec)
+
+
+def in_shard(name, spec):
+    """True if the subject folder (or archive) name belongs to the shard (always, without a spec)."""
+    if not spec:
+        return True
+    kind, a, b = parse_shard(spec)
+    name = archive_stem(name) or name
+    if kind == 'hash':
+        return zlib.crc32(name.encode('utf-8')) % b == a
+    return (not a or name >= a) and (not b or name <= b)
+
+
+def shard_tag(spec):
+    """File name tag of a shard: 'shard-03-of-08', 'range-SUBJ0000-SUBJ0499'."""
+    kind, a, b = parse_shard(spec)
+    if kind == 'hash':
+        width = len(str(b - 1))
+        return 'shard-%0*d-of-%0*d' % (width, a, width, b)
+    return 'range-%s-%s' % (re.sub(r'[^\w.]', '_', a), re.sub(r'[^\w.]', '_', b))
+
+
+def hash_shard(tag):
+    """(i, n) of a hash shard tag, None for a range shard."""
+    match = _HASH_TAG.match(tag)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def shard_files(shard_dir, spec):
+    """(modified rows file, status file) of a shard."""
+    tag = shard_tag(spec)
+    return os.path.join(shard_dir, tag + MODIFIED_SUFFIX), os.path.join(shard_dir, tag + STATUS_SUFFIX)
+
+
+def write_status(status, path, columns):
+    """Writes the per-subject flags of a shard (its completion marker) atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['SUBJ'] + list(columns))
+        for subj in sorted(status):
+            writer.writerow([subj] + [status[subj][column] for column in columns])
+    os.replace(tmp_path, path)
+
+
+def read_status(path):
+    """{subject: {column: int flag}} of a status file."""
+    with open(path, newline='') as f:
+        return {row.pop('SUBJ'): {column: int(value) for column, value in row.items()}
+                for row in csv.DictReader(f)}
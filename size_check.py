@@ -0,0 +1,129 @@
+"""
+size_check.py
+
+Cheap truncation check of DICOM series from the file sizes.
+
+A series passes the N_files >= expected check even when some of its files were
+cut short (an interrupted copy, a full disk). The representative header read by
+the checkers gives the image geometry, hence the pixel payload of every file of
+the series:
+
+    Rows x Columns x NumberOfFrames x SamplesPerPixel x BitsAllocated / 8
+
+One scandir pass over the series folder then gives every file's size (one stat
+per file, nothing is opened), and a file is flagged when:
+    - empty:     it has 0 bytes;
+    - truncated: it is smaller than the payload plus the 132-byte preamble, or
+                 more than SIZE_TOLERANCE below the median size of the series
+                 (headers of one series differ by a few hundred bytes at most);
+    - size:      it is more than SIZE_TOLERANCE above the median size.
+The last two apply to native transfer syntaxes only: compressed pixel data has
+no fixed size.
+
+Flagged files are suspects to check (deep validation, checksum manifest), not
+proven corrupt.
+
+Usage:
+    fields = read_header_fields(path, ROW_TAGS + SIZE_TAGS)
+    for suspect in check_sizes(series_dir, fields, suffix='.dcm'):
+        suspect['File'], suspect['Size'], suspect['Problem']
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+from statistics import median_low
+
+from dicom_archive import archive_path
+from run_metrics import count
+
+# Header fields needed for the expected payload (TransferSyntaxUID from the file meta)
+SIZE_TAGS = ['Rows', 'Columns', 'BitsAllocated', 'SamplesPerPixel', 'NumberOfFrames', 'TransferSyntaxUID']
+
+# 128-byte preamble + 'DICM': the smallest header a DICOM file can have
+MIN_HEADER = 132
+
+# Largest difference from the median file size of the series not flagged
+SIZE_TOLERANCE = 4096
+
+# Uncompressed transfer syntaxes (implicit / explicit little endian, explicit big endian)
+NATIVE_SYNTAXES = {'1.2.840.10008.1.2', '1.2.840.10008.1.2.1', '1.2.840.10008.1.2.2'}
+
+# Columns of the size check report
+SIZE_COLUMNS = ['Series_dir', 'File', 'Size', 'Expected_min', 'Median_size', 'Problem']
+
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def pixel_bytes(fields):
+    """Pixel payload of one file from the header fields, or None if the geometry is unknown."""
+    rows, columns, bits = (_int(fields.get(tag)) for tag in ('Rows', 'Columns', 'BitsAllocated'))
+    if not rows or not columns or not bits:
+        return None
+    frames = _int(fields.get('NumberOfFrames'), 1) or 1
+    samples = _int(fields.get('SamplesPerPixel'), 1) or 1
+    return rows * columns * frames * samples * bits // 8
+
+
+def is_native(fields):
+    """True unless the transfer syntax is a compressed one (files without file meta count as native)."""
+    syntax = fields.get('TransferSyntaxUID')
+    return syntax in (None, '') or str(syntax) in NATIVE_SYNTAXES
+
+
+def file_sizes(series_dir, suffix=''):
+    """{file name: size} of the files of a folder ending with suffix, in one scandir pass."""
+    archive = archive_path(series_dir)[0]
+    if archive is not None:
+        return archive.file_sizes(series_dir, suffix)
+    sizes = {}
+    with os.scandir(series_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                sizes[entry.name] = entry.stat().st_size
+    count('dirs_listed')
+    return sizes
+
+
+def check_sizes(series_dir, fields, suffix='', tolerance=SIZE_TOLERANCE):
+    """
+    Flags the files of a series whose size does not fit its header.
+
+    Parameters:
+        series_dir (str): Series folder.
+        fields (dict): Representative header fields (SIZE_TAGS).
+        suffix (str): Only files ending with it are checked (e.g. '.dcm').
+        tolerance (int): See SIZE_TOLERANCE.
+
+    Returns:
+        list of dicts (SIZE_COLUMNS), in file name order.
+    """
+    sizes = file_sizes(series_dir, suffix)
+    if not sizes:
+        return []
+    native = is_native(fields)
+    median = median_low(sizes.values())
+    minimum = None
+    if native:
+        payload = pixel_bytes(fields)
+        minimum = max(median - tolerance, payload + MIN_HEADER if payload else 0)
+
+    suspects = []
+    for name in sorted(sizes):
+        size = sizes[name]
+        if size == 0:
+            problem = 'empty'
+        elif minimum is not None and size < minimum:
+            problem = 'truncated'
+        elif native and size > median + tolerance:
+            problem = 'size'
+        else:
+            continue
+        suspects.append(dict(zip(SIZE_COLUMNS, [series_dir, name, size, minimum, median, problem])))
+    return suspects
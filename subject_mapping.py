@@ -0,0 +1,90 @@
+"""
+subject_mapping.py
+
+Indexed ANC number -> (ADBS_ID, ASSESSMENT_ID) lookup.
+
+The conversion scripts grep subject_data.txt once or twice per session folder.
+Here the table is read once into a dict, so every lookup is O(1) whatever the
+number of rows. The first column is normalized as 'for subject_data.txt' does
+(sed 's/ANC//g' | sed 's/^0*//'), so the raw ANC table and subject_data.txt can
+both be loaded. Duplicated keys are reported: the first row is kept, and a key
+whose rows disagree on the IDs is reported as ambiguous.
+
+Lookups take anything holding the ANC number (session folder 'ANC00123_MR',
+AccessionNumber 'ANC00123', '123') and use its first run of digits without
+leading zeros, as `grep -oE '[1-9][0-9]*'` in the shell scripts.
+
+Usage:
+    mapping = load_mapping('subject_data.txt')
+    ids = lookup(mapping, 'ANC00123')   # ('ADBS001', 'V1') or None
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import re
+
+DIGITS = re.compile(r'[1-9][0-9]*')
+
+
+def normalize_key(value):
+    """First-column normalization of 'for subject_data.txt': drop 'ANC' and leading zeros."""
+    return str(value).replace('ANC', '').lstrip('0')
+
+
+def mapping_key(value):
+    """Lookup key of a folder name or accession number (first digits, no leading zeros)."""
+    match = DIGITS.search(str(value)) if value is not None else None
+    return match.group(0) if match else None
+
+
+def load_mapping(text_file):
+    """
+    Loads the subject table into a dict.
+
+    Parameters:
+        text_file (str): Whitespace-separated table: ANC number, ADBS_ID, ASSESSMENT_ID.
+
+    Returns:
+        dict: normalized ANC number -> (ADBS_ID, ASSESSMENT_ID)
+    """
+    mapping = {}
+    with open(text_file) as f:
+        for line_number, line in enumerate(f, 1):
+            columns = line.replace('\r', '').split()
+            if not columns:
+                continue
+            if len(columns) < 3:
+                print('%s:%d: expected ANC number, ADBS_ID and ASSESSMENT_ID, skipped: %s'
+                      % (text_file, line_number, line.strip()))
+                continue
+
+            key = normalize_key(columns[0])
+            ids = (columns[1], columns[2])
+            if key not in mapping:
+                mapping[key] = ids
+            elif mapping[key] == ids:
+                print('%s:%d: duplicate entry for %s' % (text_file, line_number, key))
+            else:
+                print('%s:%d: ambiguous entry for %s (%s), keeping %s'
+                      % (text_file, line_number, key, ' '.join(ids), ' '.join(mapping[key])))
+    return mapping
+
+
+def lookup(mapping, value):
+    """(ADBS_ID, ASSESSMENT_ID) for a folder name / accession number, or None."""
+    return mapping.get(mapping_key(value))
+
+
+def fill_ids(record, mapping, key_column='ANCID', columns=('ADBS_ID', 'Assesment_ID')):
+    """
+    Fills blank ADBS_ID / Assesment_ID values of a checker row (dict) from the
+    mapping, looked up by the accession number (ANCID). Values read from the
+    headers are kept.
+    """
+    ids = None
+    for i, column in enumerate(columns):
+        if record[column] is None or str(record[column]).strip() == '':
+            ids = ids or lookup(mapping, record[key_column])
+            record[column] = ids[i] if ids else None
+    return record
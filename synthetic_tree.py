@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+synthetic_tree.py
+
+Synthetic DICOM trees in the three layouts the checkers read, for benchmarks
+and for trying changes without real data:
+
+- XNAT:    <root>/<SUBJ>/<n>/DICOM/*.dcm, plus behavioral/examcard resources
+           (check_dicom_completeness.py, check_dicom02.py)
+- GE:      <root>/<session>/SER<nn>/I<k> with a DIRFILE (check_dicom.py, DICOM_checker.py)
+- Phantom: <root>/<month>/<session>/SER<nn>/I<k> with a DIRFILE (Phantom_fBIRN_check)
+
+Every series gets the real expected file count of its protocol (scale < 1
+shrinks them for quick runs). Files are tiny: a minimal MR header and an 8x8
+image. Each series is written from one template built with pydicom, only the
+InstanceNumber and SOP Instance UID bytes being patched per file, so tens of
+thousands of files are written per second.
+
+Usage:
+    make_xnat_tree('/tmp/bench/xnat', n_subjects=2)
+    make_ge_tree('/tmp/bench/ge', n_sessions=2)
+    make_phantom_tree('/tmp/bench/phantom', months=['01', '02'], sessions_per_month=2)
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+import struct
+from io import BytesIO
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+# Session protocols and their expected number of files
+SESSION_PROTOCOLS = {
+    'DKI': 4480,
+    'Ref_rest_AP': 88,
+    'Ref_DWI_PA': 112,
+    'Ref_DWI_AP': 112,
+    'Ref_rest_PA': 88,
+    'Ref_TRENDS_PA': 84,
+    'Ref_TRENDS_AP': 84,
+    'T2w': 136,
+    'FLAIR': 150,
+    'DTI_6dir': 448,
+    'B0_PreScan': 0,
+    'Survey': 9,
+    'fieldmap': 176,
+    'task-rest_bold': 12100,
+    'task-trends_bold': 6720,
+    'T1w': 192,
+    'T1w_PSIR': 576,
+    'Ref_vft_AP': 88,
+    'Ref_vft_PA': 88,
+    'task-vft_bold': 4752,
+}
+
+# Daily fBIRN phantom protocols and their expected number of files
+PHANTOM_PROTOCOLS = {
+    'REST_FE_EPI_PB_VOLUME_SHIM': 6160,
+    'DKI_56slices_SHIM_PB_VOLUME': 616,
+    'Survey': 9,
+    'T1W_FFE': 2,
+    'DelRec - T1W_FFE': 58,
+}
+
+# Length of the synthetic VFT recording
+WAV_SECONDS = 2
+
+MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4'
+MEDIA_STORAGE_DIRECTORY = '1.2.840.10008.1.3.10'
+
+# Placeholders patched per file (same length as the values written)
+INSTANCE_PLACEHOLDER = '999999'
+UID_PLACEHOLDER = '1999999'
+INSTANCE_NUMBER_HEADER = b'\x20\x00\x13\x00IS'
+
+
+def series_counts(protocols, scale=1.0):
+    """
+    Files to write per protocol (at least 1 when scaled down). Protocols expecting
+    no files (B0_PreScan) are left out: they produce no series folder.
+    """
+    return {name: max(1, int(count * scale)) for name, count in protocols.items() if count}
+
+
+def series_template(header):
+    """
+    Encodes one file of a series with placeholder InstanceNumber / SOP Instance UID.
+
+    Returns:
+        (template bytes, offset of the InstanceNumber value, placeholder UID bytes)
+    """
+    uid_root = generate_uid()[:56]
+    sop_uid = '%s.%s' % (uid_root, UID_PLACEHOLDER)
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = MR_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = sop_uid
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = MR_IMAGE_STORAGE
+    ds.SOPInstanceUID = sop_uid
+    ds.Modality = 'MR'
+    for keyword, value in header.items():
+        setattr(ds, keyword, value)
+    ds.InstanceNumber = INSTANCE_PLACEHOLDER
+    ds.Rows = ds.Columns = 8
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = bytes(8 * 8 * 2)
+
+    buf = BytesIO()
+    ds.save_as(buf, enforce_file_format=True)
+    template = buf.getvalue()
+    offset = template.index(INSTANCE_NUMBER_HEADER) + 8
+    return template, offset, sop_uid.encode('ascii')
+
+
+def write_series(folder, names, header):
+    """
+    Writes one series: one file per name in folder, InstanceNumber 1..n.
+
+    Parameters:
+        folder (str): Series folder (created).
+        names (list): File names, in instance order.
+        header (dict): Keyword -> value written in every file (ProtocolName, ...).
+    """
+    os.makedirs(folder, exist_ok=True)
+    header = dict(header, SeriesInstanceUID=generate_uid())
+    template, offset, placeholder = series_template(header)
+    width = len(INSTANCE_PLACEHOLDER)
+    uid_root = placeholder[:-len(UID_PLACEHOLDER)]
+    for number, name in enumerate(names, 1):
+        data = bytearray(template)
+        data[offset:offset + width] = str(number).rjust(width).encode('ascii')
+        data = bytes(data).replace(placeholder, uid_root + b'1%06d' % number)
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(data)
+
+
+def _element(group, element, vr, value):
+    """Explicit VR little endian encoding of a short-form element (value padded to even length)."""
+    if isinstance(value, int):
+        value = struct.pack('<H' if vr == 'US' else '<I', value)
+    else:
+        value = value.encode('ascii')
+        if len(value) % 2:
+            value += b'\0' if vr == 'UI' else b' '
+    return struct.pack('<HH2sH', group, element, vr.encode('ascii'), len(value)) + value
+
+
+def _record(record_type, elements, next_offset=0, lower_offset=0):
+    """One directory record item: the record links followed by its (tag-ordered) elements."""
+    body = (_element(0x0004, 0x1400, 'UL', next_offset)
+            + _element(0x0004, 0x1410, 'US', 0xFFFF)
+            + _element(0x0004, 0x1420, 'UL', lower_offset)
+            + _element(0x0004, 0x1430, 'CS', record_type)
+            + b''.join(_element(*e) for e in elements))
+    return struct.pack('<HHI', 0xFFFE, 0xE000, len(body)) + body
+
+
+def write_dicomdir(session_path, series, dirfile='DIRFILE'):
+    """
+    Writes a DICOMDIR for a session: one patient, one study and one series record
+    per (folder, protocol, file names) entry, with one image record per file.
+
+    The header is written by pydicom; the records are encoded here, since writing
+    tens of thousands of records through pydicom takes tens of seconds.
+    """
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = MEDIA_STORAGE_DIRECTORY
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.FileSetID = ''
+    ds.OffsetOfTheFirstDirectoryRecordOfTheRootDirectoryEntity = 0
+    ds.OffsetOfTheLastDirectoryRecordOfTheRootDirectoryEntity = 0
+    ds.FileSetConsistencyFlag = 0
+
+    # Records as (type, elements, index of the next record, index of the first lower-level record)
+    records = [('PATIENT', [(0x0010, 0x0020, 'LO', os.path.basename(session_path))], None, 1),
+               ('STUDY', [(0x0020, 0x000D, 'UI', generate_uid())], None, None)]
+    series_indexes = []
+    for folder, protocol, names in series:
+        series_indexes.append(len(records))
+        records.append(('SERIES', [(0x0008, 0x0060, 'CS', 'MR'), (0x0008, 0x103E, 'LO', protocol),
+                                   (0x0020, 0x000E, 'UI', generate_uid())],
+                        None, len(records) + 1 if names else None))
+        for i, name in enumerate(names):
+            records.append(('IMAGE', [(0x0004, 0x1500, 'CS', '%s\\%s' % (folder, name))],
+                            len(records) + 1 if i + 1 < len(names) else None, None))
+    if series_indexes:
+        records[1] = records[1][:3] + (series_indexes[0],)
+    for index, following in zip(series_indexes, series_indexes[1:]):
+        records[index] = records[index][:2] + (following,) + records[index][3:]
+
+    # Offsets are positions from the start of the file; link fields have a fixed
+    # size, so the lengths (and offsets) do not depend on the values
+    header = BytesIO()
+    ds.save_as(header, enforce_file_format=True)
+    offsets = []
+    position = len(header.getvalue()) + 12
+    for record_type, elements, _, _ in records:
+        offsets.append(position)
+        position += len(_record(record_type, elements))
+
+    ds.OffsetOfTheFirstDirectoryRecordOfTheRootDirectoryEntity = offsets[0]
+    ds.OffsetOfTheLastDirectoryRecordOfTheRootDirectoryEntity = offsets[0]
+    header = BytesIO()
+    ds.save_as(header, enforce_file_format=True)
+
+    with open(os.path.join(session_path, dirfile), 'wb') as f:
+        f.write(header.getvalue())
+        # DirectoryRecordSequence, undefined length
+        f.write(struct.pack('<HH2sHI', 0x0004, 0x1220, b'SQ', 0, 0xFFFFFFFF))
+        for record_type, elements, next_index, lower_index in records:
+            f.write(_record(record_type, elements,
+                            offsets[next_index] if next_index is not None else 0,
+                            offsets[lower_index] if lower_index is not None else 0))
+        f.write(struct.pack('<HHI', 0xFFFE, 0xE0DD, 0))
+
+
+def session_header(number, date='20250101'):
+    """Session-level header values of synthetic subject number."""
+    return {
+        'AccessionNumber': 'ANC%05d' % number,
+        'PatientName': 'SYNTHETIC^%04d' % number,
+        'PatientID': 'SYN%04d' % number,
+        'StudyDescription': 'ADBS%04d' % number,
+        'StudyComments': '101',
+        'StudyDate': date,
+        'PerformedProcedureStepStartDate': date,
+    }
+
+
+def make_ge_session(session_path, header, protocols, scale=1.0, dirfile=True):
+    """Writes one SER<nn>/I<k> session; returns the number of files written."""
+    series = []
+    for index, (protocol, count) in enumerate(series_counts(protocols, scale).items()):
+        folder = 'SER%02d' % index
+        names = ['I%d' % k for k in range(1, count + 1)]
+        write_series(os.path.join(session_path, folder), names,
+                     dict(header, ProtocolName=protocol, SeriesNumber=index + 1))
+        series.append((folder, protocol, names))
+    if dirfile:
+        write_dicomdir(session_path, series)
+    return sum(len(names) for _, _, names in series)
+
+
+def silent_wav(seconds, rate=8000):
+    """16-bit mono PCM WAV file of silence (behavioral recordings that pass validation)."""
+    data = bytes(2 * int(seconds * rate))
+    fmt = struct.pack('<HHIIHH', 1, 1, rate, 2 * rate, 2, 16)
+    return (b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+            + b'data' + struct.pack('<I', len(data)) + data)
+
+
+def make_xnat_tree(root, n_subjects, scale=1.0, protocols=SESSION_PROTOCOLS, behavioral=True):
+    """
+    XNAT export layout: <root>/SUBJ<nnnn>/<n>/DICOM/<k>.dcm per series, plus the
+    VFT/TRENDS behavioral files and examcards under a resources folder.
+
+    Returns:
+        int: number of DICOM files written.
+    """
+    total = 0
+    for number in range(1, n_subjects + 1):
+        subj_path = os.path.join(root, 'SUBJ%04d' % number)
+        header = session_header(number)
+        for index, (protocol, count) in enumerate(series_counts(protocols, scale).items(), 1):
+            names = ['%06d.dcm' % k for k in range(1, count + 1)]
+            write_series(os.path.join(subj_path, str(index), 'DICOM'), names,
+                         dict(header, ProtocolName=protocol, SeriesNumber=index))
+            total += count
+
+        if behavioral:
+            resources = os.path.join(subj_path, 'Behavioral', 'resources')
+            vft = os.path.join(resources, 'Behavioral%20data-VFT', 'VFT')
+            trends = os.path.join(resources, 'Behavioral%20data-TRENDS', 'TRENDS')
+            for folder in (vft, trends, os.path.join(resources, 'Examcards')):
+                os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(vft, 'VFT_001.wav'), 'wb') as f:
+                f.write(silent_wav(WAV_SECONDS))
+            for folder in (vft, trends):
+                with open(os.path.join(folder, 'export.txt'), 'w') as f:
+                    f.write('Subject\tTrial\tResponse\n%s\t1\t1\n' % header['PatientID'])
+    return total
+
+
+def make_ge_tree(root, n_sessions, scale=1.0, protocols=SESSION_PROTOCOLS, dirfile=True):
+    """
+    GE-style export layout: <root>/ANC<nnnnn>/SER<nn>/I<k> with a DIRFILE per session.
+
+    Returns:
+        int: number of DICOM files written.
+    """
+    return sum(make_ge_session(os.path.join(root, 'ANC%05d' % number), session_header(number),
+                               protocols, scale, dirfile)
+               for number in range(1, n_sessions + 1))
+
+
+def make_phantom_tree(root, months, sessions_per_month, scale=1.0, protocols=PHANTOM_PROTOCOLS,
+                      dirfile=True, year='2025'):
+    """
+    Phantom layout: <root>/<month>/<session>/SER<nn>/I<k> with a DIRFILE per session,
+    one session per day.
+
+    Returns:
+        int: number of DICOM files written.
+    """
+    total = 0
+    for month in months:
+        for day in range(1, sessions_per_month + 1):
+            date = '%s%s%02d' % (year, month, day)
+            header = dict(session_header(day, date), PatientName='FBIRN^PHANTOM')
+            total += make_ge_session(os.path.join(root, month, 'FBIRN_%s' % date), header,
+                                     protocols, scale, dirfile)
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a synthetic DICOM tree')
+    parser.add_argument('layout', choices=['xnat', 'ge', 'phantom'])
+    parser.add_argument('root')
+    parser.add_argument('--sessions', type=int, default=1, help='subjects / sessions (per month for phantom)')
+    parser.add_argument('--months', default='01', help='comma-separated months (phantom)')
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the expected file counts')
+    args = parser.parse_args()
+
+    if args.layout == 'xnat':
+        n_files = make_xnat_tree(args.root, args.sessions, args.scale)
+    elif args.layout == 'ge':
+        n_files = make_ge_tree(args.root, args.sessions, args.scale)
+    else:
+        n_files = make_phantom_tree(args.root, args.months.split(','), args.sessions, args.scale)
+    print('%d DICOM files written under %s' % (n_files, args.root))
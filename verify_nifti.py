@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+verify_nifti.py
+
+Post-conversion check of the BIDS tree: does every NIfTI hold all the images of
+its source DICOM series?
+
+A task-rest_bold run converted from a series with missing files, or cut short
+by dcm2niix, is a valid NIfTI with fewer volumes. Only the NIfTI headers are
+read (the first 348 / 540 bytes, through gzip for .nii.gz), on a pool of
+readers, so a whole dataset is verified in seconds:
+
+- dim[] gives the slices and volumes of every run; a .nii file shorter than
+  vox_offset + data size is truncated.
+- Each run is linked to its source series through the per-series conversion
+  state of convert_sessions.py (STATE_FILE). The images of all the runs of a
+  series (e.g. the magnitude and phase runs of a fieldmap) must add up to the
+  N_files of the series, taken from check_dicom.py's modified CSV (keyed by
+  the same ANC session and SERxx folder as the conversion), or from the
+  series fingerprint when the CSV has no row for it (with a warning).
+- The images of the series must reach EXPECTED_FILES of its sequence, hence
+  the expected volumes of 4D runs (expected files / slices).
+Multi-frame sources (fewer files than images) are reported without comparing
+counts. Runs not produced by a tracked conversion get their header checks
+only ('unchecked').
+
+Output: one row per run (VERIFY_COLUMNS) with Status pass / fail / unchecked.
+
+Usage:
+    python verify_nifti.py [bids_root] [--state STATE_FILE] [--modified MODIFIED_CSV] [--out verify.csv]
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import gzip
+import os
+import struct
+from collections import defaultdict
+
+import pandas as pd
+
+import check_dicom_completeness as checker
+import convert_sessions
+from csv_stream import stream_csv
+from run_metrics import count, map_tasks
+from worker_pool import default_workers
+
+# ----------------------------- Configuration -------------------------------- #
+
+# BIDS tree and conversion state (None: convert_sessions.py's OUTPUT_PATH and
+# STATE_FILE, read at call time)
+BIDS_ROOT = None
+STATE_FILE = None
+
+# check_dicom.py's modified data (its modified_data_file), with the N_files of
+# every (ANC session, SERxx) series; None: fingerprint counts only
+MODIFIED_CSV = '/DICOM_information/modified/modified_data.csv'
+
+# Per-run verification table (None: VERIFY_NAME in the BIDS root that was verified)
+VERIFY_CSV = None
+VERIFY_NAME = 'nifti_verification.csv'
+
+# Header reader pool
+N_WORKERS = default_workers()
+POOL_KIND = 'thread'
+
+NIFTI_EXTENSIONS = ('.nii', '.nii.gz')
+
+# Columns of the verification table
+VERIFY_COLUMNS = ['Session', 'Series_dir', 'Sequence', 'File', 'Dims', 'Slices', 'Volumes', 'Series_images',
+                  'N_files', 'Expected_files', 'Expected_volumes', 'Status', 'Problem']
+
+# ----------------------------- NIfTI headers --------------------------------- #
+
+# sizeof_hdr -> (dim format, dim offset, bitpix format, bitpix offset, vox_offset format, vox_offset offset)
+NIFTI_LAYOUTS = {
+    348: ('8h', 40, 'h', 72, 'f', 108),   # NIfTI-1
+    540: ('8q', 16, 'h', 14, 'q', 168),   # NIfTI-2
+}
+
+
+def read_nifti_header(path):
+    """
+    dim, bitpix and vox_offset of a NIfTI-1 / NIfTI-2 file (.nii or .nii.gz),
+    from its header bytes only.
+
+    Returns:
+        dict 'dims' (list of the dim[1..dim[0]] sizes), 'bitpix', 'vox_offset'.
+
+    Raises:
+        ValueError: if the file does not start with a NIfTI header.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        header = f.read(540)
+    count('files_opened')
+
+    for endian in '<>':
+        if len(header) >= 4 and struct.unpack_from(endian + 'i', header)[0] in NIFTI_LAYOUTS:
+            break
+    else:
+        raise ValueError('not a NIfTI header')
+    size = struct.unpack_from(endian + 'i', header)[0]
+    if len(header) < size:
+        raise ValueError('header cut short (%d bytes)' % len(header))
+    dim_format, dim_offset, bitpix_format, bitpix_offset, vox_format, vox_offset = NIFTI_LAYOUTS[size]
+    dim = struct.unpack_from(endian + dim_format, header, dim_offset)
+    if not 1 <= dim[0] <= 7:
+        raise ValueError('invalid dim[0] = %d' % dim[0])
+    return {'dims': list(dim[1:dim[0] + 1]),
+            'bitpix': struct.unpack_from(endian + bitpix_format, header, bitpix_offset)[0],
+            'vox_offset': int(struct.unpack_from(endian + vox_format, header, vox_offset)[0])}
+
+
+def _read_task(path):
+    """Pool task: path -> (path, header fields + problem, or error)."""
+    try:
+        fields = read_nifti_header(path)
+    except (OSError, ValueError, EOFError) as e:
+        return path, None, 'unreadable: %s' % e
+    dims = fields['dims'] + [1, 1, 1]
+    fields['slices'] = dims[2]
+    fields['volumes'] = 1
+    for n in fields['dims'][3:]:
+        fields['volumes'] *= n
+    problem = None
+    if path.endswith('.nii'):
+        data_bytes = fields['slices'] * fields['volumes'] * dims[0] * dims[1] * fields['bitpix'] // 8
+        size = os.stat(path).st_size
+        if size < fields['vox_offset'] + data_bytes:
+            problem = 'truncated: %d of %d bytes' % (size, fields['vox_offset'] + data_bytes)
+    return path, fields, problem
+
+
+def list_nifti(root):
+    """Every NIfTI file under root (hidden folders, e.g. conversion staging, skipped)."""
+    paths = []
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        count('dirs_listed')
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(NIFTI_EXTENSIONS):
+                    paths.append(entry.path)
+    return sorted(paths)
+
+# ------------------------------ Source series -------------------------------- #
+
+
+def source_series(state):
+    """
+    {NIfTI path: (session, series folder, fingerprint file count)} of every run
+    recorded in the conversion state.
+    """
+    sources = {}
+    for session, record in state.items():
+        for relative, entry in (record.get('series') or {}).items():
+            for destination in entry['outputs']:
+                if destination.endswith(NIFTI_EXTENSIONS):
+                    path = os.path.normpath(os.path.join(record['output'], destination))
+                    sources[path] = (session, relative, entry['fingerprint'][1])
+    return sources
+
+
+def load_series_counts(modified_csv):
+    """{(SUBJ, Seq): (N_files, cleaned sequence name)} from check_dicom.py's modified CSV."""
+    if not modified_csv:
+        return {}
+    if not os.path.exists(modified_csv):
+        print('[!] %s not found: N_files from the conversion fingerprints, EXPECTED_FILES not checked'
+              % modified_csv)
+        return {}
+    data = pd.read_csv(modified_csv, usecols=['SUBJ', 'Seq', 'Sequence_name', 'N_files'],
+                       dtype={'SUBJ': str, 'Seq': str, 'Sequence_name': str})
+    counts = {}
+    for subj, seq, name, n_files in data.itertuples(index=False):
+        clean = checker.WIP_PREFIX.sub('', name).lower() if isinstance(name, str) else None
+        counts[(subj, seq)] = (None if pd.isna(n_files) else int(n_files), clean)
+    return counts
+
+# ------------------------------- Verification -------------------------------- #
+
+
+def _series_problems(runs, n_files, expected):
+    """Problems shared by the runs of one series: (problem or None, multi-frame flag)."""
+    images = sum(run['slices'] * run['volumes'] for run in runs)
+    if n_files and images > n_files and images % n_files == 0:
+        return None, True
+    problems = []
+    if n_files is not None and images != n_files:
+        problems.append('%d images from %d files' % (images, n_files))
+    if expected and images < expected:
+        problems.append('%d images, expected %d' % (images, expected))
+    return '; '.join(problems) or None, False
+
+
+def verify_tree(bids_root=None, state_file=None, modified_csv=None, expected_files=None, workers=None, kind=None):
+    """
+    Verifies every NIfTI of a BIDS tree against its source series. The arguments
+    left to None take the module settings (BIDS_ROOT, STATE_FILE, MODIFIED_CSV,
+    EXPECTED_FILES, N_WORKERS, POOL_KIND) at call time.
+
+    Returns:
+        list of dicts (VERIFY_COLUMNS), in file order.
+    """
+    bids_root = bids_root or BIDS_ROOT or convert_sessions.OUTPUT_PATH
+    state_file = state_file or STATE_FILE or convert_sessions.STATE_FILE
+    modified_csv = MODIFIED_CSV if modified_csv is None else modified_csv
+    expected_files = checker.EXPECTED_FILES if expected_files is None else expected_files
+    workers = N_WORKERS if workers is None else workers
+    kind = POOL_KIND if kind is None else kind
+    sources = source_series(convert_sessions.load_state(state_file))
+    series_counts = load_series_counts(modified_csv)
+
+    headers = {path: (fields, problem) for path, fields, problem
+               in map_tasks(_read_task, list_nifti(bids_root), workers, kind)}
+    # Runs recorded in the state but missing from the tree
+    for path in sources:
+        if path not in headers:
+            headers[path] = (None, 'missing NIfTI')
+
+    by_series = defaultdict(list)
+    for path in headers:
+        if path in sources:
+            by_series[sources[path][:2]].append(path)
+
+    rows = {}
+    unmatched = []
+    for (session, relative), paths in by_series.items():
+        key = (session, relative.split(os.sep)[0])
+        if key not in series_counts:
+            unmatched.append('%s/%s' % key)
+        n_files, sequence = series_counts.get(key, (sources[paths[0]][2], None))
+        expected = expected_files.get(sequence)
+        readable = [headers[path][0] for path in paths if headers[path][0] is not None]
+        series_problem, multi_frame = _series_problems(readable, n_files, expected)
+        images = sum(run['slices'] * run['volumes'] for run in readable)
+        for path in paths:
+            fields, problem = headers[path]
+            if len(readable) < len(paths) and problem is None:
+                problem = 'other runs of the series unreadable'
+            problems = [p for p in (problem, series_problem) if p]
+            row = {'Session': session, 'Series_dir': relative, 'Sequence': sequence,
+                   'Series_images': images, 'N_files': n_files, 'Expected_files': expected,
+                   'Status': 'fail' if problems else 'pass',
+                   'Problem': '; '.join(problems) or ('multi-frame source, counts not compared'
+                                                      if multi_frame else None)}
+            if fields is not None and expected and len(fields['dims']) >= 4:
+                row['Expected_volumes'] = expected // fields['slices']
+            rows[path] = row
+    if series_counts and unmatched:
+        print('[!] %d of %d converted series have no row in %s (EXPECTED_FILES not checked): %s'
+              % (len(unmatched), len(by_series), modified_csv, ', '.join(sorted(unmatched)[:10])
+                 + (' ...' if len(unmatched) > 10 else '')))
+
+    results = []
+    for path in sorted(headers):
+        fields, problem = headers[path]
+        row = rows.get(path) or {'Status': 'fail' if problem else 'unchecked', 'Problem': problem}
+        row['File'] = os.path.relpath(path, bids_root)
+        if fields is not None:
+            row.update(Dims='x'.join(str(n) for n in fields['dims']),
+                       Slices=fields['slices'], Volumes=fields['volumes'])
+        results.append(row)
+    return results
+
+
+def write_verification(results, path=None, bids_root=None):
+    """
+    Writes the verification table (path, VERIFY_CSV, or VERIFY_NAME in the BIDS
+    root) and prints the pass / fail counts.
+    """
+    path = path or VERIFY_CSV or os.path.join(bids_root or BIDS_ROOT or convert_sessions.OUTPUT_PATH, VERIFY_NAME)
+    for _ in stream_csv(results, path, VERIFY_COLUMNS):
+        pass
+    failed = sum(row['Status'] == 'fail' for row in results)
+    unchecked = sum(row['Status'] == 'unchecked' for row in results)
+    print("%s NIfTI verification saved: %s (%d runs, %d failed, %d unchecked)"
+          % ('[✓]' if not failed else '[!]', path, len(results), failed, unchecked))
+    return failed
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Verify converted NIfTI runs against their source DICOM series')
+    parser.add_argument('bids_root', nargs='?', help="BIDS tree (default BIDS_ROOT, convert_sessions' OUTPUT_PATH)")
+    parser.add_argument('--state', help='conversion state of convert_sessions.py (default STATE_FILE)')
+    parser.add_argument('--modified', help="check_dicom.py's modified CSV (N_files, default MODIFIED_CSV)")
+    parser.add_argument('--out', help='verification table (default VERIFY_NAME in the BIDS root)')
+    parser.add_argument('--workers', type=int, help='header readers (default N_WORKERS)')
+    args = parser.parse_args()
+
+    results = verify_tree(args.bids_root, args.state, args.modified, workers=args.workers)
+    sys.exit(1 if write_verification(results, args.out, args.bids_root) else 0)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+watch_sessions.py
+
+Real-time watch mode for the incoming XNAT export root.
+
+Instead of running check_dicom_completeness.py by hand over the whole tree, this
+watcher runs continuously and checks each session (subject folder) on its own as
+soon as it has finished arriving:
+
+- Changes are picked up from filesystem events (inotify through the optional
+  'watchdog' package). Without watchdog, or with USE_INOTIFY = False, the tree
+  is polled every POLL_INTERVAL seconds; only directories whose mtime changed
+  are listed again, so a poll costs one stat per directory, not per file.
+- A changed session is debounced: it is checked once its per-series file
+  counts have not changed (and no event arrived) for DEBOUNCE_SECONDS.
+  Sessions delivered as archives (<SUBJ>.zip, .tar...) are counted from the
+  archive index (dicom_archive.py) once the archive can be read.
+- The check is the same walk -> extract -> classify pipeline and EXPECTED_FILES
+  rules as check_dicom_completeness.py, run on that session only. Its rows are
+  appended to WATCH_MODIFIED_CSV and its missing-sequence row to WATCH_MISSING_CSV.
+- With CONVERT set, the session is then converted to BIDS in the background
+  (convert_sessions.py configuration, job state and logs).
+
+Stop with Ctrl+C.
+
+Author: Deepankan
+Last Updated: 2025-08-04
+"""
+
+import os
+import queue
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import check_dicom_completeness as checker
+import convert_sessions
+from completeness import SubjectSummary
+from csv_stream import stream_csv
+from dicom_archive import archive_path, archive_stem
+from scan_cache import ScanCache
+from subject_mapping import load_mapping
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# ----------------------------- Configuration -------------------------------- #
+
+# Incoming root (one folder per session) and the reports the checks are appended to
+WATCH_ROOT = checker.ROOT_PATH
+WATCH_MODIFIED_CSV = '/mnt/f/Deepankan/XNAT/output/watch_modified.csv'
+WATCH_MISSING_CSV = '/mnt/f/Deepankan/XNAT/output/watch_missing.csv'
+
+# Use filesystem events when watchdog is installed; otherwise poll
+USE_INOTIFY = True
+POLL_INTERVAL = 10
+
+# A session is checked once its file counts are stable for this long (seconds)
+DEBOUNCE_SECONDS = 120
+
+# Check the sessions already present when the watcher starts
+CHECK_EXISTING = False
+
+# Start the BIDS conversion of a checked session (see convert_sessions.py);
+# with CONVERT_COMPLETE_ONLY only sessions without missing sequences are converted
+CONVERT = False
+CONVERT_COMPLETE_ONLY = True
+
+# ------------------------------ Change sources ------------------------------- #
+
+# watchdog event types that do not modify anything
+READ_EVENTS = {'opened', 'closed_no_write'}
+
+
+def session_of(root, path):
+    """Session (top-level folder under root) a path belongs to, or None."""
+    rel = os.path.relpath(path, root)
+    if rel == '.' or rel.startswith('..'):
+        return None
+    return rel.split(os.sep, 1)[0]
+
+
+class EventSource(FileSystemEventHandler):
+    """Collects the sessions touched by filesystem events (inotify via watchdog)."""
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+        self.events = queue.Queue()
+        self.observer = Observer()
+        self.observer.schedule(self, root, recursive=True)
+        self.observer.start()
+
+    def on_any_event(self, event):
+        # Reading the files (including our own checks) is not a change
+        if event.event_type in READ_EVENTS:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            session = session_of(self.root, path) if path else None
+            if session:
+                self.events.put(session)
+
+    def changed(self):
+        """Sessions with events since the last call."""
+        sessions = set()
+        while not self.events.empty():
+            sessions.add(self.events.get_nowait())
+        return sessions
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class DirectoryPoller:
+    """
+    Polling fallback: reports the sessions in which a directory was added,
+    removed or changed since the last poll, and the session archives whose size
+    or mtime changed. Directory listings are kept and a directory is only
+    listed again when its mtime changed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.dirs = {}
+        self.archives = {}
+
+    def _scan(self, path):
+        """Re-stats path and its subdirectories; True if anything changed."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self.dirs.pop(path, None) is not None
+
+        known = self.dirs.get(path)
+        changed = known is None or known[0] != mtime
+        if changed:
+            subdirs = [entry.path for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False)]
+            self.dirs[path] = (mtime, subdirs)
+        else:
+            subdirs = known[1]
+
+        for subdir in subdirs:
+            changed = self._scan(subdir) or changed
+        return changed
+
+    def changed(self):
+        """Sessions changed since the last call (every session on the first call)."""
+        sessions, archives = [], {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                sessions.append(entry.path)
+            elif archive_stem(entry.name) and entry.is_file():
+                stat = entry.stat()
+                archives[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        changed = {os.path.basename(path) for path in sessions if self._scan(path)}
+        changed.update(name for name, signature in archives.items() if self.archives.get(name) != signature)
+        self.archives = archives
+        return changed
+
+    def stop(self):
+        pass
+
+# ------------------------------- Session check ------------------------------- #
+
+
+def session_counts(root, subj):
+    """
+    Number of files per series folder of a session (debounce signature), None if
+    gone. A session archive (<SUBJ>.zip, .tar...) is counted from its index; an
+    archive that cannot be indexed yet (still being written) is skipped until
+    it changes again.
+    """
+    subj_path = os.path.join(root, subj)
+    counts = {}
+    if archive_stem(subj):
+        try:
+            archive = archive_path(subj_path)[0]
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+            print("[!] %s: archive not readable yet (%s), skipped until it changes" % (subj, e))
+            return None
+        if archive is None:
+            return None
+        for name in archive.listdir(subj_path):
+            dicom_dir = os.path.join(subj_path, name, "DICOM")
+            if archive.isdir(os.path.join(subj_path, name)):
+                counts[name] = len(archive.files(dicom_dir))
+        return counts
+    try:
+        for entry in os.scandir(subj_path):
+            if entry.is_dir():
+                dicom_dir = os.path.join(entry.path, "DICOM")
+                counts[entry.name] = sum(1 for _ in os.scandir(dicom_dir)) if os.path.isdir(dicom_dir) else 0
+    except OSError:
+        return None
+    return counts
+
+
+def check_session(root, subj, cache=None, mapping=None):
+    """
+    Runs the completeness check on one session and appends the results to the
+    watch reports.
+
+    Returns:
+        str: the session's 'Missing Sequences' ('NIL' when complete), or None if
+        the session has no readable series.
+    """
+    start = time.time()
+    _, series, status = checker.list_subject(root, subj)
+    rows = checker.classify(checker.extract(series, cache, checker.N_WORKERS, checker.POOL_KIND), mapping)
+
+    summary = SubjectSummary(checker.EXPECTED_FILES)
+    for row in stream_csv(rows, WATCH_MODIFIED_CSV, checker.MODIFIED_COLUMNS, append=True):
+        summary.add(row)
+    if cache:
+        cache.commit()
+    if not summary.subjects:
+        print("[!] %s: no readable series" % subj)
+        return None
+
+    missing_df = checker.build_missing_report(summary, {subj: status})
+    new_file = not os.path.exists(WATCH_MISSING_CSV) or os.path.getsize(WATCH_MISSING_CSV) == 0
+    missing_df.to_csv(WATCH_MISSING_CSV, mode='a', header=new_file, index=False)
+
+    missing = missing_df['Missing Sequences'].iloc[0]
+    print("[✓] %s checked in %.1fs: %d series, missing: %s"
+          % (subj, time.time() - start, len(series), missing))
+    return missing
+
+# -------------------------------- Watch loop --------------------------------- #
+
+
+def watch(root=WATCH_ROOT):
+    """Watches root until interrupted, checking (and converting) settled sessions."""
+    use_events = USE_INOTIFY and Observer is not None
+    source = EventSource(root) if use_events else DirectoryPoller(root)
+    print("Watching %s (%s, debounce %ds)"
+          % (root, 'filesystem events' if use_events else 'polling every %ds' % POLL_INTERVAL, DEBOUNCE_SECONDS))
+
+    cache = ScanCache(checker.CACHE_FILE, checker.FORCE_RESCAN) if checker.CACHE_FILE else None
+    mapping = load_mapping(checker.SUBJECT_TABLE) if checker.SUBJECT_TABLE else None
+
+    converter = conversion_mapping = state = None
+    conversions = {}
+    if CONVERT:
+        os.makedirs(convert_sessions.LOG_DIR, exist_ok=True)
+        converter = ThreadPoolExecutor(max_workers=convert_sessions.N_JOBS)
+        conversion_mapping = load_mapping(convert_sessions.TEXT_FILE)
+        state = convert_sessions.load_state(convert_sessions.STATE_FILE)
+
+    # Session -> (file counts, time of the last change)
+    pending = {}
+    initial = source.changed() if not use_events else set(
+        s for s in os.listdir(root) if os.path.isdir(os.path.join(root, s)) or archive_stem(s))
+    if CHECK_EXISTING:
+        pending.update((subj, (None, 0)) for subj in initial)
+
+    try:
+        while True:
+            now = time.monotonic()
+            for subj in source.changed():
+                pending[subj] = (pending.get(subj, (None, 0))[0], now)
+
+            for subj, (counts, since) in list(pending.items()):
+                current = session_counts(root, subj)
+                if current is None:
+                    del pending[subj]
+                elif current != counts:
+                    pending[subj] = (current, now)
+                elif now - since >= DEBOUNCE_SECONDS:
+                    del pending[subj]
+                    missing = check_session(root, subj, cache, mapping)
+                    if converter and missing is not None and (missing == 'NIL' or not CONVERT_COMPLETE_ONLY):
+                        job = convert_sessions.plan_session(root, subj, conversion_mapping,
+                                                            convert_sessions.OUTPUT_PATH, state)
+                        if job is not None and subj not in conversions:
+                            print("[→] Converting %s to %s" % (subj, job['output']))
+                            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+                            conversions[subj] = converter.submit(convert_sessions.convert_session, job)
+
+            # Record finished conversions
+            for subj, future in list(conversions.items()):
+                if future.done():
+                    record = future.result()
+                    state[subj] = record
+                    convert_sessions.save_state(state, convert_sessions.STATE_FILE)
+                    print("[%s] Conversion of %s: %s" % ('✓' if record['status'] == 'done' else '!',
+                                                         subj, record['error'] or record['output']))
+                    del conversions[subj]
+
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print("Stopping the watcher")
+    finally:
+        source.stop()
+        if converter:
+            converter.shutdown(wait=True)
+            for subj, future in conversions.items():
+                state[subj] = future.result()
+            convert_sessions.save_state(state, convert_sessions.STATE_FILE)
+        if cache:
+            cache.close()
+
+
+if __name__ == '__main__':
+    watch()